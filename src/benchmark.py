@@ -0,0 +1,300 @@
+"""
+Benchmarks of the solver. Run from the src directory:
+
+python benchmark.py queue [<path_to_map_file> ...]
+
+python benchmark.py suite [--maps <glob>] [--strategies <strategies>] [--trials <number>]
+	[-t <time_in_second>] [--output <path_to_file>] [--baseline <path_to_file>]
+	[--threshold <metric>=<fraction> ...]
+
+Where:
+
+queue: Time the heap and the bucket priority queues, alone and while solving the given maps.
+
+suite: Solve every map with every strategy, a few times each, and write the nodes visited, nodes
+per second, time, solution length and peak memory to a JSON file. Each solve runs in a fresh
+process. With a baseline file written by an earlier run, list the regressions and exit with
+status 1 if there is any.
+
+[--maps <glob>]: The maps of the suite. Default: maps/*.txt
+
+[--strategies <strategies>]: Comma separated algorithm[:heuristic[:weight]], like --portfolio.
+
+[--trials <number>]: Number of solves per map and strategy, the median time is kept. Default: 3
+
+[-t <time_in_second>]: Time limit of each solve. Default: 60
+
+[--output <path_to_file>]: Where to write the results. Default: benchmark.json
+
+[--baseline <path_to_file>]: Results to compare with.
+
+[--threshold <metric>=<fraction>]: Largest allowed change of a metric before it counts as a
+regression, e.g. --threshold time=0.25 allows 25% slower. Can be given several times.
+Defaults: time=0.2, nodes=0.05, nodes_per_second=0.2, length=0, peak_memory=0.2
+"""
+
+import sys
+import os
+import time
+import heapq
+import random
+import json
+import glob
+import statistics
+from concurrent.futures import ProcessPoolExecutor
+
+from main import (
+    BucketQueue,
+    Node,
+    SokobanMap,
+    build_tree,
+    parse_search_options,
+    solve_map,
+    strategy_options,
+)
+
+
+"""
+Strategies of the suite when none are given.
+"""
+SUITE_STRATEGIES = (
+    "astar:combined,astar:box_shelf,push:box_shelf,push:push_distance,push:matching,bidirectional"
+)
+
+"""
+Largest allowed relative change of each metric, see compare. For nodes_per_second a drop is a
+regression, for the others a rise.
+"""
+DEFAULT_THRESHOLDS = {
+    "time": 0.2,
+    "nodes": 0.05,
+    "nodes_per_second": 0.2,
+    "length": 0,
+    "peak_memory": 0.2,
+}
+
+# Solves faster than this (in seconds) are too noisy to compare their time and speed
+MIN_TIME = 0.1
+
+
+def time_queue_operations(count: int = 200000, seed: int = 0) -> dict:
+    """
+    Push count nodes with random integer g and h, interleaved with pops, then pop everything.
+    Return the time taken in seconds by heapq and by BucketQueue.
+    """
+    rng = random.Random(seed)
+    state = SokobanMap("maps/micro1.txt").build_state()
+    nodes = []
+    for _ in range(count):
+        node = Node(state)
+        node.g = rng.randrange(200)
+        node.h = rng.randrange(50)
+        nodes.append(node)
+
+    times = {}
+
+    t1 = time.time()
+    heap = []
+    for i, node in enumerate(nodes):
+        heapq.heappush(heap, node)
+        if i % 3 == 0:
+            heapq.heappop(heap)
+    while heap:
+        heapq.heappop(heap)
+    times["heap"] = time.time() - t1
+
+    t1 = time.time()
+    queue = BucketQueue()
+    for i, node in enumerate(nodes):
+        queue.insert(node)
+        if i % 3 == 0:
+            queue.pop()
+    while queue:
+        queue.pop()
+    times["bucket"] = time.time() - t1
+
+    return times
+
+
+def time_queue_search(map_path: str, search: str = "push") -> dict:
+    """
+    Solve the map with both queues. Return (time taken in seconds, visited nodes, solution
+    cost) of each.
+    """
+    results = {}
+    for queue_name in ["heap", "bucket"]:
+        options = parse_search_options(["-s", search, "--queue", queue_name])
+        sokoban_map = SokobanMap(map_path)
+        initial_state = sokoban_map.build_state()
+        tree = build_tree(initial_state, sokoban_map, options, print_progress=False)
+        t1 = time.time()
+        result = tree.search()
+        results[queue_name] = (time.time() - t1, tree.total_visited, result.g if result else None)
+    return results
+
+
+def benchmark_queue(map_paths: list[str]) -> None:
+    times = time_queue_operations()
+    print(
+        "Queue operations: heap "
+        + str(round(times["heap"], 3))
+        + "s, bucket "
+        + str(round(times["bucket"], 3))
+        + "s"
+    )
+    for map_path in map_paths:
+        for search in ["astar", "push"]:
+            results = time_queue_search(map_path, search)
+            print(
+                map_path
+                + " -s "
+                + search
+                + ": "
+                + ", ".join(
+                    name
+                    + " "
+                    + str(round(taken, 3))
+                    + "s "
+                    + str(visited)
+                    + " nodes cost "
+                    + str(cost)
+                    for name, (taken, visited, cost) in results.items()
+                )
+            )
+
+
+def run_suite(
+    map_paths: list[str], strategies: list[str], trials: int = 3, time_limit: int = 60
+) -> dict:
+    """
+    Solve every map with every strategy trials times. Return the results by "map|strategy":
+    status, nodes, median time in seconds, nodes per second, solution length (number of moves)
+    and the highest peak memory in bytes.
+    """
+
+    results = {}
+    # A fresh process per solve, so that the peak memory is the one of that solve alone
+    executor_options = {"max_workers": 1}
+    if sys.version_info >= (3, 11):
+        executor_options["max_tasks_per_child"] = 1
+    with ProcessPoolExecutor(**executor_options) as executor:
+        for map_path in map_paths:
+            for strategy in strategies:
+                options = strategy_options(strategy, ["-t", str(time_limit)])
+                runs = [
+                    executor.submit(solve_map, map_path, options).result()
+                    for _ in range(trials)
+                ]
+                times = [run["time"] for run in runs if "time" in run]
+                memory = [run["peak_memory"] for run in runs if run.get("peak_memory")]
+                first = runs[0]
+                result = {
+                    "status": first["status"],
+                    "nodes": first.get("nodes"),
+                    "time": round(statistics.median(times), 3) if times else None,
+                    "length": len(first["moves"]) if first.get("moves") else None,
+                    "peak_memory": max(memory) if memory else None,
+                }
+                result["nodes_per_second"] = (
+                    round(result["nodes"] / max(result["time"], 0.001), 1)
+                    if result["time"] is not None
+                    else None
+                )
+                results[map_path + "|" + strategy] = result
+                print(
+                    map_path
+                    + " "
+                    + strategy
+                    + ": "
+                    + ", ".join(name + " " + str(value) for name, value in result.items())
+                )
+    return results
+
+
+def compare(results: dict, baseline: dict, thresholds: dict) -> list[str]:
+    """
+    Compare the results of run_suite with a baseline. Return a description of every
+    regression: a solve that does not succeed anymore, or a metric that got worse by more than
+    its threshold.
+    """
+
+    regressions = []
+    for name, base in baseline.items():
+        if name not in results:
+            continue
+        result = results[name]
+        if base["status"] == "solved" and result["status"] != "solved":
+            regressions.append(name + ": " + result["status"] + ", was solved")
+            continue
+        for metric, threshold in thresholds.items():
+            old = base.get(metric)
+            new = result.get(metric)
+            if old is None or new is None:
+                continue
+            if metric in ["time", "nodes_per_second"] and base["time"] < MIN_TIME:
+                continue
+            if metric == "nodes_per_second":
+                worse = new < old * (1 - threshold)
+            else:
+                worse = new > old * (1 + threshold)
+            if worse:
+                regressions.append(name + ": " + metric + " " + str(old) + " -> " + str(new))
+    return regressions
+
+
+def benchmark_suite(argv: list[str]) -> int:
+    """
+    The suite command. Return the exit status, 1 if a regression was found.
+    """
+
+    def option(name: str, default: str) -> str:
+        try:
+            return argv[argv.index(name) + 1]
+        except ValueError:
+            return default
+
+    map_paths = sorted(glob.glob(option("--maps", os.path.join("maps", "*.txt"))))
+    strategies = option("--strategies", SUITE_STRATEGIES).split(",")
+    trials = int(option("--trials", "3"))
+    time_limit = int(option("-t", "60"))
+    output_path = option("--output", "benchmark.json")
+    baseline_path = option("--baseline", None)
+
+    thresholds = DEFAULT_THRESHOLDS.copy()
+    for i, arg in enumerate(argv):
+        if arg == "--threshold":
+            metric, value = argv[i + 1].split("=")
+            if metric not in thresholds:
+                raise Exception("Illegal metric. Accept only " + ", ".join(thresholds.keys()))
+            thresholds[metric] = float(value)
+
+    results = run_suite(map_paths, strategies, trials, time_limit)
+    with open(output_path, "w") as output_file:
+        json.dump({"trials": trials, "time_limit": time_limit, "results": results}, output_file)
+    print("Results written to " + output_path)
+
+    if not baseline_path:
+        return 0
+    with open(baseline_path, "r") as baseline_file:
+        baseline = json.load(baseline_file)["results"]
+    regressions = compare(results, baseline, thresholds)
+    for regression in regressions:
+        print("Regression: " + regression)
+    if not regressions:
+        print("No regression against " + baseline_path)
+    return 1 if regressions else 0
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] not in ["queue", "suite"]:
+        print(__doc__)
+        return
+    if sys.argv[1] == "suite":
+        sys.exit(benchmark_suite(sys.argv[2:]))
+    if sys.argv[1] == "queue":
+        map_paths = sys.argv[2:] or ["maps/micro1.txt", "maps/micro19.txt", "maps/nabo40.txt"]
+        benchmark_queue(map_paths)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,449 @@
+"""
+A long running solver. Jobs are sent as JSON lines over a local TCP port or a Unix socket and
+solved by a pool of warm worker processes, which keep the parsed maps and their dead squares
+between jobs. Run from the src directory:
+
+python daemon.py serve [--port <number> | --socket <path_to_file>] [--workers <number>]
+
+python daemon.py submit [--port <number> | --socket <path_to_file>] -p <path_to_map_file>
+	[--level <number>] [--id <name>] [--deadline <seconds>] [<search options of main.py>]
+
+python daemon.py cancel [--port <number> | --socket <path_to_file>] <id>
+
+python daemon.py status [--port <number> | --socket <path_to_file>]
+
+Where:
+
+serve: Start the daemon. It listens on 127.0.0.1, port 7878 unless --port or --socket is given.
+
+[--workers <number>]: Number of worker processes. Defaults to the number of CPUs.
+
+submit: Send a job and print every message of it until its result.
+
+[--id <name>]: Name of the job, used to cancel it. Default: a number given by the daemon.
+
+[--deadline <seconds>]: Stop the job this many seconds after it was sent, queued or not.
+
+[<search options of main.py>]: e.g. -s push --heuristic matching. See python main.py -h.
+
+cancel: Stop a queued or running job. A running job is stopped by replacing its worker.
+
+status: Print the running and queued jobs.
+
+Protocol:
+
+A request is a JSON object on a single line. {"op": "solve", "map": "maps/micro1.txt"} solves a
+map, with the optional fields "level" (from 1), "rows" (the rows of a level, instead of "map"),
+"args" (search options as a list, like ["-s", "push"]), "id", "deadline" and "progress" (the
+interval of the progress messages in seconds, 1 by default). {"op": "cancel", "id": ...} and
+{"op": "status"} need no other field.
+
+The daemon answers with JSON lines that all have the "id" of their job and an "event":
+"queued", "started", "progress" (the statistics of the search, see --stats of main.py) and
+finally one "result", like a line of --batch. Its status is solved, no solution, timeout,
+error or cancelled. The jobs of a client that disconnects are cancelled. Instead of the
+peak_memory of --batch, a result has the worker_peak_memory: the peak of the warm worker over
+all the jobs it has run so far, not of this job alone.
+"""
+
+import sys
+import os
+import json
+import socket
+import asyncio
+import threading
+import multiprocessing
+from collections import OrderedDict, deque
+
+from main import LevelCollection, SokobanMap, parse_search_options, solve_map
+
+
+DEFAULT_PORT = 7878
+
+# Parsed maps kept by each worker, least recently used are dropped first
+MAP_CACHE_SIZE = 64
+
+# Seconds given to a search after its deadline to stop by itself, before its worker is replaced
+DEADLINE_GRACE = 2
+
+
+class ProgressStream:
+    """
+    File-like object given to the search as its stats file. Each JSON line of statistics is
+    sent to the daemon as a progress message of the job.
+    """
+
+    def __init__(self, job_id: str, connection) -> None:
+        self.job_id = job_id
+        self.connection = connection
+
+    def write(self, line: str) -> None:
+        message = json.loads(line)
+        message.update(id=self.job_id, event="progress")
+        self.connection.send(message)
+
+    def flush(self) -> None:
+        pass
+
+
+def load_map(request: dict, maps: OrderedDict, collections: dict) -> SokobanMap:
+    """
+    The map of a solve request, parsed and compiled only the first time the worker sees it.
+    """
+    rows = request.get("rows")
+    if rows is None:
+        path = request["map"]
+        # Read the level index of a collection again only if the file changed
+        modified = os.path.getmtime(path)
+        if path not in collections or collections[path][0] != modified:
+            collections[path] = (modified, LevelCollection(path))
+        rows = collections[path][1].rows(request.get("level", 1) - 1)
+
+    key = "\n".join(rows)
+    if key in maps:
+        maps.move_to_end(key)
+    else:
+        maps[key] = SokobanMap(rows=rows)
+        maps[key].search_dead_ends()
+        if len(maps) > MAP_CACHE_SIZE:
+            maps.popitem(last=False)
+    return maps[key]
+
+
+def worker_main(connection) -> None:
+    """
+    Body of a worker process. Solve the jobs received on the connection one after the other.
+    """
+    maps = OrderedDict()
+    collections = {}
+    while True:
+        try:
+            job = connection.recv()
+        except EOFError:
+            return
+        request = job["request"]
+        try:
+            options = parse_search_options(request.get("args", []))
+            options["workers"] = 1
+            if job["time_limit"] is not None:
+                options["time_limit"] = min(
+                    job["time_limit"], options["time_limit"] or job["time_limit"]
+                )
+            result = solve_map(
+                request.get("map"),
+                options,
+                request.get("level", 1) - 1,
+                sokoban_map=load_map(request, maps, collections),
+                stats_file=ProgressStream(job["id"], connection),
+                stats_interval=request.get("progress", 1),
+            )
+        except Exception as e:
+            result = {"map": request.get("map"), "status": "error", "error": str(e)}
+        # The peak of the process can not be reset between jobs
+        if "peak_memory" in result:
+            result["worker_peak_memory"] = result.pop("peak_memory")
+        result.update(id=job["id"], event="result")
+        connection.send(result)
+
+
+class Job:
+    """
+    A solve request, from the moment it is received until its result is sent.
+    """
+
+    def __init__(self, job_id: str, request: dict, writer: asyncio.StreamWriter) -> None:
+        self.id = job_id
+        self.request = request
+        # Connection of the client that sent the job, where its messages go
+        self.writer = writer
+        # Worker running the job, None while queued
+        self.worker: Worker = None
+        # Loop time of the deadline, None for no deadline
+        self.deadline: float = None
+        self.timer: asyncio.TimerHandle = None
+
+    def map_key(self) -> str:
+        if "rows" in self.request:
+            return "\n".join(self.request["rows"])
+        return str(self.request.get("map")) + ":" + str(self.request.get("level", 1))
+
+
+class Worker:
+    """
+    A warm worker process of the daemon, running one job at a time.
+    """
+
+    def __init__(self, number: int, context) -> None:
+        self.number = number
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(
+            target=worker_main, args=(child_connection,), daemon=True
+        )
+        self.process.start()
+        # Only the worker keeps its end, so recv fails once the worker is gone
+        child_connection.close()
+        self.job: Job = None
+        # Keys of the maps this worker has parsed, see Job.map_key
+        self.maps: set[str] = set()
+
+    def stop(self) -> None:
+        # The connection is closed by the thread reading it, once it sees the end
+        self.process.terminate()
+        self.process.join()
+
+
+class Daemon:
+    """
+    Accepts the jobs of the clients, queues them and runs them on the workers. All of it runs
+    on a single asyncio loop, the workers are read by one thread each.
+    """
+
+    def __init__(self, workers: int = None) -> None:
+        self.context = multiprocessing.get_context("spawn")
+        self.workers = [
+            Worker(number, self.context) for number in range(workers or os.cpu_count() or 1)
+        ]
+        self.queue: deque[Job] = deque()
+        # Jobs that are queued or running, by id
+        self.jobs: dict[str, Job] = {}
+        self.next_id = 1
+
+    async def serve(self, port: int = DEFAULT_PORT, socket_path: str = None) -> None:
+        for worker in self.workers:
+            self.listen(worker)
+        if socket_path:
+            server = await asyncio.start_unix_server(self.handle, socket_path)
+            print("Listening on " + socket_path)
+        else:
+            server = await asyncio.start_server(self.handle, "127.0.0.1", port)
+            print("Listening on 127.0.0.1:" + str(port))
+        async with server:
+            await server.serve_forever()
+
+    def send(self, job: Job, message: dict) -> None:
+        message["id"] = job.id
+        if not job.writer.is_closing():
+            job.writer.write((json.dumps(message) + "\n").encode())
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """
+        Read the requests of a client until it disconnects. Its unfinished jobs are cancelled.
+        """
+        jobs = []
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                except ValueError:
+                    writer.write(b'{"event": "error", "error": "Invalid JSON"}\n')
+                    continue
+                op = request.get("op")
+                if op == "solve":
+                    jobs.append(self.submit(request, writer))
+                elif op == "cancel":
+                    job = self.jobs.get(str(request.get("id")))
+                    if job is not None:
+                        self.finish(job, {"status": "cancelled"})
+                    answer = {"id": request.get("id"), "event": "cancel", "found": job is not None}
+                    writer.write((json.dumps(answer) + "\n").encode())
+                elif op == "status":
+                    writer.write((json.dumps(self.status()) + "\n").encode())
+                else:
+                    writer.write(b'{"event": "error", "error": "Unknown op"}\n')
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            for job in jobs:
+                if job.id in self.jobs:
+                    self.finish(job, {"status": "cancelled"})
+            writer.close()
+
+    def status(self) -> dict:
+        return {
+            "event": "status",
+            "running": [
+                {"id": worker.job.id, "worker": worker.number}
+                for worker in self.workers
+                if worker.job is not None
+            ],
+            "queued": [job.id for job in self.queue],
+        }
+
+    def submit(self, request: dict, writer: asyncio.StreamWriter) -> Job:
+        job_id = str(request.get("id") or self.next_id)
+        self.next_id += 1
+        job = Job(job_id, request, writer)
+        if job_id in self.jobs:
+            self.send(job, {"event": "result", "status": "error", "error": "Duplicate id"})
+            return job
+        self.jobs[job_id] = job
+
+        loop = asyncio.get_running_loop()
+        if request.get("deadline") is not None:
+            job.deadline = loop.time() + float(request["deadline"])
+            job.timer = loop.call_later(
+                float(request["deadline"]) + DEADLINE_GRACE,
+                self.finish,
+                job,
+                {"status": "timeout"},
+            )
+        self.queue.append(job)
+        self.send(job, {"event": "queued", "position": len(self.queue)})
+        self.dispatch()
+        return job
+
+    def dispatch(self) -> None:
+        """
+        Start queued jobs on the idle workers, preferring a worker that has parsed the map.
+        """
+        loop = asyncio.get_running_loop()
+        while self.queue:
+            idle = [worker for worker in self.workers if worker.job is None]
+            if not idle:
+                return
+            job = self.queue.popleft()
+            time_limit = None
+            if job.deadline is not None:
+                time_limit = job.deadline - loop.time()
+                if time_limit <= 0:
+                    self.finish(job, {"status": "timeout"})
+                    continue
+            key = job.map_key()
+            worker = next((worker for worker in idle if key in worker.maps), idle[0])
+            worker.maps.add(key)
+            worker.job = job
+            job.worker = worker
+            worker.connection.send({"id": job.id, "request": job.request, "time_limit": time_limit})
+            self.send(job, {"event": "started", "worker": worker.number})
+
+    def finish(self, job: Job, result: dict) -> None:
+        """
+        Send the result of the job and forget it. A worker still running it is replaced.
+        """
+        if self.jobs.get(job.id) is not job:
+            return
+        del self.jobs[job.id]
+        if job.timer is not None:
+            job.timer.cancel()
+        if job in self.queue:
+            self.queue.remove(job)
+        worker = job.worker
+        if worker is not None and worker.job is job:
+            worker.job = None
+            if result.get("event") != "result":
+                # The worker is still busy with the job, start a fresh one in its place
+                self.replace(worker)
+        result.setdefault("map", job.request.get("map"))
+        result["event"] = "result"
+        self.send(job, result)
+        self.dispatch()
+
+    def replace(self, worker: Worker) -> None:
+        worker.stop()
+        new_worker = Worker(worker.number, self.context)
+        self.workers[self.workers.index(worker)] = new_worker
+        self.listen(new_worker)
+
+    def listen(self, worker: Worker) -> None:
+        """
+        Start the thread that hands the messages of the worker to the loop, until the worker is
+        stopped.
+        """
+        loop = asyncio.get_running_loop()
+
+        def read() -> None:
+            while True:
+                try:
+                    message = worker.connection.recv()
+                except (EOFError, OSError):
+                    worker.connection.close()
+                    return
+                loop.call_soon_threadsafe(self.receive, worker, message)
+
+        threading.Thread(target=read, daemon=True).start()
+
+    def receive(self, worker: Worker, message: dict) -> None:
+        job = self.jobs.get(message["id"])
+        # Late messages of a job that was cancelled or timed out are dropped
+        if job is None or job.worker is not worker:
+            return
+        if message["event"] == "result":
+            self.finish(job, message)
+        else:
+            self.send(job, message)
+
+
+def connect(argv: list[str]) -> socket.socket:
+    if "--socket" in argv:
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.connect(argv[argv.index("--socket") + 1])
+    else:
+        port = int(argv[argv.index("--port") + 1]) if "--port" in argv else DEFAULT_PORT
+        client = socket.create_connection(("127.0.0.1", port))
+    return client
+
+
+def request(argv: list[str], message: dict, until_result=False) -> None:
+    """
+    Send a request and print the answers, until the result of the job if until_result.
+    """
+    client = connect(argv)
+    with client, client.makefile("r") as answers:
+        client.sendall((json.dumps(message) + "\n").encode())
+        for line in answers:
+            print(line.rstrip())
+            if not until_result or json.loads(line).get("event") == "result":
+                break
+
+
+def submit(argv: list[str]) -> None:
+    # The options of the daemon itself, with their values, the rest goes to the search
+    message = {"op": "solve"}
+    args = []
+    i = 0
+    while i < len(argv):
+        if argv[i] in ["-p", "--level", "--id", "--deadline", "--port", "--socket"]:
+            name, value = argv[i], argv[i + 1]
+            if name == "-p":
+                message["map"] = os.path.abspath(value)
+            elif name == "--level":
+                message["level"] = int(value)
+            elif name == "--id":
+                message["id"] = value
+            elif name == "--deadline":
+                message["deadline"] = float(value)
+            i += 2
+        else:
+            args.append(argv[i])
+            i += 1
+    message["args"] = args
+    request(argv, message, until_result=True)
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] not in ["serve", "submit", "cancel", "status"]:
+        print(__doc__)
+        return
+    argv = sys.argv[2:]
+    if sys.argv[1] == "serve":
+        workers = int(argv[argv.index("--workers") + 1]) if "--workers" in argv else None
+        port = int(argv[argv.index("--port") + 1]) if "--port" in argv else DEFAULT_PORT
+        socket_path = argv[argv.index("--socket") + 1] if "--socket" in argv else None
+        try:
+            asyncio.run(Daemon(workers).serve(port, socket_path))
+        except KeyboardInterrupt:
+            pass
+    elif sys.argv[1] == "submit":
+        submit(argv)
+    elif sys.argv[1] == "cancel":
+        request(argv, {"op": "cancel", "id": argv[-1]})
+    elif sys.argv[1] == "status":
+        request(argv, {"op": "status"})
+
+
+if __name__ == "__main__":
+    main()
@@ -2,37 +2,154 @@ import sys
 import os
 import time
 import heapq
+import random
+import json
+import hashlib
+import sqlite3
+import glob
+import queue
+import threading
+import cProfile
+import multiprocessing
+import tempfile
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 
 
 HELP_TEXT = """
 Command:
 
-python main.py –p <path_to_map_file>
-	[-h] [-i] [-s (dfs|astar)] [-t <time_in_second>]
+python main.py –p <path_to_map_file> [--level <number>]
+	[-h] [-i] [-s (dfs|astar|idastar|push|bidirectional)] [-t <time_in_second>]
 	[-f <frame_per_second>] [--optimal] [--visual]
-	[--no-replay]
+	[--no-replay] [--heuristic <name>] [--patterns <path_to_file>]
+	[--max-memory <megabytes>] [--workers <number>] [--weight <number>]
+	[--portfolio [<strategies>]] [--queue (heap|bucket)] [--macros] [--corrals]
+	[--timers] [--stats <path_to_file>] [--stats-interval <seconds>]
+	[--profile <path_to_file>] [--cache <path_to_file>] [--cache-size <megabytes>]
 
 Where:
 
 [-h]: Show this help
 
 -p <path_to_map_file>: The path to the map file. e.g. -p maps/nabo1.txt
+The file may hold many levels, like the standard .xsb and .sok collections. The standard symbols
+(@ + $ . * - _) are read as well, unless the level uses the hero X of this game.
 
-[-i]: Enable interactive play mode. Use arrow keys to control the hero.
+[--level <number>]: The level of the map file to play or solve, from 1. Default: 1
 
-[-s (dfs|astar)]: Choose search algorithm. e.g. -s astar
+[-i]: Enable interactive play mode. Use arrow keys to control the hero.
 
-[--visual]: Draw state after each node visit. Will greatly decrease the performance.
+[-s (dfs|astar|idastar|push|bidirectional)]: Choose search algorithm. e.g. -s astar
+    idastar: Iterative deepening A*. Memory stays small, the examined states are kept in a
+    fixed size table (64 megabytes unless --max-memory is given).
+    push: A* where each step is a box push. The hero walks for free between pushes, which
+    greatly reduces the number of states. The walking path is rebuilt for the replay.
+    bidirectional: Like push, but a second search starts from the solved map and pulls the
+    boxes back until both searches meet. Usually much faster, not always the fewest pushes.
+
+[--heuristic <name>]: Choose the h(n) function of the A* searches. One of:
+    combined: Manhattan distance of the boxes to the nearest shelf plus hero to the boxes.
+    Default of astar and idastar.
+    box_shelf: Manhattan distance of the boxes to the nearest shelf. Default of push and
+    bidirectional (forward search only).
+    push_distance: Number of pushes of the boxes to the nearest shelf, walls are respected.
+    matching: Number of pushes with every box assigned to its own shelf (min cost matching).
+
+[--queue (heap|bucket)]: The priority queue of astar and push. bucket is faster but only keeps
+the exact order when f(n) = g + h is an integer. Default: bucket, unless --weight is a fraction.
+Not used with --optimal, which has its own queue.
+
+[--macros]: With push and bidirectional, push a box along a one-wide tunnel in a single move.
+If every shelf is in a room with a single entrance and no box at the start, the boxes entering
+it are also pushed straight to their shelves, in an order that never blocks the room. Such an
+order is only found if the room can be filled one box at a time, each box going straight to its
+shelf: a room so packed that boxes must wait inside it first gets no goal room macro. Fewer
+states on maps with long tunnels or such a room, the number of pushes is still counted. The
+bundled maps have neither, so they are searched as without --macros.
+
+[--corrals]: With push and bidirectional, when the boxes close off an area the hero can not
+enter, and the hero can push each of its boxes into it but nowhere else (a PI-corral), only
+these pushes are tried. Fewer states, the more so on larger maps. The skipped pushes are counted
+as "PI-corral" in the pruned states.
+
+[--weight <number>]: Multiply h(n) by this weight. Above 1, solutions are usually found faster
+but may be longer than the optimal. e.g. --weight 2
+
+[--portfolio [<strategies>]]: Race several strategies in parallel processes, the first solution
+wins and the others are stopped. A strategy is algorithm[:heuristic[:weight]], separated by
+commas. e.g. --portfolio dfs,astar:combined,push:matching:1.5
+Default: dfs,astar:combined,astar:box_shelf,push:push_distance:2,bidirectional
+
+[--patterns <path_to_file>]: Learn small deadlock patterns during the search and keep them in
+this file. The patterns are loaded again by later runs, on any map. e.g. --patterns deadlocks.json
+
+[--max-memory <megabytes>]: Keep the examined states in a fixed size table of this many
+megabytes. Once it is full, the states furthest from the start are forgotten first, the
+expanded ones last. Except for idastar, the search stops with an error once it has forgotten
+more expanded states than the table holds: it would keep expanding them again.
+
+[--workers <number>]: Run astar or push on this many processes. Every state belongs to one
+process, chosen by its hash. With --optimal, the search only ends once no process can find a
+cheaper solution. e.g. --workers 8
+The processes do not expand the nodes in the order of a single search, so together they expand
+more of them, and without --optimal the first solution may be longer. It only pays off with
+more free CPUs than workers.
+
+[--timers]: Measure the time spent generating successors (with the hashing), checking
+deadlocks, finding corrals, computing h(n), looking up the examined states and using the open
+queue. The steps a search does not use are shown as n/a. Slows the search down a little.
+
+[--stats <path_to_file>]: Write the statistics of the search (nodes, speed, open queue size,
+pruned states, timers) to this file as a JSON line every second, and once more at the end.
+
+[--stats-interval <seconds>]: The interval of --stats. e.g. --stats-interval 0.5
+
+[--profile <path_to_file>]: Run the search under cProfile and write the profile to this file,
+e.g. python -m pstats <path_to_file>. A sampling profiler like py-spy can also attach to the
+process while it runs.
+
+[--cache <path_to_file>]: Keep the solutions in this SQLite file. A level solved before with the
+same search options is answered at once, even if it is rotated, mirrored or has other walls
+around it. Also used by --batch and --portfolio.
+
+[--cache-size <megabytes>]: Once the moves in the cache take more than this (64 by default), the
+least recently used solutions are removed.
+
+[--visual]: Draw the current state of the search 30 times per second. The states visited in
+between are not drawn, so the search is barely slowed down.
 
 [--no-replay]: Do not replay the solution after one is found.
 
-[--optimal]: Continue the search even if a solution is found (seek optimal).
+[--optimal]: Continue the search even if a solution is found (seek optimal). With astar and
+push, a first solution is found quickly with h(n) multiplied by 3 (or --weight), then the weight
+is lowered step by step to find better ones. Each solution is printed with its bound as soon as
+it is found: it costs at most bound times the optimal.
+astar uses box_shelf unless --heuristic is given. combined may overestimate, with it the search
+can not prune by h(n) and only proves the solution optimal (bound 1) once it has seen everything.
 
 [-t <time_in_second>]: Stop the search after the given time is reached. This option has higher
 privilege than --optimal.
 
 [-f <frame_per_second>]: The frame rate in which the replay will play after a solution is found.
 
+Batch mode:
+
+python main.py --batch <directory_or_glob> [-s ...] [-t <time_in_second>] [--heuristic <name>]
+	[--max-memory <megabytes>] [--cache <path_to_file>] [--workers <number>]
+	[--output <path_to_file>]
+
+Solve every level of the maps of a directory (.txt, .xsb and .sok files), or matched by a glob
+such as "maps/*.txt", in parallel processes. The levels are read from the files one at a time.
+Nothing is drawn. The search options are the same as above, -t is the time limit of each level.
+One JSON line per level is written as soon as it is done, with the map, the level number, the
+status (solved, no solution, timeout or error), the LURD moves, the number of visited nodes, the
+time taken and the peak memory in bytes.
+
+[--workers <number>]: Number of worker processes. Defaults to the number of CPUs.
+
+[--output <path_to_file>]: Write the JSON lines to this file instead of the console.
+
 """
 
 
@@ -53,6 +170,9 @@ class Move:
         DIR_DOWN: (0, 1),
     }
 
+    # Move characters of the LURD notation, indexed by direction. Upper case means a push.
+    LURD_CHARS = "lrud"
+
     def __init__(self, direction: int) -> None:
         self.dir = direction
 
@@ -72,295 +192,2690 @@ RIGHT = Move(Move.DIR_RIGHT)
 UP = Move(Move.DIR_UP)
 DOWN = Move(Move.DIR_DOWN)
 
+# All moves, indexed by Move.dir
+MOVES = [LEFT, RIGHT, UP, DOWN]
 
-class State:
+
+def bits(mask: int):
     """
-    A State object represents a certain game state.
+    Yield the index of every set bit of the given mask, lowest first.
     """
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
 
-    def __init__(
-        self,
-        hero: tuple[int],
-        boxes: set[tuple[int]],
-        walls: set[tuple[int]],
-        shelves: set[tuple[int]],
-    ) -> None:
+
+def count_bits(mask: int) -> int:
+    """
+    Number of set bits of the given mask.
+    """
+    return bin(mask).count("1")
+
+
+class CompiledMap:
+    """
+    A compact model of a map, built once from a SokobanMap. Every floor cell gets a number (row
+    by row, so a lower number is closer to the top left corner), which lets a set of cells be
+    stored as a bitmask in a single int.
+    """
+
+    def __init__(self, sokoban_map) -> None:
 
         """
-        A tuple that stores the current position of the hero. E.g. (1, 2)
+        Walls and shelves as sets of tuples. Only used for drawing.
         """
-        self.hero = hero
+        self.walls: set[tuple[int]] = sokoban_map.walls
+        self.shelves: set[tuple[int]] = sokoban_map.shelves
+
+        """
+        Symbols of the walls, shelves and empty floor, one string per row. Built on the first
+        draw, see GraphicController.layer.
+        """
+        self.layer: list[str] = None
+
+        # Flood fill the floor starting from every non-wall object of the map
+        bound_x, bound_y = sokoban_map.get_map_bound()
+        floor = set()
+        frontier = [sokoban_map.hero, *sokoban_map.boxes, *sokoban_map.shelves]
+        while frontier:
+            position = frontier.pop()
+            if position in floor or position in self.walls:
+                continue
+            if not (0 <= position[0] <= bound_x and 0 <= position[1] <= bound_y):
+                continue
+            floor.add(position)
+            for direction in [LEFT, RIGHT, UP, DOWN]:
+                frontier.append(direction.move(position))
+
+        """
+        Position of each cell, indexed by the cell number. E.g. [(1, 1), (2, 1)]
+        """
+        self.cells: list[tuple[int]] = sorted(floor, key=lambda p: (p[1], p[0]))
+
+        """
+        Cell number of each floor position. E.g. {(1, 1): 0, (2, 1): 1}
+        """
+        self.index: dict[tuple[int], int] = {
+            position: i for i, position in enumerate(self.cells)
+        }
+
+        """
+        Neighbor cell numbers of each cell, indexed by Move.dir. -1 means there is a wall.
+        """
+        self.neighbors: list[tuple[int]] = [
+            tuple(
+                self.index.get(direction.move(position), -1)
+                for direction in [LEFT, RIGHT, UP, DOWN]
+            )
+            for position in self.cells
+        ]
+
+        """
+        Bitmask of the cells that have a shelf.
+        """
+        self.shelf_mask = self.to_mask(self.shelves)
+
+        """
+        Manhattan distance from each cell to its nearest shelf.
+        """
+        self.shelf_distance: list[float] = [
+            min(
+                [abs(shelf[0] - x) + abs(shelf[1] - y) for shelf in self.shelves],
+                default=float("inf"),
+            )
+            for x, y in self.cells
+        ]
+
+        """
+        Zobrist keys. A random 64 bit number per cell for the hero and for a box. The hash of a
+        state is the XOR of the keys of everything on the map, so a move only has to XOR out the
+        old cells and XOR in the new ones. A fixed seed keeps hashes the same between processes.
+        """
+        rng = random.Random(0)
+        self.hero_keys: list[int] = [rng.getrandbits(64) for _ in self.cells]
+        self.box_keys: list[int] = [rng.getrandbits(64) for _ in self.cells]
+
+        """
+        A state is packed into a single int key, (boxes << hero_bits) | hero.
+        """
+        self.hero_bits = max(1, (len(self.cells) - 1).bit_length())
+        self.hero_mask = (1 << self.hero_bits) - 1
+
+        """
+        Cell numbers of the shelves. The order is the shelf order used in push_distance.
+        """
+        self.shelf_cells: list[int] = list(bits(self.shelf_mask))
+
+        """
+        Number of pushes needed to bring a box from each cell to each shelf, ignoring the other
+        boxes. E.g. push_distance[cell][i] is the distance to shelf_cells[i], inf if impossible.
+        """
+        by_shelf = [self.pull_distances(shelf) for shelf in self.shelf_cells]
+        self.push_distance: list[list[float]] = [list(row) for row in zip(*by_shelf)]
+
+        """
+        Push distance from each cell to its nearest shelf.
+        """
+        self.nearest_push_distance: list[float] = [
+            min(row, default=float("inf")) for row in self.push_distance
+        ]
+
+        """
+        Bitmask of the cells where a box can never reach a shelf.
+        """
+        self.dead_mask: int = self.find_dead_cells()
+
+        """
+        The 2x2 squares around each cell, as the cell numbers of the 3 other corners. -1 means
+        the corner is a wall.
+        """
+        self.squares: list[list[tuple[int]]] = [
+            [
+                (
+                    self.index.get((x + dx, y), -1),
+                    self.index.get((x, y + dy), -1),
+                    self.index.get((x + dx, y + dy), -1),
+                )
+                for dx, dy in [(-1, -1), (1, -1), (-1, 1), (1, 1)]
+            ]
+            for x, y in self.cells
+        ]
+
+        """
+        Directions along which each cell is part of a one-wide tunnel, as a bitmask of Move.dir:
+        both cells beside it, across the direction, are walls. See State.generate_macro_pushes.
+        """
+        self.tunnel: list[int] = [
+            sum(
+                1 << direction
+                for direction in range(4)
+                if all(
+                    cell_neighbors[side] < 0
+                    for side in (
+                        [Move.DIR_UP, Move.DIR_DOWN]
+                        if direction in [Move.DIR_LEFT, Move.DIR_RIGHT]
+                        else [Move.DIR_LEFT, Move.DIR_RIGHT]
+                    )
+                )
+            )
+            for cell_neighbors in self.neighbors
+        ]
+
+        """
+        Goal room, an area holding every shelf that is only entered through the entrance cell,
+        by a push in entrance_direction. The boxes are pushed into it one by one, each straight
+        to the next shelf of fill_order, by the pushes fill_paths[shelf] (Move.dir of each push,
+        the first one from the entrance). fill_masks[k] are the first k shelves of fill_order.
+        entrance is -1 when the map has no such room or no fill order was found, and None until
+        find_goal_room is called on the first use by the macro moves.
+        """
+        self.start_boxes = self.to_mask(sokoban_map.boxes)
+        self.entrance = None
+        self.entrance_direction = -1
+        self.room_mask = 0
+        self.fill_order: list[int] = []
+        self.fill_paths: dict[int, list[int]] = {}
+        self.fill_masks: list[int] = []
+        # Cell the box leaves on the last push of fill_paths[shelf], where the hero ends
+        self.fill_previous: dict[int, int] = {}
+
+    def find_goal_room(self) -> None:
+        """
+        Find the smallest goal room without any of the boxes of the initial state, then its fill
+        order: starting from the room full of boxes, take out the first box that can be pulled
+        back to the entrance, and so on. The boxes are put in again in the reverse order, by the
+        reverse pushes. See entrance. Only the first call does the work.
+
+        The areas that a single cell cuts off are found in one depth first search from a box,
+        which can not be in the room: the subtree below a cell is such an area if none of its
+        cells has a back edge above the cell (Tarjan's articulation points).
+        """
+        if self.entrance is not None:
+            return
+        self.entrance = -1
+        boxes = self.start_boxes
+        if not boxes:
+            return
+        neighbors = self.neighbors
+        cell_count = len(self.cells)
+        shelf_count = count_bits(self.shelf_mask)
+        # Discovery order, lowest order reachable by a back edge from the subtree, parent, and
+        # the number of cells, shelves and boxes of the subtree of each cell
+        order = [-1] * cell_count
+        low = [0] * cell_count
+        parent = [-1] * cell_count
+        size = [1] * cell_count
+        shelves = [self.shelf_mask >> cell & 1 for cell in range(cell_count)]
+        box_counts = [boxes >> cell & 1 for cell in range(cell_count)]
+        next_direction = [0] * cell_count
+
+        # Smallest room as (number of cells, entrance, direction of the push into it)
+        room = None
+        root = (boxes & -boxes).bit_length() - 1
+        order[root] = 0
+        counter = 1
+        stack = [root]
+        while stack:
+            cell = stack[-1]
+            if next_direction[cell] < 4:
+                next_cell = neighbors[cell][next_direction[cell]]
+                next_direction[cell] += 1
+                if next_cell < 0:
+                    continue
+                if order[next_cell] < 0:
+                    order[next_cell] = low[next_cell] = counter
+                    counter += 1
+                    parent[next_cell] = cell
+                    stack.append(next_cell)
+                elif next_cell != parent[cell]:
+                    low[cell] = min(low[cell], order[next_cell])
+                continue
+
+            stack.pop()
+            entrance = parent[cell]
+            if entrance < 0:
+                continue
+            low[entrance] = min(low[entrance], low[cell])
+            size[entrance] += size[cell]
+            shelves[entrance] += shelves[cell]
+            box_counts[entrance] += box_counts[cell]
+            if (
+                low[cell] < order[entrance]
+                or shelves[cell] < shelf_count
+                or box_counts[cell]
+                or self.shelf_mask & (1 << entrance)
+            ):
+                continue
+            if room is not None and size[cell] >= room[0]:
+                continue
+            # The outside cell must be the only way to the entrance, and across it from inside
+            first, last = order[cell], order[cell] + size[cell]
+            outside = [
+                next_cell
+                for next_cell in neighbors[entrance]
+                if next_cell >= 0 and not first <= order[next_cell] < last
+            ]
+            if len(outside) != 1:
+                continue
+            direction = neighbors[entrance].index(outside[0]) ^ 1
+            inside = neighbors[entrance][direction]
+            if inside >= 0 and first <= order[inside] < last:
+                room = (size[cell], entrance, direction)
+        if room is None:
+            return
+
+        _, entrance, direction = room
+        outside = neighbors[entrance][direction ^ 1]
+        # Everything reachable from inside without crossing the entrance
+        area = self.reachable(neighbors[entrance][direction], 1 << entrance)
+        # The hero only needs the room, the entrance and the outside cell: the rest of the map is
+        # walled off so that the pulls do not flood it
+        walled = ((1 << cell_count) - 1) & ~(area | (1 << entrance) | (1 << outside))
+        # Start from the room full of boxes
+        boxes = self.shelf_mask
+        removed = []
+        paths = {}
+        while boxes:
+            for shelf in bits(boxes):
+                pulls = self.pull_out(shelf, walled | boxes ^ (1 << shelf), entrance, outside)
+                if pulls is not None:
+                    break
+            else:
+                return
+            boxes ^= 1 << shelf
+            removed.append(shelf)
+            paths[shelf] = [pull ^ 1 for pull in reversed(pulls)]
+
+        self.entrance = entrance
+        self.entrance_direction = direction
+        self.room_mask = area
+        self.fill_order = removed[::-1]
+        self.fill_paths = paths
+        self.fill_masks = [0]
+        for shelf in self.fill_order:
+            self.fill_masks.append(self.fill_masks[-1] | (1 << shelf))
+            self.fill_previous[shelf] = neighbors[shelf][paths[shelf][-1] ^ 1]
+
+    def pull_out(self, shelf: int, boxes: int, entrance: int, outside: int) -> list[int]:
+        """
+        Breadth first search of the pulls that bring the box on shelf to the entrance, the hero
+        ending on the outside cell, with the other boxes in place. The hero comes in through the
+        entrance. Return the Move.dir of the pulls, or None if it can't be done.
+        """
+        neighbors = self.neighbors
+        start = (shelf, self.canonical_hero(entrance, boxes | (1 << shelf)))
+        came_from = {start: None}
+        queue = [start]
+        for box, hero in queue:
+            reach = self.reachable(hero, boxes | (1 << box))
+            for direction in range(4):
+                # The hero stands where the box goes and steps one cell further
+                target = neighbors[box][direction]
+                if target < 0 or not reach & (1 << target):
+                    continue
+                step = neighbors[target][direction]
+                if step < 0 or boxes & (1 << step):
+                    continue
+                if target == entrance and step == outside:
+                    pulls = [direction]
+                    state = (box, hero)
+                    while came_from[state] is not None:
+                        state, pull = came_from[state]
+                        pulls.append(pull)
+                    pulls.reverse()
+                    return pulls
+                next_state = (target, self.canonical_hero(step, boxes | (1 << target)))
+                if next_state not in came_from:
+                    came_from[next_state] = ((box, hero), direction)
+                    queue.append(next_state)
+        return None
+
+    def room_path_free(self, boxes: int, shelf: int) -> bool:
+        """
+        Check that a box just pushed onto the entrance can be pushed on to shelf along its fill
+        path, with the other boxes (not counting that one) in place.
+        """
+        neighbors = self.neighbors
+        box = self.entrance
+        hero = neighbors[box][self.entrance_direction ^ 1]
+        for push in self.fill_paths[shelf]:
+            pusher = neighbors[box][push ^ 1]
+            if not self.reachable(hero, boxes | (1 << box)) & (1 << pusher):
+                return False
+            hero, box = box, neighbors[box][push]
+            if boxes & (1 << box):
+                return False
+        return True
+
+    def macro_pushes(self, box: int, move: int, target: int) -> list[int]:
+        """
+        Move.dir of each push of a move of State.generate_macro_pushes, that took the box to
+        target.
+        """
+        direction = move & 3
+        count = (move >> 2) + 1
+        # Only a goal room macro goes on from the entrance, tunnels stop there
+        if count > 1:
+            self.find_goal_room()
+        if count > 1 and self.neighbors[box][direction] == self.entrance:
+            return [direction] + self.fill_paths[target]
+        return [direction] * count
+
+    def square_deadlock(self, boxes: int, cell: int) -> bool:
+        """
+        Check if the box at cell is part of a 2x2 block of boxes and walls where one of the
+        boxes is not on a shelf. No box of such a block can ever move.
+        """
+        block = 1 << cell
+        for corners in self.squares[cell]:
+            square = block
+            for corner in corners:
+                if corner < 0:
+                    continue
+                if not boxes & (1 << corner):
+                    break
+                square |= 1 << corner
+            else:
+                if square & ~self.shelf_mask:
+                    return True
+        return False
+
+    def frozen_boxes(self, boxes: int, cell: int, fixed: int = 0) -> int:
+        """
+        Check if the box at cell can never move again. A box is blocked along an axis if there
+        is a wall on either side, a dead cell on both sides, or a frozen box on either side.
+        Boxes in fixed are already being checked and are treated as walls. Return the bitmask
+        of the boxes that are frozen together with this one, 0 if it can still move.
+        """
+        neighbors = self.neighbors[cell]
+        dead = self.dead_mask
+        fixed |= 1 << cell
+        frozen = 1 << cell
+
+        for first, second in [(Move.DIR_LEFT, Move.DIR_RIGHT), (Move.DIR_UP, Move.DIR_DOWN)]:
+            a = neighbors[first]
+            b = neighbors[second]
+            if a < 0 or b < 0 or fixed & ((1 << a) | (1 << b)):
+                continue
+            if dead & (1 << a) and dead & (1 << b):
+                continue
+            if boxes & (1 << a):
+                group = self.frozen_boxes(boxes, a, fixed)
+                if group:
+                    frozen |= group
+                    continue
+            if boxes & (1 << b):
+                group = self.frozen_boxes(boxes, b, fixed)
+                if group:
+                    frozen |= group
+                    continue
+            return 0
+
+        return frozen
+
+    def find_dead_cells(self) -> int:
+        """
+        Pull a box backwards from every shelf at once. A cell the box is never pulled to can not
+        be pushed to any shelf, so a box there means the level can not be solved. Return a
+        bitmask of these dead cells.
+        """
+        neighbors = self.neighbors
+        live = self.shelf_mask
+        queue = list(bits(live))
+        for cell in queue:
+            for direction in range(4):
+                previous = neighbors[cell][direction]
+                if previous < 0 or neighbors[previous][direction] < 0:
+                    continue
+                if not live & (1 << previous):
+                    live |= 1 << previous
+                    queue.append(previous)
+        return ((1 << len(self.cells)) - 1) & ~live
+
+    def pull_distances(self, shelf: int) -> list[float]:
+        """
+        Backward breadth first search from a shelf. A box is pulled away from the shelf, which
+        is possible when both the cell the box moves to and the cell behind it (where the hero
+        stands while pushing) are floor. Return the number of pushes from each cell.
+        """
+        neighbors = self.neighbors
+        distance = [float("inf")] * len(self.cells)
+        distance[shelf] = 0
+        queue = [shelf]
+        for cell in queue:
+            for direction in range(4):
+                previous = neighbors[cell][direction]
+                if previous < 0 or neighbors[previous][direction] < 0:
+                    continue
+                if distance[previous] == float("inf"):
+                    distance[previous] = distance[cell] + 1
+                    queue.append(previous)
+        return distance
+
+    def hash_of(self, hero: int, boxes: int) -> int:
+        """
+        Compute the Zobrist hash of a state from scratch.
+        """
+        h = self.hero_keys[hero]
+        for box in bits(boxes):
+            h ^= self.box_keys[box]
+        return h
+
+    def reachable(self, hero: int, boxes: int) -> int:
+        """
+        Flood fill the cells the hero can walk to without pushing any box. Return a bitmask.
+        """
+        neighbors = self.neighbors
+        reach = 1 << hero
+        stack = [hero]
+        while stack:
+            cell = stack.pop()
+            for next_cell in neighbors[cell]:
+                if next_cell < 0:
+                    continue
+                bit = 1 << next_cell
+                if not (reach | boxes) & bit:
+                    reach |= bit
+                    stack.append(next_cell)
+        return reach
+
+    def canonical_hero(self, hero: int, boxes: int) -> int:
+        """
+        The top left cell of the area the hero can reach. States whose hero stands anywhere in
+        the same area share this cell.
+        """
+        reach = self.reachable(hero, boxes)
+        return (reach & -reach).bit_length() - 1
+
+    def pi_corral(self, hero: int, boxes: int) -> int:
+        """
+        Find a PI-corral: an area the hero can not reach, fenced by boxes that can only be pushed
+        into it (I) and that the hero can push into it right now (P). Unless the area is already
+        solved, one of these pushes is needed before any other push matters. Return the bitmask
+        of the fence boxes of the PI-corral with the fewest pushes, or 0 if there is none.
+        """
+        neighbors = self.neighbors
+        reach = self.reachable(hero, boxes)
+        floor = (1 << len(self.cells)) - 1
+        if not floor & ~(reach | boxes):
+            return 0
+        # Boxes touching the hero's area, they fence the corrals
+        fence = 0
+        for box in bits(boxes):
+            for next_cell in neighbors[box]:
+                if next_cell >= 0 and reach & (1 << next_cell):
+                    fence |= 1 << box
+                    break
+        outside = reach | fence
+        unseen = floor & ~outside
+        best, best_pushes = 0, float("inf")
+        while unseen:
+            start = (unseen & -unseen).bit_length() - 1
+            # The boxes inside the corral (away from the hero's area) are part of it
+            corral = self.reachable(start, outside)
+            unseen &= ~corral
+            border = 0
+            for cell in bits(corral):
+                for next_cell in neighbors[cell]:
+                    if next_cell >= 0 and fence & (1 << next_cell):
+                        border |= 1 << next_cell
+            inside = boxes & corral
+            if not (inside | border) & ~self.shelf_mask and not self.shelf_mask & corral & ~inside:
+                continue
+            # Give up on the corral at the first push out of it, or into it but not possible now
+            pushes = 0
+            for box in bits(border):
+                for direction in range(4):
+                    target = neighbors[box][direction]
+                    pusher = neighbors[box][direction ^ 1]
+                    if target < 0 or pusher < 0 or boxes & (1 << target):
+                        continue
+                    if corral & (1 << target):
+                        # Also fails when a box stands where the hero should push from
+                        if not reach & (1 << pusher):
+                            break
+                        pushes += 1
+                    elif reach & (1 << pusher) and not self.dead_mask & (1 << target):
+                        break
+                else:
+                    continue
+                break
+            else:
+                if pushes < best_pushes:
+                    best, best_pushes = border, pushes
+        return best
+
+    def walk(self, start: int, goal: int, boxes: int) -> list[int]:
+        """
+        Find the shortest walk from start to goal that does not push any box. Return a list of
+        Move.dir, or None if goal can not be reached.
+        """
+        neighbors = self.neighbors
+        came_from = {start: None}
+        queue = [start]
+        for cell in queue:
+            if cell == goal:
+                break
+            for direction, next_cell in enumerate(neighbors[cell]):
+                if next_cell < 0 or next_cell in came_from or boxes & (1 << next_cell):
+                    continue
+                came_from[next_cell] = (cell, direction)
+                queue.append(next_cell)
+        else:
+            return None
+
+        directions = []
+        while came_from[goal] is not None:
+            goal, direction = came_from[goal]
+            directions.append(direction)
+        directions.reverse()
+        return directions
+
+    def to_mask(self, positions) -> int:
+        """
+        Convert positions to a bitmask. Positions that are not floor cells are ignored.
+        """
+        mask = 0
+        for position in positions:
+            if position in self.index:
+                mask |= 1 << self.index[position]
+        return mask
+
+    def to_positions(self, mask: int) -> set[tuple[int]]:
+        """
+        Convert a bitmask back to a set of positions.
+        """
+        return {self.cells[i] for i in bits(mask)}
+
+
+class State:
+    """
+    A State object represents a certain game state. Only the hero cell number and the box bitmask
+    are stored, everything else is shared through the CompiledMap.
+    """
+
+    __slots__ = ("map", "hero", "boxes", "hash")
+
+    def __init__(self, map: CompiledMap, hero: int, boxes: int, hash: int = None) -> None:
 
         """
-        A set of tuples that stores the current position of the walls. E.g. {(1, 2), (1,5)}
+        The compiled map this state belongs to.
         """
-        self.walls = walls
+        self.map = map
 
         """
-        A set of tuples that stores the current position of the shelves. E.g. {(1, 2), (1,5)}
+        Cell number of the hero. E.g. 12
         """
-        self.shelves = shelves
+        self.hero = hero
 
         """
-        A set of tuples that stores the current position of the boxes. E.g. {(1, 2), (1,5)}
+        Bitmask of the cells that have a box. E.g. 0b1001 means cell 0 and cell 3.
         """
         self.boxes = boxes
 
         """
-        Hash value of the state. Different states should have different hash values.
+        Zobrist hash value of the state. Pass the hash when it has been derived incrementally
+        from the parent, otherwise it is computed from scratch.
         """
-        self.hash = hash((self.hero, frozenset(self.boxes)))
+        self.hash = hash if hash is not None else map.hash_of(hero, boxes)
 
     def __eq__(self, o: object) -> bool:
         if not isinstance(o, State):
             return False
-        return self.hash == o.hash
+        # Compare the content too, a hash collision must not merge two different states
+        return self.hash == o.hash and self.hero == o.hero and self.boxes == o.boxes
+
+    @property
+    def key(self) -> int:
+        """
+        The hero and the boxes packed into a single int, see CompiledMap.hero_bits.
+        """
+        return (self.boxes << self.map.hero_bits) | self.hero
+
+    @property
+    def hero_position(self) -> tuple[int]:
+        return self.map.cells[self.hero]
+
+    @property
+    def box_positions(self) -> set[tuple[int]]:
+        return self.map.to_positions(self.boxes)
 
     def next_state(self, direction: Move):
         """
         Find the next state given the move direction.
         """
 
-        hero_new_location = direction.move(self.hero)
+        map = self.map
+        neighbors = map.neighbors
+        hero_new_location = neighbors[self.hero][direction.dir]
 
-        if hero_new_location in self.walls:
+        if hero_new_location < 0:
             return None
 
-        new_boxes_location: set = self.boxes.copy()
+        boxes = self.boxes
+        new_hash = (
+            self.hash ^ map.hero_keys[self.hero] ^ map.hero_keys[hero_new_location]
+        )
+        hero_bit = 1 << hero_new_location
 
-        if hero_new_location in self.boxes:
-            pushed_box_location = direction.move(hero_new_location)
+        if boxes & hero_bit:
+            pushed_box_location = neighbors[hero_new_location][direction.dir]
 
-            if pushed_box_location in self.walls:
+            if pushed_box_location < 0:
                 return None
 
-            if pushed_box_location in self.boxes:
+            pushed_bit = 1 << pushed_box_location
+
+            if boxes & pushed_bit:
                 return None
 
-            new_boxes_location.discard(hero_new_location)
-            new_boxes_location.add(pushed_box_location)
+            boxes ^= hero_bit | pushed_bit
+            new_hash ^= map.box_keys[hero_new_location] ^ map.box_keys[pushed_box_location]
 
-        return State(hero_new_location, new_boxes_location, self.walls, self.shelves)
+        return State(map, hero_new_location, boxes, new_hash)
 
-    def generate_possible_next_states(self) -> list[object]:
+    def generate_possible_next_states(self) -> list[tuple]:
         """
         Generate the next possible states from the current state by trying to perform all the move
-        directions.
+        directions. Return a list of (Move.dir, State).
         """
         next_states = []
         for direction in [LEFT, RIGHT, UP, DOWN]:
             new_state = self.next_state(direction)
             if new_state is not None:
-                next_states.append(new_state)
+                next_states.append((direction.dir, new_state))
+
+        return next_states
+
+    def normalized(self):
+        """
+        The same state with the hero moved to the canonical cell of its reachable area.
+        """
+        hero = self.map.canonical_hero(self.hero, self.boxes)
+        if hero == self.hero:
+            return self
+        return State(self.map, hero, self.boxes)
+
+    def generate_possible_pushes(self) -> list[tuple]:
+        """
+        Generate the next possible states where one box has been pushed by one cell. Walking
+        around is free, so the hero of every resulting state is normalized. Return a list of
+        (Move.dir of the push, State).
+        """
+        map = self.map
+        neighbors = map.neighbors
+        hero_keys = map.hero_keys
+        box_keys = map.box_keys
+        boxes = self.boxes
+        reach = map.reachable(self.hero, boxes)
+        parent_hash = self.hash ^ hero_keys[self.hero]
+
+        next_states = []
+        for box in bits(boxes):
+            box_neighbors = neighbors[box]
+            for direction in range(4):
+                target = box_neighbors[direction]
+                if target < 0 or boxes & (1 << target):
+                    continue
+                # The hero stands on the opposite side of the box
+                pusher = box_neighbors[direction ^ 1]
+                if pusher < 0 or not reach & (1 << pusher):
+                    continue
+                new_boxes = boxes ^ (1 << box) ^ (1 << target)
+                hero = map.canonical_hero(box, new_boxes)
+                new_hash = parent_hash ^ hero_keys[hero] ^ box_keys[box] ^ box_keys[target]
+                next_states.append((direction, State(map, hero, new_boxes, new_hash)))
+
+        return next_states
+
+    def generate_macro_pushes(self) -> list[tuple]:
+        """
+        Like generate_possible_pushes, with macro moves that make several pushes of one box.
+        A box pushed into a one-wide tunnel, with the hero behind it in the tunnel, is pushed on
+        until it leaves the tunnel or reaches a shelf or the goal room entrance. A box pushed
+        onto the entrance of the goal room is pushed on to the next shelf of the fill order, and
+        the boxes already on their shelves in the room are not pushed again. The move of a macro
+        is Move.dir of its first push + 4 * (number of pushes - 1), see CompiledMap.macro_pushes.
+        """
+        map = self.map
+        neighbors = map.neighbors
+        tunnel = map.tunnel
+        hero_keys = map.hero_keys
+        box_keys = map.box_keys
+        boxes = self.boxes
+        reach = map.reachable(self.hero, boxes)
+        parent_hash = self.hash ^ hero_keys[self.hero]
+
+        # Shelf of the next box entering the goal room, -1 unless the room is filled in order
+        map.find_goal_room()
+        next_shelf = -1
+        if map.entrance >= 0:
+            room_boxes = boxes & map.room_mask
+            filled = count_bits(room_boxes)
+            if filled < len(map.fill_order) and room_boxes == map.fill_masks[filled]:
+                next_shelf = map.fill_order[filled]
+
+        next_states = []
+        for box in bits(boxes):
+            if next_shelf >= 0 and map.room_mask & (1 << box):
+                continue
+            box_neighbors = neighbors[box]
+            for direction in range(4):
+                target = box_neighbors[direction]
+                if target < 0 or boxes & (1 << target):
+                    continue
+                # The hero stands on the opposite side of the box
+                pusher = box_neighbors[direction ^ 1]
+                if pusher < 0 or not reach & (1 << pusher):
+                    continue
+                others = boxes ^ (1 << box)
+                pushes = 1
+                hero = box
+                if (
+                    target == map.entrance
+                    and direction == map.entrance_direction
+                    and next_shelf >= 0
+                    and map.room_path_free(others, next_shelf)
+                ):
+                    pushes += len(map.fill_paths[next_shelf])
+                    target = next_shelf
+                    hero = map.fill_previous[next_shelf]
+                else:
+                    while (
+                        tunnel[hero] & tunnel[target] & (1 << direction)
+                        and not map.shelf_mask & (1 << target)
+                        and target != map.entrance
+                    ):
+                        next_cell = neighbors[target][direction]
+                        if next_cell < 0 or (others | map.dead_mask) & (1 << next_cell):
+                            break
+                        hero, target = target, next_cell
+                        pushes += 1
+                new_boxes = others | (1 << target)
+                hero = map.canonical_hero(hero, new_boxes)
+                new_hash = parent_hash ^ hero_keys[hero] ^ box_keys[box] ^ box_keys[target]
+                next_states.append(
+                    (direction + 4 * (pushes - 1), State(map, hero, new_boxes, new_hash))
+                )
 
         return next_states
 
+    def generate_possible_pulls(self) -> list[tuple]:
+        """
+        Generate the previous possible states, where one box has been pulled by one cell: the hero
+        stands next to the box, steps away from it and drags the box along. Pushing the box back
+        leads to this state again. The hero of every resulting state is normalized. Return a list
+        of (Move.dir of the pull, State).
+        """
+        map = self.map
+        neighbors = map.neighbors
+        hero_keys = map.hero_keys
+        box_keys = map.box_keys
+        boxes = self.boxes
+        reach = map.reachable(self.hero, boxes)
+        parent_hash = self.hash ^ hero_keys[self.hero]
+
+        previous_states = []
+        for box in bits(boxes):
+            box_neighbors = neighbors[box]
+            for direction in range(4):
+                # The hero stands where the box goes and steps one cell further
+                target = box_neighbors[direction]
+                if target < 0 or not reach & (1 << target):
+                    continue
+                step = neighbors[target][direction]
+                if step < 0 or boxes & (1 << step):
+                    continue
+                new_boxes = boxes ^ (1 << box) ^ (1 << target)
+                hero = map.canonical_hero(step, new_boxes)
+                new_hash = parent_hash ^ hero_keys[hero] ^ box_keys[box] ^ box_keys[target]
+                previous_states.append((direction, State(map, hero, new_boxes, new_hash)))
+
+        return previous_states
+
+    def goal_states(self) -> list:
+        """
+        The solved states of the map, with all boxes on shelves, one per area the hero could be
+        standing in. The hero of every state is normalized.
+        """
+        map = self.map
+        boxes = map.shelf_mask
+        free = ((1 << len(map.cells)) - 1) & ~boxes
+        states = []
+        while free:
+            hero = (free & -free).bit_length() - 1
+            free &= ~map.reachable(hero, boxes)
+            states.append(State(map, hero, boxes))
+        return states
+
     def is_goal_state(self):
-        return self.boxes == self.shelves
+        return self.boxes == self.map.shelf_mask
 
-    def check_dead_end(self, deadends) -> bool:
+    def check_dead_end(self, deadends: int) -> bool:
         """
-        Check if any box in the current state is at the blocked position.
+        Check if any box in the current state is at the blocked position. deadends is a bitmask.
         """
 
-        for box in self.boxes:
-            if box in deadends:
-                return True
-        return False
+        return self.boxes & deadends != 0
 
+    def find_pi_corral(self) -> int:
+        """
+        Bitmask of the boxes fencing a PI-corral, or 0, see CompiledMap.pi_corral.
+        """
 
-class Node:
+        return self.map.pi_corral(self.hero, self.boxes)
+
+    def check_frozen(self, box: int) -> str:
+        """
+        Check if the box that has just been pushed to the given cell is stuck together with its
+        neighbors. Return the name of the rule that found the deadlock, or None.
+        """
+
+        if self.map.square_deadlock(self.boxes, box):
+            return "2x2 block"
+        if self.map.frozen_boxes(self.boxes, box) & ~self.map.shelf_mask:
+            return "frozen"
+        return None
+
+
+class PatternStore:
     """
-    Represents a node on a tree. Contains a State object associated with this node. No 2 nodes
-    have the same identical state.
+    Deadlock patterns learned during search, kept on disk so that later runs don't have to find
+    them again. A pattern is a set of boxes inside a small window around a pushed box. Patterns
+    are indexed by the walls, floor and shelves of the window, so the same pattern matches on
+    any map with the same local geometry. Least recently used patterns are evicted when the
+    store is full.
     """
 
-    def __init__(self, state: State, parent=None, h_function=None) -> None:
-        self.state = state
+    # The window is WIDTH x WIDTH cells, centered on the pushed box
+    RADIUS = 2
+    WIDTH = 2 * RADIUS + 1
+    # Window cell of the pushed box
+    CENTER = RADIUS * WIDTH + RADIUS
+    # Node standing for everything outside the window
+    OUTSIDE = WIDTH * WIDTH
+    # Bitmasks of the first and last column of the window
+    LEFT_COLUMN = int(("0" * (WIDTH - 1) + "1") * WIDTH, 2)
+    RIGHT_COLUMN = LEFT_COLUMN << (WIDTH - 1)
+    # Maximum number of states explored when trying to prove a deadlock
+    PROOF_LIMIT = 1000
+    # Maximum number of boxes in a window that is proven as a whole
+    MAX_BOXES = 4
+
+    def __init__(self, path: str = None, capacity: int = 10000) -> None:
+        self.path = path
+        self.capacity = capacity
+
+        """
+        Learned patterns as (geometry, boxes) keys, least recently used first.
+        """
+        self.patterns: OrderedDict = OrderedDict()
+
+        """
+        Box masks of the learned patterns, by window geometry.
+        """
+        self.index: dict[str, set[int]] = {}
+
+        """
+        Windows that could not be proven to be deadlocks during this run.
+        """
+        self.tested: set[tuple] = set()
+
+        # Window cells around the center of the window, the pushed box
+        self.around = 0
+        for dy in range(-1, 2):
+            for dx in range(-1, 2):
+                if dx or dy:
+                    self.around |= 1 << (PatternStore.CENTER + dy * PatternStore.WIDTH + dx)
+
+        # Window cells of the map cells, and neighbor tables of the window geometries
+        self.map: CompiledMap = None
+        self.windows: dict[int, tuple] = {}
+        self.graphs: dict[str, tuple] = {}
+
+        if path and os.path.exists(path):
+            self.load()
+
+    def load(self) -> None:
+        with open(self.path, "r") as store_file:
+            data = json.load(store_file)
+        if data.get("radius") != PatternStore.RADIUS:
+            return
+        for geometry, boxes in data["patterns"]:
+            self.add(geometry, boxes)
+
+    def save(self) -> None:
+        if not self.path:
+            return
+        data = {
+            "radius": PatternStore.RADIUS,
+            "patterns": [[geometry, boxes] for geometry, boxes in self.patterns],
+        }
+        # Write to a temporary file first so that a crash never leaves a broken store. Each
+        # save has its own file, so that processes saving at the same time do not mix theirs:
+        # the last one replaces the store as a whole.
+        store_file = tempfile.NamedTemporaryFile(
+            "w", dir=os.path.dirname(os.path.abspath(self.path)), suffix=".tmp", delete=False
+        )
+        try:
+            with store_file:
+                json.dump(data, store_file)
+            os.replace(store_file.name, self.path)
+        except BaseException:
+            os.remove(store_file.name)
+            raise
+
+    def add(self, geometry: str, boxes: int) -> None:
+        self.patterns[(geometry, boxes)] = True
+        self.index.setdefault(geometry, set()).add(boxes)
+        while len(self.patterns) > self.capacity:
+            (old_geometry, old_boxes), _ = self.patterns.popitem(last=False)
+            self.index[old_geometry].discard(old_boxes)
+            if not self.index[old_geometry]:
+                del self.index[old_geometry]
+
+    def window(self, map: CompiledMap, cell: int) -> tuple:
+        """
+        Return the geometry string of the window around cell, the window bit of every map cell
+        inside the window, and the bitmask of these map cells.
+        """
+        if map is not self.map:
+            self.map = map
+            self.windows = {}
+        if cell not in self.windows:
+            x0, y0 = map.cells[cell]
+            geometry = []
+            window_bits = {}
+            window_mask = 0
+            for y in range(y0 - PatternStore.RADIUS, y0 + PatternStore.RADIUS + 1):
+                for x in range(x0 - PatternStore.RADIUS, x0 + PatternStore.RADIUS + 1):
+                    map_cell = map.index.get((x, y), -1)
+                    if map_cell < 0:
+                        geometry.append(SokobanMap.WALL_CHAR)
+                        continue
+                    window_bits[map_cell] = 1 << len(geometry)
+                    window_mask |= 1 << map_cell
+                    if map.shelf_mask & (1 << map_cell):
+                        geometry.append(SokobanMap.SHELF_CHAR)
+                    else:
+                        geometry.append(SokobanMap.SPACE_CHAR)
+            self.windows[cell] = ("".join(geometry), window_bits, window_mask)
+        return self.windows[cell]
+
+    def check(self, state: State, cell: int) -> bool:
+        """
+        Check if the box that has just been pushed to cell is part of a deadlock pattern. Known
+        patterns are looked up first. Otherwise, try to prove that the window is a deadlock and
+        learn it.
+        """
+        geometry, window_bits, window_mask = self.window(state.map, cell)
+        window_boxes = state.boxes & window_mask
+        # A single box is left to the dead squares, and boxes all on shelves are never a deadlock
+        if not window_boxes & ~state.map.shelf_mask or count_bits(window_boxes) < 2:
+            return False
+
+        boxes = 0
+        for map_cell in bits(window_boxes):
+            boxes |= window_bits[map_cell]
+
+        for pattern in self.index.get(geometry, ()):
+            if pattern & boxes == pattern:
+                self.patterns.move_to_end((geometry, pattern))
+                return True
+
+        # Only try to prove windows where the pushed box touches another box and can not move
+        # along one of the axes anymore
+        if not boxes & self.around:
+            return False
+        neighbors = state.map.neighbors[cell]
+        if not any(
+            neighbors[first] < 0
+            or neighbors[second] < 0
+            or state.boxes & ((1 << neighbors[first]) | (1 << neighbors[second]))
+            for first, second in [(Move.DIR_LEFT, Move.DIR_RIGHT), (Move.DIR_UP, Move.DIR_DOWN)]
+        ):
+            return False
+        # Crowded windows are too big to prove, keep the pushed box and its neighbors only.
+        # Leaving boxes out can only make the window easier, so a deadlock without them is
+        # still a deadlock with them.
+        if count_bits(boxes) > PatternStore.MAX_BOXES:
+            boxes &= self.around | (1 << PatternStore.CENTER)
+        if (geometry, boxes) in self.tested:
+            return False
+        if not self.prove(geometry, boxes):
+            if len(self.tested) > self.capacity * 10:
+                self.tested.clear()
+            self.tested.add((geometry, boxes))
+            return False
+
+        # Drop the boxes that are not needed for the deadlock so the pattern matches more often
+        for box in bits(boxes):
+            if self.prove(geometry, boxes & ~(1 << box)):
+                boxes &= ~(1 << box)
+        self.add(geometry, boxes)
+        return True
+
+    def graph(self, geometry: str) -> tuple:
+        """
+        Neighbor table of a window geometry, indexed by Move.dir. -1 means a wall and OUTSIDE
+        means the neighbor is outside the window. Also return the bitmask of the floor cells and
+        the bitmask of the floor cells on the window border, connected to the outside.
+        """
+        if geometry not in self.graphs:
+            width = PatternStore.WIDTH
+            neighbors = []
+            floor = 0
+            border = 0
+            for cell in range(width * width):
+                x, y = cell % width, cell // width
+                cell_neighbors = []
+                for dx, dy in Move.DIR_MOVE_MAPPING.values():
+                    if not (0 <= x + dx < width and 0 <= y + dy < width):
+                        cell_neighbors.append(PatternStore.OUTSIDE)
+                    elif geometry[(y + dy) * width + x + dx] == SokobanMap.WALL_CHAR:
+                        cell_neighbors.append(-1)
+                    else:
+                        cell_neighbors.append((y + dy) * width + x + dx)
+                neighbors.append(tuple(cell_neighbors))
+                if geometry[cell] != SokobanMap.WALL_CHAR:
+                    floor |= 1 << cell
+                    if PatternStore.OUTSIDE in cell_neighbors:
+                        border |= 1 << cell
+            self.graphs[geometry] = (neighbors, floor, border)
+        return self.graphs[geometry]
+
+    def reachable(self, geometry: str, hero: int, boxes: int) -> int:
+        """
+        Flood fill the window nodes the hero can reach, with whole rows of bits at a time. The
+        outside is assumed to be open floor, which can only make the window easier to solve.
+        """
+        _, floor, border = self.graph(geometry)
+        width = PatternStore.WIDTH
+        outside = 1 << PatternStore.OUTSIDE
+        free = floor & ~boxes
+        reach = 1 << hero
+        while True:
+            if reach & (border | outside):
+                reach |= (border & free) | outside
+            grown = reach | (
+                (
+                    ((reach & ~PatternStore.RIGHT_COLUMN) << 1)
+                    | ((reach & ~PatternStore.LEFT_COLUMN) >> 1)
+                    | (reach << width)
+                    | (reach >> width)
+                )
+                & free
+            )
+            if grown == reach:
+                return reach
+            reach = grown
+
+    def prove(self, geometry: str, boxes: int) -> bool:
+        """
+        Search every push of the boxes inside the window, from every place the hero could be.
+        A box pushed out of the window is free and removed. Return True if no sequence of pushes
+        puts all the remaining boxes on shelves, False if one does or the search is too big.
+        """
+        neighbors, _, _ = self.graph(geometry)
+        shelves = 0
+        for cell, c in enumerate(geometry):
+            if c == SokobanMap.SHELF_CHAR:
+                shelves |= 1 << cell
+
+        # One start state per area the hero could be standing in
+        queue = []
+        covered = 0
+        for hero in [PatternStore.OUTSIDE, *range(len(geometry))]:
+            if (covered | boxes) & (1 << hero):
+                continue
+            if hero != PatternStore.OUTSIDE and geometry[hero] == SokobanMap.WALL_CHAR:
+                continue
+            region = self.reachable(geometry, hero, boxes)
+            covered |= region
+            queue.append((region, boxes))
+        seen = {(region & -region, boxes) for region, boxes in queue}
+
+        if any(not boxes & ~shelves for _, boxes in queue):
+            return False
+
+        # Depth first, a way out is usually found after a few pushes
+        while queue:
+            region, boxes = queue.pop()
+            if len(seen) > PatternStore.PROOF_LIMIT:
+                return False
+            # Pushing a box out of the window never makes the others harder: they keep their
+            # places and the hero gets more room. So when a box can go out, that is the only
+            # push tried from this state.
+            pushes = []
+            for box in bits(boxes):
+                for direction in range(4):
+                    target = neighbors[box][direction]
+                    pusher = neighbors[box][direction ^ 1]
+                    if target < 0 or pusher < 0 or not region & (1 << pusher):
+                        continue
+                    if target == PatternStore.OUTSIDE:
+                        pushes = [(box, target)]
+                        break
+                    if not boxes & (1 << target):
+                        pushes.append((box, target))
+                else:
+                    continue
+                break
+            for box, target in pushes:
+                if target == PatternStore.OUTSIDE:
+                    new_boxes = boxes & ~(1 << box)
+                else:
+                    new_boxes = boxes ^ (1 << box) ^ (1 << target)
+                if not new_boxes & ~shelves:
+                    return False
+                new_region = self.reachable(geometry, box, new_boxes)
+                key = (new_region & -new_region, new_boxes)
+                if key not in seen:
+                    seen.add(key)
+                    queue.append((new_region, new_boxes))
+
+        return True
+
+
+class Node:
+    """
+    Represents a node on a tree. No 2 nodes have the same identical state. To keep the search
+    tree small, a node does not keep its State object, only the packed state key, and the move
+    that leads to it from its parent.
+    """
+
+    __slots__ = ("map", "key", "hash", "g", "h", "move", "parent")
+
+    def __init__(
+        self,
+        state: State,
+        parent=None,
+        h_function=None,
+        move: int = None,
+        parent_state: State = None,
+    ) -> None:
+        self.map = state.map
+
+        """
+        Packed state key, see State.key.
+        """
+        self.key = state.key
+        self.hash = state.hash
+
+        """
+        Move.dir of the step (or of the push, at push level) from the parent to this node.
+        """
+        self.move = move
+
+        """
+        g(n) = cost of the cheapest path from the initial node to this node.
+        Also equals to the height of the current node.
+        """
+        self.g = 0
+
+        if parent and isinstance(parent, Node):
+            # A macro move makes several pushes, see State.generate_macro_pushes
+            self.g = parent.g + 1 + (move >> 2 if move else 0)
+        self.parent = parent
+
+        """
+        h(n) = cost of the cheapest path from this node to the goal node. The parent state is
+        given to the function so that it can update incrementally.
+        """
+        if callable(h_function):
+            if parent_state is None and parent is not None:
+                parent_state = parent.state
+            self.h = h_function(state, parent_state)
+        else:
+            self.h = None
+
+    @property
+    def state(self) -> State:
+        """
+        Rebuild the State object of this node.
+        """
+        return State(
+            self.map, self.key & self.map.hero_mask, self.key >> self.map.hero_bits, self.hash
+        )
+
+    def __eq__(self, o: object) -> bool:
+        if not isinstance(o, Node):
+            return False
+        return self.hash == o.hash and self.key == o.key
+
+    def __lt__(self, o: object) -> bool:
+
+        if not isinstance(o, Node):
+            raise Exception(
+                "Wrong comparing type: " + str(type(self)) + " and " + str(type(o))
+            )
+
+        if self.h is None:
+            raise Exception("H value is None")
+
+        if self.g + self.h == o.g + o.h:
+            return self.g > o.g
+
+        return self.g + self.h < o.g + o.h
+
+    def is_goal_node(self):
+        return self.key >> self.map.hero_bits == self.map.shelf_mask
+
+    def __hash__(self) -> int:
+        return self.hash
+
+
+class TranspositionTable:
+    """
+    Open addressing hash table of the states and the best g found for each of them. It lives
+    in flat buffers allocated up front, so it never grows past its memory budget. It can be used
+    in place of the StateTable of a Tree: a node is "in" the table if its state has been stored
+    with a g that is not worse.
+
+    Each slot holds the 64 bit hash, g + 1 (0 marks an empty slot), the IDA* iteration that
+    stored it (for the other searches, 1 once the state has been expanded, see close), a lower
+    bound of h (see visit) and the packed state key as fixed width bytes, which is compared to
+    confirm a hit. When all the slots a state may use are taken, a state that has not been
+    expanded yet is replaced first: forgetting an expanded one lets the search expand its whole
+    subtree again. Among those, the one with the highest g is replaced: states close to the
+    root are the most expensive to find again.
+
+    A search that marks the states it expands with close gives keep_expanded. store raises a
+    MemoryError once it has replaced more expanded states than the table has slots: the budget
+    is too small for the level, and the search would spend its time expanding them again.
+    """
+
+    # Number of slots a state may use, starting at its hash
+    MAX_PROBES = 8
+    # Budget in bytes of the searches that always need a table, e.g. IDA*
+    DEFAULT_MEMORY = 64 * 1024 * 1024
+
+    def __init__(self, map: CompiledMap, max_memory: int, keep_expanded: bool = False) -> None:
+        """
+        max_memory is the budget of the table in bytes.
+        """
+        self.keep_expanded = keep_expanded
+        self.key_size = (map.hero_bits + len(map.cells) + 7) // 8
+        slot_size = 8 + 4 + 4 + 4 + self.key_size
+
+        # Largest power of two number of slots that fits in the budget
+        self.capacity = 1
+        while self.capacity * 2 * slot_size <= max_memory:
+            self.capacity *= 2
+        self.mask = self.capacity - 1
+
+        self.hashes = memoryview(bytearray(8 * self.capacity)).cast("Q")
+        self.g_buffer = bytearray(4 * self.capacity)
+        self.g_values = memoryview(self.g_buffer).cast("I")
+        self.iterations = memoryview(bytearray(4 * self.capacity)).cast("I")
+        self.bounds = memoryview(bytearray(4 * self.capacity)).cast("f")
+        self.keys = bytearray(self.key_size * self.capacity)
+
+        # Statistics
+        self.size = 0
+        self.lookups = 0
+        self.probes = 0
+        self.replacements = 0
+        self.forgotten_expanded = 0
+
+    def find(self, hash: int, key: bytes) -> int:
+        """
+        Return the slot of the state, or -1 if it is not in the table.
+        """
+        self.lookups += 1
+        key_size = self.key_size
+        for probe in range(TranspositionTable.MAX_PROBES):
+            slot = (hash + probe) & self.mask
+            self.probes += 1
+            # Slots are never emptied, so the state can not be further away
+            if not self.g_values[slot]:
+                return -1
+            if (
+                self.hashes[slot] == hash
+                and self.keys[slot * key_size : (slot + 1) * key_size] == key
+            ):
+                return slot
+        return -1
+
+    def best_g(self, node: Node) -> int:
+        """
+        The best g stored for the state of the node, None if it is not in the table.
+        """
+        slot = self.find(node.hash, node.key.to_bytes(self.key_size, "little"))
+        return self.g_values[slot] - 1 if slot >= 0 else None
+
+    def __contains__(self, node: Node) -> bool:
+        g = self.best_g(node)
+        return g is not None and g <= node.g
+
+    def add(self, node: Node) -> None:
+        key = node.key.to_bytes(self.key_size, "little")
+        slot = self.find(node.hash, key)
+        if slot >= 0:
+            if node.g + 1 < self.g_values[slot]:
+                self.g_values[slot] = node.g + 1
+            return
+        self.store(node, key)
+
+    def visit(self, node: Node, iteration: int) -> float:
+        """
+        Check and record a node visited by the given IDA* iteration. Return None if the state
+        is stored with a lower g, or with the same g by this iteration: nothing new can be found
+        below the node. The table is kept across the iterations, so the states reached by a
+        worse path in an earlier iteration are skipped at once. Otherwise return the lower bound
+        of h stored by update_bound, 0 for a new state.
+        """
+        key = node.key.to_bytes(self.key_size, "little")
+        slot = self.find(node.hash, key)
+        if slot < 0:
+            slot = self.store(node, key)
+        else:
+            g = self.g_values[slot] - 1
+            if g < node.g or g == node.g and self.iterations[slot] == iteration:
+                return None
+            self.g_values[slot] = node.g + 1
+        self.iterations[slot] = iteration
+        return self.bounds[slot]
+
+    def close(self, node: Node) -> None:
+        """
+        Mark the state of the node as expanded, if it is still in the table.
+        """
+        slot = self.find(node.hash, node.key.to_bytes(self.key_size, "little"))
+        if slot >= 0:
+            self.iterations[slot] = 1
+
+    def update_bound(self, node: Node, h: float) -> None:
+        """
+        Raise the lower bound of h of the state of the node, if it is still in the table.
+        """
+        slot = self.find(node.hash, node.key.to_bytes(self.key_size, "little"))
+        if slot >= 0 and h > self.bounds[slot]:
+            self.bounds[slot] = h
+
+    def store(self, node: Node, key: bytes) -> int:
+        """
+        Store a state that is not in the table. Return its slot.
+        """
+        # Take the first empty slot, or replace the one with the highest g, preferring the
+        # states that have not been expanded
+        slot = -1
+        iterations = self.iterations
+        g_values = self.g_values
+        for probe in range(TranspositionTable.MAX_PROBES):
+            candidate = (node.hash + probe) & self.mask
+            if not g_values[candidate]:
+                slot = candidate
+                self.size += 1
+                break
+            if slot < 0 or (not iterations[candidate], g_values[candidate]) > (
+                not iterations[slot],
+                g_values[slot],
+            ):
+                slot = candidate
+        else:
+            self.replacements += 1
+            if self.keep_expanded and iterations[slot]:
+                self.forgotten_expanded += 1
+                if self.forgotten_expanded > self.capacity:
+                    raise MemoryError(
+                        "--max-memory is too small for this level, the search has forgotten "
+                        + str(self.forgotten_expanded)
+                        + " expanded states, more than the "
+                        + str(self.capacity)
+                        + " the table holds"
+                    )
+
+        self.hashes[slot] = node.hash
+        self.g_values[slot] = node.g + 1
+        self.keys[slot * self.key_size : (slot + 1) * self.key_size] = key
+        self.iterations[slot] = 0
+        self.bounds[slot] = 0
+        return slot
+
+    def clear(self) -> None:
+        """
+        Forget every state but keep the buffers, so the table can be reused without allocating.
+        """
+        self.g_buffer[:] = bytes(len(self.g_buffer))
+        self.size = 0
+
+    def load_factor(self) -> float:
+        return self.size / self.capacity
+
+    def stats(self) -> str:
+        return (
+            "load factor "
+            + str(round(self.load_factor(), 4))
+            + ", average probes "
+            + str(round(self.probes / max(self.lookups, 1), 2))
+            + ", replacements "
+            + str(self.replacements)
+        )
+
+
+class StateTable:
+    """
+    The best g found for each state, in a dict by packed state key. It has no size limit, see
+    TranspositionTable for the same methods within a memory budget.
+    """
+
+    def __init__(self) -> None:
+        self.g_values: dict[int, int] = {}
+
+    def best_g(self, node: Node) -> int:
+        return self.g_values.get(node.key)
+
+    def __contains__(self, node: Node) -> bool:
+        g = self.g_values.get(node.key)
+        return g is not None and g <= node.g
+
+    def add(self, node: Node) -> None:
+        g = self.g_values.get(node.key)
+        if g is None or node.g < g:
+            self.g_values[node.key] = node.g
+
+    def clear(self) -> None:
+        self.g_values.clear()
+
+    def __len__(self) -> int:
+        return len(self.g_values)
+
+
+class BucketQueue:
+    """
+    Priority queue of Nodes for integer f(n) = g + h, a drop-in replacement of heapq. There is
+    one bucket per f, split by g, and each (f, g) pair is a stack. Like Node.__lt__, the lowest
+    f comes first and the highest g breaks ties, the last inserted node among equals. Push is
+    O(1), pop is O(1) amortized as the pointers only move over empty buckets.
+
+    f is truncated to an int. Nodes with an infinite f can never lead to a solution and are
+    dropped.
+    """
+
+    def __init__(self) -> None:
+        # Stacks of nodes, buckets[f][g]
+        self.buckets: list[list[list[Node]]] = []
+        # Highest g of each f that may have nodes, -1 if the bucket is empty
+        self.top: list[int] = []
+        # No bucket below this f has nodes
+        self.min_f = 0
+        self.size = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def insert(self, node: Node) -> None:
+        f = node.g + node.h
+        if f == float("inf"):
+            return
+        f = int(f)
+        g = node.g
+        buckets = self.buckets
+        while len(buckets) <= f:
+            buckets.append([])
+            self.top.append(-1)
+        bucket = buckets[f]
+        while len(bucket) <= g:
+            bucket.append([])
+        bucket[g].append(node)
+        if g > self.top[f]:
+            self.top[f] = g
+        if f < self.min_f:
+            self.min_f = f
+        self.size += 1
+
+    def pop(self) -> Node:
+        if not self.size:
+            raise IndexError("pop from an empty queue")
+        top = self.top
+        f = self.min_f
+        while top[f] < 0:
+            f += 1
+        self.min_f = f
+
+        bucket = self.buckets[f]
+        g = top[f]
+        node = bucket[g].pop()
+        while g >= 0 and not bucket[g]:
+            g -= 1
+        top[f] = g
+        self.size -= 1
+        return node
+
+
+DFS = 0
+A_STAR = 1
+IDA_STAR = 2
+BIDIRECTIONAL = 3
+
+# Minimum time in seconds between two progress lines of a search
+PROGRESS_INTERVAL = 0.2
+
+# First weight of the anytime A* search, and how much it is lowered after each solution
+ANYTIME_WEIGHT = 3.0
+ANYTIME_STEP = 0.5
+
+
+class Tree:
+    """
+    The state space tree. Store and manage closed and open Nodes.
+    Use this object to start search process.
+    """
+
+    def __init__(
+        self,
+        root: Node,
+        deadends=0,
+        print_state=True,
+        print_progress=True,
+        search_type=DFS,
+        heuristic_function=None,
+        push_level=False,
+        macros=False,
+        corrals=False,
+        patterns: PatternStore = None,
+        max_memory: int = None,
+        workers: int = 1,
+        weight: float = ANYTIME_WEIGHT,
+        bucket_queue=False,
+        admissible=True,
+        timers=False,
+        stats_file=None,
+        stats_interval: float = 1,
+    ) -> None:
+
+        """
+        Best g of every state that has been queued or examined. A child is only queued if it
+        improves on it, and a node popped with a worse g than the best is skipped, so the open
+        queue holds no useless duplicates and examined states are reopened when a cheaper path
+        to them is found (except by DFS). With a memory budget (in bytes), a TranspositionTable
+        of that size is used instead of a StateTable. IDA* always uses a TranspositionTable.
+        """
+        if search_type == IDA_STAR and not max_memory:
+            max_memory = TranspositionTable.DEFAULT_MEMORY
+        if max_memory:
+            self.closed = TranspositionTable(
+                root.map, max_memory, keep_expanded=search_type != IDA_STAR
+            )
+        else:
+            self.closed = StateTable()
+        self.closed.add(root)
+
+        """
+        Bitmask of the box positions that are blocked and there exists no way to solution.
+        """
+        self.deadends: int = deadends
+
+        """
+        Current node being examined in the tree. Initialized with the root node.
+        """
+        self.current_node = root
+
+        """
+        Nodes that have been generated, but have not examined. A list, or a BucketQueue.
+        """
+        self.open: list[Node] = []
+
+        if search_type == DFS:
+
+            """
+            Use stack-like operations on the list.
+            """
+            self.pop = self.open.pop
+            self.insert = self.open.append
+
+        elif search_type == A_STAR and bucket_queue:
+
+            """
+            Use a BucketQueue, only for heuristics that give integers.
+            """
+            self.open = BucketQueue()
+            self.pop = self.open.pop
+            self.insert = self.open.insert
+
+        elif search_type == A_STAR:
+
+            """
+            Use priority-queue-like operations on the list.
+            heapq uses the Node class' __lt__ function to compare priority.
+            """
+            self.pop = lambda: heapq.heappop(self.open)
+            self.insert = lambda node: heapq.heappush(self.open, node)
+
+        elif search_type == BIDIRECTIONAL:
+
+            """
+            Two priority queues, self.open for the pushes from the initial state and
+            self.backward_open for the pulls from the goal states.
+            """
+            self.backward_open: list[Node] = []
+            self.pop = lambda: heapq.heappop(self.open)
+            self.insert = lambda node: heapq.heappush(self.open, node)
+            self.backward_pop = lambda: heapq.heappop(self.backward_open)
+            self.backward_insert = lambda node: heapq.heappush(self.backward_open, node)
+
+        elif search_type == IDA_STAR:
+
+            """
+            The open list is not used, every iteration is a depth first search bounded by f(n).
+            """
+            self.pop = None
+            self.insert = None
+
+        else:
+            raise Exception("Illegal search type.")
+
+        self.search_type = search_type
+
+        """
+        Function that calculate h(n).
+        """
+        self.heuristic_function = heuristic_function
+
+        """
+        Function that generates the child states. At push level every edge is a box push and the
+        states are normalized, see State.generate_possible_pushes. With macros, a push along a
+        tunnel or into the goal room can go on for several cells, see
+        State.generate_macro_pushes.
+        """
+        self.push_level = push_level
+        self.macros = macros
+        if push_level and macros:
+            self.expand = State.generate_macro_pushes
+        elif push_level:
+            self.expand = State.generate_possible_pushes
+        else:
+            self.expand = State.generate_possible_next_states
+
+        """
+        With corrals, a push level state with a PI-corral only gets the pushes of the boxes that
+        fence it, see CompiledMap.pi_corral.
+        """
+        self.corrals = corrals and push_level
+        self.find_corral = State.find_pi_corral
+
+        """
+        With print_state, the visited nodes are drawn by a Renderer on its own thread, and the
+        progress line goes below the drawing.
+        """
+        self.print_state = print_state
+        self.renderer = Renderer() if print_state else None
+        # Write the number of visited nodes to the console, at most every PROGRESS_INTERVAL
+        self.print_progress = print_progress
+        self.last_progress = 0
+        self.time_init = time.time()
+
+        """
+        File object where the statistics are written as a JSON line every stats_interval
+        seconds, see stats. None to disable.
+        """
+        self.stats_file = stats_file
+        self.stats_interval = stats_interval
+        self.last_stats = self.time_init
+
+        self.total_visited = 0
+        # Children and popped nodes dropped because their state is known with a better g
+        self.duplicates = 0
+        # Nodes visited by the backward search, included in total_visited
+        self.backward_visited = 0
+
+        """
+        Number of generated states that have been dropped, by the deadlock rule that found them.
+        """
+        self.pruned: dict[str, int] = {
+            "dead square": 0,
+            "2x2 block": 0,
+            "frozen": 0,
+            "learned": 0,
+            "PI-corral": 0,
+        }
+
+        """
+        Store of the learned deadlock patterns, None to disable learning.
+        """
+        self.patterns = patterns
+
+        """
+        Number of processes of the A* search, see search_parallel. The number of nodes visited
+        by each of them is kept for the statistics.
+        """
+        self.workers = workers
+        self.worker_visited: list[int] = []
+
+        """
+        First weight of h(n) in the anytime search, see search_anytime. Every improved solution
+        or bound is kept as (time since the start, cost, suboptimality bound). The bound is None
+        until the round that found the solution is over.
+        """
+        self.weight = weight
+        self.solutions: list[tuple] = []
+        # Whether h never overestimates, only then can it prune the anytime search
+        self.admissible = admissible
+
+        """
+        (f(n) threshold, number of visited nodes) of each finished IDA* iteration.
+        """
+        self.iterations: list[tuple] = []
+
+        self.time_limit = None
+        self.best_solution: Node = None
+
+        """
+        Lookup and update of the best g of the states, see self.closed.
+        """
+        self.lookup = self.closed.best_g
+        self.record = self.closed.add
+        # Marks the expanded states, which a full TranspositionTable keeps over the others
+        self.close = None
+        if isinstance(self.closed, TranspositionTable) and self.closed.keep_expanded:
+            self.close = self.closed.close
+        # IDA* checks and records its nodes with these instead, see TranspositionTable.visit
+        if search_type == IDA_STAR:
+            self.visit = self.closed.visit
+            self.update_bound = self.closed.update_bound
+
+        """
+        Time spent in each step of the search in seconds, and the number of calls, by step.
+        Only measured when timers is True, see enable_timers.
+        """
+        self.timers: dict[str, float] = {}
+        self.calls: dict[str, int] = {}
+        if timers:
+            self.enable_timers()
+
+    def enable_timers(self) -> None:
+        """
+        Replace the functions called for every node with wrappers that measure them:
+        successors (includes the incremental Zobrist hashing), deadlocks, corrals, heuristic,
+        closed (lookups and updates of the best g) and queue (inserts and pops). A search with
+        its own queue wraps it when it starts, see search_anytime. The steps a search does not
+        use keep 0 calls.
+        """
+        self.expand = self.timed("successors", self.expand)
+        self.check_deadlock = self.timed("deadlocks", self.check_deadlock)
+        if self.corrals:
+            self.find_corral = self.timed("corrals", self.find_corral)
+        if self.heuristic_function is not None:
+            self.heuristic_function = self.timed("heuristic", self.heuristic_function)
+        self.lookup = self.timed("closed", self.lookup)
+        self.record = self.timed("closed", self.record)
+        if self.close is not None:
+            self.close = self.timed("closed", self.close)
+        if self.search_type == IDA_STAR:
+            self.visit = self.timed("closed", self.visit)
+            self.update_bound = self.timed("closed", self.update_bound)
+        if self.insert is not None:
+            self.insert = self.timed("queue", self.insert)
+            self.pop = self.timed("queue", self.pop)
+        if self.search_type == BIDIRECTIONAL:
+            self.backward_insert = self.timed("queue", self.backward_insert)
+            self.backward_pop = self.timed("queue", self.backward_pop)
+
+    def timed(self, name: str, function):
+        """
+        Wrap the function so that its time and calls are added to self.timers[name] and
+        self.calls[name].
+        """
+        timers = self.timers
+        calls = self.calls
+        timers[name] = 0
+        calls[name] = 0
+        clock = time.perf_counter
+
+        def wrapper(*args):
+            start = clock()
+            try:
+                return function(*args)
+            finally:
+                timers[name] += clock() - start
+                calls[name] += 1
+
+        return wrapper
+
+    def stats(self) -> dict:
+        """
+        Statistics of the search so far, as a dict that can be written as JSON.
+        """
+        elapsed = time.time() - self.time_init
+        return {
+            "time": round(elapsed, 3),
+            "visited": self.total_visited,
+            "nodes_per_second": round(self.total_visited / (elapsed + 0.01), 1),
+            # IDA* keeps no open queue
+            "open": len(self.open) if self.search_type != IDA_STAR else None,
+            "duplicates": self.duplicates,
+            "pruned": self.pruned,
+            "solutions": self.solutions,
+            "timers": {name: round(value, 4) for name, value in self.timers.items()},
+            "calls": self.calls,
+        }
+
+    def write_stats(self) -> None:
+        if self.stats_file is not None:
+            self.stats_file.write(json.dumps(self.stats()) + "\n")
+            self.stats_file.flush()
+
+    def report_progress(self, details: dict = None) -> None:
+        """
+        Called for every visited node. Write the progress line to the console and the statistics
+        to the stats file, each only when its interval has passed.
+        """
+        if not self.print_progress and self.stats_file is None:
+            return
+        now = time.time()
+        if self.print_progress and now - self.last_progress >= PROGRESS_INTERVAL:
+            self.last_progress = now
+            line = "Total nodes visited: " + str(self.total_visited)
+            for label, value in (details or {}).items():
+                line += " | " + label + ": " + str(value)
+            line += " | Average speed: " + str(
+                round(self.total_visited / (now - self.time_init + 0.01), 2)
+            )
+            if self.renderer is not None:
+                self.renderer.status = line
+            else:
+                sys.stdout.write(line + "\r")
+        if self.stats_file is not None and now - self.last_stats >= self.stats_interval:
+            self.last_stats = now
+            self.write_stats()
+
+    def report_solution(self) -> None:
+        """
+        Called for every new entry of self.solutions. Write it on its own line to the console,
+        and the statistics to the stats file.
+        """
+        found_at, cost, bound = self.solutions[-1]
+        if self.print_progress:
+            line = (
+                "Solution of cost "
+                + str(cost)
+                + (" (bound " + str(round(bound, 2)) + ")" if bound is not None else "")
+                + " at "
+                + str(round(found_at, 2))
+                + "s"
+            )
+            if self.renderer is not None:
+                self.renderer.status = line
+            else:
+                sys.stdout.write(line + "\n")
+        self.write_stats()
+
+    def check_deadlock(self, state: State, parent_boxes: int) -> str:
+        """
+        Check if the state, generated from a state with the given boxes, can never reach the
+        goal. Return the name of the rule that found the deadlock, or None.
+        """
+        # If any of the box is at the blocked position, the state can never reach the goal
+        if state.check_dead_end(self.deadends):
+            return "dead square"
+
+        # If a box has been pushed, check whether it got stuck with its neighbors
+        pushed = state.boxes & ~parent_boxes
+        if pushed:
+            rule = state.check_frozen(pushed.bit_length() - 1)
+            if rule:
+                return rule
+            if self.patterns is not None and self.patterns.check(
+                state, pushed.bit_length() - 1
+            ):
+                return "learned"
+        return None
+
+    def generate_children(self, node: Node, state: State) -> list[Node]:
+        """
+        Generate the child nodes of the given node, whose State is given. Children that are
+        deadlocked, or that do not push a box fencing a PI-corral, are dropped and counted in
+        self.pruned.
+        """
+        children = []
+        parent_boxes = state.boxes
+        fence = self.find_corral(state) if self.corrals else 0
+        for move, child_state in self.expand(state):
+            if fence and not parent_boxes & ~child_state.boxes & fence:
+                self.pruned["PI-corral"] += 1
+                continue
+            # Do not insert deadlocked states into the open queue
+            rule = self.check_deadlock(child_state, parent_boxes)
+            if rule:
+                self.pruned[rule] += 1
+                continue
+            children.append(
+                Node(
+                    state=child_state,
+                    parent=node,
+                    h_function=self.heuristic_function,
+                    move=move,
+                    parent_state=state,
+                )
+            )
+        return children
+
+    def search(
+        self,
+        # Continue finding the best solution by traversing through all nodes of the tree
+        seek_optimal=False,
+        # Stop searching after time limit is reached, even if seek_optimal is True
+        time_limit=None,
+    ):
+        """
+        Function that starts and keeps track of the search. Search algorithm is determined by
+        self.search_type. Generate next nodes, check deadend, insert and pop the open queue to
+        travel the tree. Terminate if reach the time limit. Continue searching for optimal solution
+        if demanded.
+        """
+
+        if self.renderer is not None:
+            self.renderer.start()
+        try:
+            return self.search_by_type(seek_optimal, time_limit)
+        finally:
+            if self.renderer is not None:
+                self.renderer.stop()
+
+    def search_by_type(self, seek_optimal=False, time_limit=None):
+        """
+        Run the search algorithm of self.search_type, see search.
+        """
+        if self.search_type == IDA_STAR:
+            return self.search_iterative_deepening(time_limit)
+        if self.search_type == BIDIRECTIONAL:
+            return self.search_bidirectional(time_limit)
+        if self.workers > 1:
+            return self.search_parallel(seek_optimal, time_limit)
+        if seek_optimal and self.search_type == A_STAR:
+            return self.search_anytime(time_limit)
+
+        while True:
+            # Print state to console
+            if self.print_state:
+                self.renderer.submit(self.current_node)
+            self.report_progress()
+
+            # Stop search if time limit is reached
+            if time_limit and time.time() - self.time_init > time_limit:
+                return self.best_solution
+
+            if self.current_node.is_goal_node():
+                # Update with the best solution so far
+                if not self.best_solution or self.current_node.g < self.best_solution.g:
+                    self.best_solution = self.current_node
+
+                if not seek_optimal:
+                    return self.current_node
+
+            # A goal node is not expanded, the search goes on with the next one
+            else:
+                if self.close is not None:
+                    self.close(self.current_node)
+                for new_node in self.generate_children(
+                    self.current_node, self.current_node.state
+                ):
+                    # DFS never reopens a state, its g has nothing to do with the solution found
+                    best_g = self.lookup(new_node)
+                    if best_g is not None and (
+                        best_g <= new_node.g or self.search_type == DFS
+                    ):
+                        self.duplicates += 1
+                        continue
+                    self.record(new_node)
+                    self.insert(new_node)
+
+            # Take the next node, skipping the ones whose state has been queued again with a
+            # lower g since (lazy deletion)
+            while self.open:
+                self.current_node = self.pop()
+                best_g = self.lookup(self.current_node)
+                if best_g is None or best_g >= self.current_node.g:
+                    break
+                self.duplicates += 1
+            else:
+                break
+            self.total_visited += 1
+
+        return self.best_solution
+
+    def search_anytime(self, time_limit=None):
+        """
+        Anytime repairing A* (ARA*). The nodes are ordered by g + weight * h, which finds a first
+        solution quickly when the weight is high. Then the weight is lowered step by step down
+        to 1, and each round continues from the nodes left by the previous one instead of
+        starting over: the open queue is kept, and the nodes that got a cheaper g after they
+        had been expanded during the round are queued again for the next one.
+
+        Nodes whose g + h is not below the cost of the best solution are dropped. Every
+        improved solution, and every tighter suboptimality bound, is added to self.solutions and
+        reported at once, see report_solution. A solution costs at most bound times the optimal.
+        The search ends when the bound reaches 1 or the time limit, and the best solution so far
+        is returned.
+
+        This only holds if h never overestimates. Otherwise (not self.admissible), h only orders
+        the queue: the nodes are dropped when their g is not below the cost, the round goes on
+        until the queue is empty, and only then is the bound 1.
+
+        The best g of the states is kept in self.closed like in search, so --max-memory applies.
+        The open queue is a heap ordered by g + weight * h, whatever the queue of the Tree.
+        """
+
+        root = self.current_node
+        weight = self.weight
+        # Queue of (g + weight * h, -g, order, node), stale entries are skipped when popped
+        self.open = []
+        # Keys of the nodes expanded in the current round
+        expanded: set[int] = set()
+        # Nodes that got a cheaper g after being expanded in the current round
+        inconsistent: dict[int, Node] = {}
+        cost = float("inf")
+        order = 0
+        admissible = self.admissible
+
+        def lower_bound(node: Node) -> float:
+            # Lowest cost of a solution through the node
+            return node.g + node.h if admissible else node.g
+
+        def push(node: Node) -> None:
+            nonlocal order
+            order += 1
+            heapq.heappush(self.open, (node.g + weight * node.h, -node.g, order, node))
+
+        def pop() -> Node:
+            return heapq.heappop(self.open)[3]
+
+        if self.timers:
+            push = self.timed("queue", push)
+            pop = self.timed("queue", pop)
+
+        def publish(node: Node) -> None:
+            nonlocal cost
+            cost = node.g
+            self.best_solution = node
+            self.solutions.append((time.time() - self.time_init, cost, None))
+            self.report_solution()
+
+        if root.is_goal_node():
+            publish(root)
+            return root
+        push(root)
+
+        while True:
+            # Expand until no queued node can lead to a cheaper solution with this weight
+            while self.open and (self.open[0][0] < cost or not admissible):
+                # Print state to console
+                if self.print_state:
+                    self.renderer.submit(self.current_node)
+                self.report_progress({"Weight": weight, "Best": cost})
+
+                # Stop search if time limit is reached
+                if time_limit and time.time() - self.time_init > time_limit:
+                    return self.best_solution
+
+                node = pop()
+                if node.key in expanded or lower_bound(node) >= cost:
+                    continue
+                best_g = self.lookup(node)
+                if best_g is not None and best_g < node.g:
+                    self.duplicates += 1
+                    continue
+                expanded.add(node.key)
+                self.current_node = node
+                self.total_visited += 1
+
+                for child in self.generate_children(node, node.state):
+                    if lower_bound(child) >= cost:
+                        continue
+                    best_g = self.lookup(child)
+                    if best_g is not None and best_g <= child.g:
+                        self.duplicates += 1
+                        continue
+                    self.record(child)
+                    if child.is_goal_node():
+                        publish(child)
+                    elif child.key in expanded and admissible:
+                        inconsistent[child.key] = child
+                    else:
+                        # Without a bound to prove, a cheaper node is expanded again at once
+                        expanded.discard(child.key)
+                        push(child)
+
+            # The optimal cost is at least the lowest bound of the nodes that are left
+            lower = min(
+                [lower_bound(entry[3]) for entry in self.open]
+                + [lower_bound(node) for node in inconsistent.values()],
+                default=float("inf"),
+            )
+            if self.best_solution is not None:
+                bound = max(1, min(weight, cost / lower) if lower > 0 else weight)
+                found_at, _, last_bound = self.solutions[-1]
+                if last_bound is None:
+                    self.solutions[-1] = (found_at, cost, bound)
+                    self.report_solution()
+                elif bound < last_bound:
+                    self.solutions.append((time.time() - self.time_init, cost, bound))
+                    self.report_solution()
+            if weight <= 1 or lower >= cost:
+                break
+
+            # Lower the weight and queue the nodes of both lists again with the new priority
+            weight = max(1, weight - ANYTIME_STEP)
+            nodes = [entry[3] for entry in self.open] + list(inconsistent.values())
+            self.open = []
+            for node in nodes:
+                best_g = self.lookup(node)
+                if (best_g is None or best_g >= node.g) and lower_bound(node) < cost:
+                    push(node)
+            expanded = set()
+            inconsistent = {}
+
+        return self.best_solution
 
+    def search_iterative_deepening(self, time_limit=None):
         """
-        g(n) = cost of the cheapest path from the initial node to this node.
-        Also equals to the height of the current node.
+        IDA*. Every iteration is a depth first search that skips the nodes whose f(n) = g + h is
+        above a threshold. The threshold starts at h of the root and is raised to the smallest f
+        that went over it, until a solution is found. The children are visited lowest f first.
+
+        The transposition table is kept across the iterations, with the lowest g each state has
+        been visited with, see TranspositionTable.visit. Once the search below a state is over,
+        the smallest f that went over the threshold there raises the h of the state in the
+        table, so the next iterations cut it off without searching it again until the threshold
+        reaches that f. Each (threshold, number of visited nodes) is added to self.iterations,
+        the unfinished one too if the time limit is reached.
         """
-        self.g = 0
 
-        """
-        h(n) = cost of the cheapest path from this node to the goal node.
-        """
-        self.h = h_function(state) if callable(h_function) else None
+        root = self.current_node
+        threshold = root.h
+        iteration = 0
+
+        while threshold < float("inf"):
+            iteration += 1
+            visited = 0
+
+            # Each level of the current path: the node, its children left to visit (best child
+            # last) and the smallest f that went over the threshold below it
+            stack = [[None, [root], float("inf")]]
+            while True:
+                level = stack[-1]
+                if not level[1]:
+                    stack.pop()
+                    if not stack:
+                        break
+                    stack[-1][2] = min(stack[-1][2], level[2])
+                    node = level[0]
+                    self.update_bound(node, level[2] - node.g)
+                    continue
+                node = level[1].pop()
 
-        if parent and isinstance(parent, Node):
-            self.g = parent.g + 1
-        self.parent = parent
+                if node.g + node.h > threshold:
+                    level[2] = min(level[2], node.g + node.h)
+                    continue
+                bound = self.visit(node, iteration)
+                if bound is None:
+                    self.duplicates += 1
+                    continue
+                if node.g + bound > threshold:
+                    level[2] = min(level[2], node.g + bound)
+                    continue
 
-    def __eq__(self, o: object) -> bool:
-        if not isinstance(o, Node):
-            return False
-        return self.state == o.state
+                self.current_node = node
+                self.total_visited += 1
+                visited += 1
 
-    def __lt__(self, o: object) -> bool:
+                # Print state to console
+                if self.print_state:
+                    self.renderer.submit(node)
+                self.report_progress({"Iteration": iteration, "Threshold": threshold})
 
-        if not isinstance(o, Node):
-            raise Exception(
-                "Wrong comparing type: " + str(type(self)) + " and " + str(type(o))
-            )
+                # Stop search if time limit is reached
+                if time_limit and time.time() - self.time_init > time_limit:
+                    self.iterations.append((threshold, visited))
+                    return self.best_solution
 
-        if self.h is None:
-            raise Exception("H value is None")
+                if node.is_goal_node():
+                    # Every node with a lower f has been visited by the earlier iterations
+                    self.best_solution = node
+                    self.iterations.append((threshold, visited))
+                    return node
 
-        if self.g + self.h == o.g + o.h:
-            return self.g > o.g
+                children = self.generate_children(node, node.state)
+                children.sort(key=lambda child: (child.g + child.h, child.h), reverse=True)
+                stack.append([node, children, float("inf")])
 
-        return self.g + self.h < o.g + o.h
+            self.iterations.append((threshold, visited))
+            threshold = level[2]
 
-    def is_goal_node(self):
-        return self.state.is_goal_state()
+        return self.best_solution
 
-    def __hash__(self) -> int:
-        return self.state.hash
+    def search_bidirectional(self, time_limit=None):
+        """
+        Search from both ends at push level. The forward search pushes boxes from the root and
+        the backward search pulls them from the goal states, see State.generate_possible_pulls.
+        The side with the smaller open queue is expanded next. The search stops as soon as a
+        state is generated by both sides, the solution is not guaranteed to be optimal.
 
+        Return the goal node of the joined path: the backward half is replayed as forward
+        pushes on top of the meeting forward node.
+        """
 
-DFS = 0
-A_STAR = 1
+        root = self.current_node
+        map = root.map
 
+        # The backward search heads to the initial boxes, h(n) is the sum of the Manhattan
+        # distances of the boxes to the nearest initial box
+        start_boxes = [map.cells[box] for box in bits(root.key >> map.hero_bits)]
+        start_distance = [
+            min([abs(x - start_x) + abs(y - start_y) for start_x, start_y in start_boxes])
+            for x, y in map.cells
+        ]
 
-class Tree:
-    """
-    The state space tree. Store and manage closed and open Nodes.
-    Use this object to start search process.
-    """
+        def backward_heuristic(state: State, parent: State = None) -> float:
+            return sum(start_distance[box] for box in bits(state.boxes))
+
+        # Nodes generated by each side, by packed state key
+        forward_seen: dict[int, Node] = {root.key: root}
+        backward_seen: dict[int, Node] = {}
+        for state in root.state.goal_states():
+            node = Node(state, h_function=backward_heuristic)
+            backward_seen[node.key] = node
+            self.backward_insert(node)
+            if node.key in forward_seen:
+                return self.join(root, node)
+        self.insert(root)
+
+        while self.open or self.backward_open:
+            # Print state to console
+            if self.print_state:
+                self.renderer.submit(self.current_node)
+            self.report_progress({"Backward": self.backward_visited})
 
-    def __init__(
-        self,
-        root: Node,
-        deadends=set(),
-        print_state=True,
-        search_type=DFS,
-        heuristic_function=None,
-    ) -> None:
+            # Stop search if time limit is reached
+            if time_limit and time.time() - self.time_init > time_limit:
+                return None
 
-        """
-        Nodes that have already been examined.
-        """
-        self.closed = {root}
+            forward = self.open and (
+                not self.backward_open or len(self.open) <= len(self.backward_open)
+            )
+            if forward:
+                node = self.pop()
+                children = self.generate_children(node, node.state)
+                seen, other_seen, insert = forward_seen, backward_seen, self.insert
+            else:
+                node = self.backward_pop()
+                state = node.state
+                children = [
+                    Node(
+                        previous_state,
+                        parent=node,
+                        h_function=backward_heuristic,
+                        move=move,
+                        parent_state=state,
+                    )
+                    for move, previous_state in state.generate_possible_pulls()
+                ]
+                seen, other_seen, insert = backward_seen, forward_seen, self.backward_insert
+                self.backward_visited += 1
+            self.current_node = node
+            self.total_visited += 1
 
-        """
-        Box positions that are blocked and there exists no way to solution.
-        """
-        self.deadends: set[tuple[int]] = deadends
+            for child in children:
+                if child.key in seen:
+                    self.duplicates += 1
+                    continue
+                seen[child.key] = child
+                if child.key in other_seen:
+                    if forward:
+                        return self.join(child, other_seen[child.key])
+                    return self.join(other_seen[child.key], child)
+                insert(child)
 
+        return None
+
+    def join(self, forward_node: Node, backward_node: Node) -> Node:
         """
-        Current node being examined in the tree. Initialized with the root node.
+        Extend the forward path with the pushes that undo the pulls of the backward path, from
+        the shared state up to the goal state the backward path started from.
         """
-        self.current_node = root
-
+        node = forward_node
+        while backward_node.parent:
+            node = Node(backward_node.parent.state, parent=node, move=backward_node.move ^ 1)
+            backward_node = backward_node.parent
+        self.best_solution = node
+        return node
+
+    def search_parallel(self, seek_optimal=False, time_limit=None):
         """
-        Nodes that have been generated, but have not examined.
+        Hash distributed A* (HDA*). Every state is owned by the worker process whose number is
+        the state hash modulo the number of workers: only that worker keeps it in its closed
+        set and open queue, see parallel_worker. The generated states are sent to their owners
+        in batches. This process only coordinates.
+
+        Without seek_optimal, the first solution found is returned. Otherwise the cost of the
+        best solution is sent to all workers as a bound, and the search ends when every worker
+        has nothing below the bound left and no batch is on its way. The termination is checked
+        with waves of probes, one every PROBE_INTERVAL: the workers answer with the number of
+        batches they have sent and received, and two waves in a row must find all of them idle
+        with the same equal counts.
+        With a heuristic that never overestimates, the solution is then optimal.
         """
-        self.open: list[Node] = []
 
-        if search_type == DFS:
+        root = self.current_node
+        workers = self.workers
+        config = {
+            "map": root.map,
+            "deadends": self.deadends,
+            "heuristic_function": self.heuristic_function,
+            "push_level": self.push_level,
+            "macros": self.macros,
+            "corrals": self.corrals,
+            "patterns": self.patterns,
+        }
+        inboxes = [multiprocessing.Queue() for _ in range(workers)]
+        results = multiprocessing.Queue()
+        processes = [
+            multiprocessing.Process(
+                target=parallel_worker,
+                args=(index, workers, config, inboxes, results),
+                daemon=True,
+            )
+            for index in range(workers)
+        ]
+        for process in processes:
+            process.start()
 
-            """
-            Use stack-like operations on the list.
-            """
-            self.pop = self.open.pop
-            self.insert = self.open.append
+        def broadcast(message: tuple) -> None:
+            for inbox in inboxes:
+                inbox.put(message)
 
-        elif search_type == A_STAR:
+        # The root is the one batch sent by this process
+        inboxes[root.hash % workers].put(
+            ("states", [(root.key, root.hash, 0, root.h, None, None)])
+        )
+        sent = 1
+
+        # Best solution found so far, as (g, key)
+        best = None
+        # Answers of the current probe wave by worker, and the counts of the previous wave
+        wave = 0
+        answers: dict[int, tuple] = {}
+        previous = None
+        visited = [0] * workers
+        # Time of the next probe wave, None while one is running
+        probe_at = time.time() + PROBE_INTERVAL
 
-            """
-            Use priority-queue-like operations on the list.
-            heapq uses the Node class' __lt__ function to compare priority.
-            """
-            self.pop = lambda: heapq.heappop(self.open)
-            self.insert = lambda node: heapq.heappush(self.open, node)
+        while True:
+            now = time.time()
+            # Stop search if time limit is reached
+            if time_limit and now - self.time_init > time_limit:
+                break
+            if probe_at is not None and now >= probe_at:
+                probe_at = None
+                broadcast(("probe", wave))
 
-        else:
-            raise Exception("Illegal search type.")
+            self.report_progress({"Workers": workers})
 
-        """
-        Function that calculate h(n).
-        """
-        self.heuristic_function = heuristic_function
+            try:
+                message = results.get(timeout=0.1)
+            except queue.Empty:
+                continue
 
-        self.print_state = print_state
-        self.time_init = time.time()
+            if message[0] == "goal":
+                _, g, key = message
+                if best is None or g < best[0]:
+                    best = (g, key)
+                if not seek_optimal:
+                    # Nothing is below a bound of 0: the workers stop expanding at once instead
+                    # of going on while the path is followed
+                    broadcast(("bound", 0))
+                    break
+                broadcast(("bound", best[0]))
 
-        self.total_visited = 0
-        self.time_limit = None
-        self.best_solution: Node = None
+            elif message[0] == "status":
+                _, index, message_wave, idle, worker_sent, worker_received, count = message
+                visited[index] = count
+                self.total_visited = sum(visited)
+                if message_wave != wave:
+                    continue
+                answers[index] = (idle, worker_sent, worker_received)
+                if len(answers) < workers:
+                    continue
 
-    def search(
-        self,
-        # Continue finding the best solution by traversing through all nodes of the tree
-        seek_optimal=False,
-        # Stop searching after time limit is reached, even if seek_optimal is True
-        time_limit=None,
-    ):
-        """
-        Function that starts and keeps track of the search. Search algorithm is determined by
-        self.search_type. Generate next nodes, check deadend, insert and pop the open queue to
-        travel the tree. Terminate if reach the time limit. Continue searching for optimal solution
-        if demanded.
-        """
+                total_sent = sent + sum(answer[1] for answer in answers.values())
+                total_received = sum(answer[2] for answer in answers.values())
+                idle = all(answer[0] for answer in answers.values())
+                wave += 1
+                answers = {}
+                if idle and total_sent == total_received:
+                    if previous == total_sent:
+                        break
+                    # Confirm at once with a second wave
+                    previous = total_sent
+                    probe_at = now
+                else:
+                    previous = None
+                    probe_at = now + PROBE_INTERVAL
+
+        # Follow the parents of the solution, each state is asked from its owner
+        path = []
+        if best is not None:
+            key = best[1]
+            map = root.map
+            while key is not None:
+                owner = map.hash_of(key & map.hero_mask, key >> map.hero_bits) % workers
+                inboxes[owner].put(("parent", key))
+                while True:
+                    message = results.get()
+                    if message[0] == "parent" and message[1] == key:
+                        break
+                path.append((key, message[3]))
+                key = message[2]
+            path.reverse()
+
+        broadcast(("stop",))
+        self.worker_visited = [0] * workers
+        stopped = 0
+        while stopped < workers:
+            message = results.get()
+            if message[0] == "done":
+                _, index, count, pruned = message
+                self.worker_visited[index] = count
+                for rule, pruned_count in pruned.items():
+                    self.pruned[rule] += pruned_count
+                stopped += 1
+        for process in processes:
+            process.join()
+        self.total_visited = sum(self.worker_visited)
+
+        if not path:
+            return None
+        node = root
+        for key, move in path[1:]:
+            map = root.map
+            state = State(map, key & map.hero_mask, key >> map.hero_bits)
+            node = Node(state, parent=node, move=move)
+        self.best_solution = node
+        return node
 
-        while True:
-            # Print state to console
-            if self.print_state:
-                GraphicController.reDraw(self.current_node.state)
-            sys.stdout.write("Total nodes visited: " + str(self.total_visited) + " | ")
-            sys.stdout.write(
-                "Average speed: "
-                + str(
-                    round(self.total_visited / (time.time() - self.time_init + 0.01), 2)
-                )
-                + "\r"
-            )
 
-            # Stop search if time limit is reached
-            if time_limit and time.time() - self.time_init > time_limit:
-                return self.best_solution
+# Number of nodes a worker of the parallel search expands between two looks at its inbox
+PARALLEL_SLICE = 64
+# Seconds between two termination probe waves of the parallel search, while a worker is busy
+PROBE_INTERVAL = 0.05
 
-            if self.current_node.is_goal_node():
-                # Update with the best solution so far
-                if not self.best_solution or self.current_node.g < self.best_solution.g:
-                    self.best_solution = self.current_node
 
-                if seek_optimal:
-                    self.current_node = self.pop()
-                    continue
+def parallel_worker(
+    index: int, workers: int, config: dict, inboxes: list, results: multiprocessing.Queue
+) -> None:
+    """
+    Worker process of Tree.search_parallel. Keep the closed set and the open queue of the
+    states owned by this worker, expand them and send the children to their owners.
 
-                return self.current_node
+    Messages read from the inbox: ("states", batch), ("bound", g), ("probe", wave),
+    ("parent", key) and ("stop",). A state of a batch is (key, hash, g, h, parent key, move).
+    """
 
-            # If any of the box is at the blocked position, remove the current state from
-            # the open queue
-            if self.current_node.state.check_dead_end(self.deadends):
-                if not self.open:
-                    break
-                self.current_node = self.open.pop()
+    map: CompiledMap = config["map"]
+    # Used for its child generation and deadlock checks only
+    tree = Tree(
+        root=Node(State(map, 0, 0)),
+        deadends=config["deadends"],
+        print_state=False,
+        print_progress=False,
+        search_type=A_STAR,
+        heuristic_function=config["heuristic_function"],
+        push_level=config["push_level"],
+        macros=config["macros"],
+        corrals=config["corrals"],
+        patterns=config["patterns"],
+    )
+
+    # Best g of every owned state, as key: (g, parent key, move, hash)
+    closed: dict[int, tuple] = {}
+    # Owned states waiting for expansion, as (f, -g, key)
+    open: list[tuple] = []
+    # Cost of the best known solution, nothing at or above it needs to be expanded
+    bound = float("inf")
+    # Generated states per owner, not sent yet
+    outgoing: list[list] = [[] for _ in range(workers)]
+    sent = 0
+    received = 0
+    visited = 0
+    inbox = inboxes[index]
+
+    def insert(key: int, hash: int, g: int, h: float, parent_key: int, move: int) -> None:
+        if key in closed and closed[key][0] <= g:
+            return
+        closed[key] = (g, parent_key, move, hash)
+        heapq.heappush(open, (g + h, -g, key))
+
+    while True:
+        idle = not open or open[0][0] >= bound
+
+        # Wait for messages when idle, otherwise only take those that are already there
+        messages = []
+        try:
+            messages.append(inbox.get(block=idle))
+            while True:
+                messages.append(inbox.get_nowait())
+        except queue.Empty:
+            pass
+
+        for message in messages:
+            if message[0] == "states":
+                received += 1
+                for state in message[1]:
+                    insert(*state)
+            elif message[0] == "bound":
+                bound = min(bound, message[1])
+            elif message[0] == "probe":
+                idle = not open or open[0][0] >= bound
+                results.put(("status", index, message[1], idle, sent, received, visited))
+            elif message[0] == "parent":
+                _, parent_key, move, _ = closed[message[1]]
+                results.put(("parent", message[1], parent_key, move))
+            elif message[0] == "stop":
+                results.put(("done", index, visited, tree.pruned))
+                return
+
+        # Expand a slice of nodes before looking at the inbox again
+        for _ in range(PARALLEL_SLICE):
+            if not open or open[0][0] >= bound:
+                break
+            f, g, key = heapq.heappop(open)
+            g = -g
+            if closed[key][0] != g:
+                # A cheaper path to this state has been found since it was queued
                 continue
+            hash = closed[key][3]
+            visited += 1
 
-            next_states = self.current_node.state.generate_possible_next_states()
+            state = State(map, key & map.hero_mask, key >> map.hero_bits, hash)
+            if state.is_goal_state():
+                results.put(("goal", g, key))
+                continue
 
-            for state in next_states:
-                new_node = Node(
-                    state=state,
-                    parent=self.current_node,
-                    h_function=self.heuristic_function,
-                )
-                if new_node in self.closed:
+            node = Node(state)
+            node.g = g
+            for child in tree.generate_children(node, state):
+                if child.h == float("inf"):
                     continue
-                self.insert(new_node)
+                owner = child.hash % workers
+                if owner == index:
+                    insert(child.key, child.hash, child.g, child.h, key, child.move)
+                else:
+                    outgoing[owner].append(
+                        (child.key, child.hash, child.g, child.h, key, child.move)
+                    )
 
-            if not self.open:
-                break
+        for owner, batch in enumerate(outgoing):
+            if batch:
+                inboxes[owner].put(("states", batch))
+                outgoing[owner] = []
+                sent += 1
 
-            self.closed.add(self.current_node)
-            self.current_node = self.pop()
-            self.total_visited += 1
 
-        return self.best_solution
+def solution_moves(initial_state: State, node: Node, push_level=False) -> list[int]:
+    """
+    Rebuild the moves of a solution from the move codes of the nodes, from the root to the given
+    node. At push level, the walk to each push is found by replaying from initial_state. Return
+    a list of Move.dir.
+    """
+    push_nodes = []
+    while node.parent:
+        push_nodes.append(node)
+        node = node.parent
+    push_nodes.reverse()
+
+    if not push_level:
+        return [node.move for node in push_nodes]
+
+    map = initial_state.map
+    state = initial_state
+    moves = []
+    for node in push_nodes:
+        new_boxes = node.key >> map.hero_bits
+        box = (state.boxes & ~new_boxes).bit_length() - 1
+        target = (new_boxes & ~state.boxes).bit_length() - 1
+        for push in map.macro_pushes(box, node.move, target):
+            pusher = map.neighbors[box][push ^ 1]
+            for move in map.walk(state.hero, pusher, state.boxes) + [push]:
+                state = state.next_state(MOVES[move])
+                moves.append(move)
+            box = map.neighbors[box][push]
+
+    return moves
+
+
+def to_lurd(initial_state: State, moves: list[int]) -> str:
+    """
+    Convert moves to a LURD string, e.g. "ulLdR". Upper case letters are pushes.
+    """
+    state = initial_state
+    chars = []
+    for move in moves:
+        new_state = state.next_state(MOVES[move])
+        if new_state.boxes != state.boxes:
+            chars.append(Move.LURD_CHARS[move].upper())
+        else:
+            chars.append(Move.LURD_CHARS[move])
+        state = new_state
+    return "".join(chars)
+
+
+def transform_lurd(lurd: str, transform: tuple, inverse=False) -> str:
+    """
+    Turn the moves of a LURD string by one of SokobanMap.TRANSFORMS, or back with inverse.
+    """
+    a, b, c, d = transform
+    if inverse:
+        # The matrices are orthogonal, the inverse is the transpose
+        b, c = c, b
+    directions = {vector: direction for direction, vector in Move.DIR_MOVE_MAPPING.items()}
+    chars = []
+    for char in lurd:
+        dx, dy = Move.DIR_MOVE_MAPPING[Move.LURD_CHARS.index(char.lower())]
+        new_char = Move.LURD_CHARS[directions[(a * dx + b * dy, c * dx + d * dy)]]
+        chars.append(new_char.upper() if char.isupper() else new_char)
+    return "".join(chars)
 
 
 class SokobanMap:
@@ -378,7 +2893,44 @@ class SokobanMap:
     SHELF_CHAR = "*"
     SHELF_BOX_CHAR = "O"  # the shelf which is currently filled with a box
 
-    def __init__(self, mapFilePath) -> None:
+    """
+    Characters of the standard XSB/.sok format, as the characters above. "+" is the hero on a
+    shelf, "-" and "_" are floor. A level is read in this format unless it has a HERO_CHAR.
+    """
+    XSB_CHARS = {
+        "@": HERO_CHAR,
+        "+": HERO_CHAR + SHELF_CHAR,
+        "$": BOX_CHAR,
+        ".": SHELF_CHAR,
+        "*": SHELF_BOX_CHAR,
+        "-": SPACE_CHAR,
+        "_": SPACE_CHAR,
+    }
+
+    """
+    Characters that can make a row of a board, in either format.
+    """
+    BOARD_CHARS = set("#XU*O @+$.-_")
+
+    """
+    The 8 rotations and reflections of a level, as the matrix (a, b, c, d) of
+    (x, y) -> (ax + by, cx + dy). The first one leaves the level as it is.
+    """
+    TRANSFORMS = [
+        (1, 0, 0, 1),
+        (0, -1, 1, 0),
+        (-1, 0, 0, -1),
+        (0, 1, -1, 0),
+        (-1, 0, 0, 1),
+        (1, 0, 0, -1),
+        (0, 1, 1, 0),
+        (0, -1, -1, 0),
+    ]
+
+    def __init__(self, mapFilePath=None, level=0, rows: list[str] = None) -> None:
+        """
+        Parse the level with the given number (from 0) of the map file, or the given rows.
+        """
         # Hero location
         self.hero: tuple(int)
 
@@ -391,34 +2943,80 @@ class SokobanMap:
         # Walls location
         self.walls: set[tuple[int]] = set()
 
-        with open(mapFilePath, "r") as txt_file:
-            lines = txt_file.readlines()
-            str_maze = []
-            for line in lines:
-                line = line.rstrip()
-                if not line:
-                    continue
-                str_maze.append(line)
+        if rows is None:
+            rows = LevelCollection(mapFilePath).rows(level)
+        xsb = not any(SokobanMap.HERO_CHAR in row for row in rows)
 
         # Parse map to game state
-        for i in range(len(str_maze)):
-            row = str_maze[i]
+        for i in range(len(rows)):
+            row = rows[i]
             for x in range(len(row)):
-                c = row[x]
-                if c == SokobanMap.WALL_CHAR:
-                    self.walls.add((x, i))
-                elif c == SokobanMap.HERO_CHAR:
-                    self.hero = (x, i)
-                elif c == SokobanMap.SHELF_CHAR:
-                    self.shelves.add((x, i))
-                elif c == SokobanMap.BOX_CHAR:
-                    self.boxes.add((x, i))
-                elif c == SokobanMap.SHELF_BOX_CHAR:
-                    self.boxes.add((x, i))
-                    self.shelves.add((x, i))
+                for c in SokobanMap.XSB_CHARS.get(row[x], row[x]) if xsb else row[x]:
+                    if c == SokobanMap.WALL_CHAR:
+                        self.walls.add((x, i))
+                    elif c == SokobanMap.HERO_CHAR:
+                        self.hero = (x, i)
+                    elif c == SokobanMap.SHELF_CHAR:
+                        self.shelves.add((x, i))
+                    elif c == SokobanMap.BOX_CHAR:
+                        self.boxes.add((x, i))
+                    elif c == SokobanMap.SHELF_BOX_CHAR:
+                        self.boxes.add((x, i))
+                        self.shelves.add((x, i))
+
+        # Compiled model of the map, built on first use
+        self.compiled: CompiledMap = None
+
+        # Canonical form of the level and its transform, built on first use
+        self.canonical_form: tuple[str, tuple] = None
+
+    def compile(self) -> CompiledMap:
+        if self.compiled is None:
+            self.compiled = CompiledMap(self)
+        return self.compiled
 
     def build_state(self) -> State:
-        return State(self.hero, self.boxes, self.walls, self.shelves)
+        compiled = self.compile()
+        return State(compiled, compiled.index[self.hero], compiled.to_mask(self.boxes))
+
+    def canonical(self) -> tuple[str, tuple]:
+        """
+        Canonical form of the level: its floor cells cropped, with everything else as walls, in
+        the smallest of the 8 rotations and reflections. Levels that only differ by their
+        orientation or the walls around them get the same form. Return (the form in the standard
+        XSB symbols, the transform of TRANSFORMS that turns this level into it).
+        """
+        if self.canonical_form is None:
+            cells = self.compile().cells
+            forms = []
+            for transform in SokobanMap.TRANSFORMS:
+                a, b, c, d = transform
+                moved = {(a * x + b * y, c * x + d * y): (x, y) for x, y in cells}
+                xs = [x for x, y in moved]
+                ys = [y for x, y in moved]
+                rows = [
+                    "".join(
+                        self.xsb_char(moved[(x, y)]) if (x, y) in moved else SokobanMap.WALL_CHAR
+                        for x in range(min(xs), max(xs) + 1)
+                    )
+                    for y in range(min(ys), max(ys) + 1)
+                ]
+                forms.append(("\n".join(rows), transform))
+            self.canonical_form = min(forms)
+        return self.canonical_form
+
+    def canonical_hash(self) -> str:
+        return hashlib.sha256(self.canonical()[0].encode()).hexdigest()
+
+    def xsb_char(self, position: tuple[int]) -> str:
+        """
+        Standard XSB symbol of a floor position.
+        """
+        if position == self.hero:
+            return "+" if position in self.shelves else "@"
+        if position in self.boxes:
+            return "*" if position in self.shelves else "$"
+        return "." if position in self.shelves else " "
 
     def get_map_bound(self) -> tuple[int]:
         # Find the maze bound
@@ -433,131 +3031,205 @@ class SokobanMap:
 
         return max_wall_x, max_wall_y
 
-    def search_dead_ends(self):
+    def search_dead_ends(self) -> int:
         """
-        Search box positions that are blocked and there exists no way to solution.
+        Search box positions that are blocked and there exists no way to solution. Return a
+        bitmask of the compiled map cells, see CompiledMap.find_dead_cells.
         """
 
-        CHECK_MAPPINGS = {
-            LEFT: (UP, DOWN),
-            RIGHT: (UP, DOWN),
-            UP: (LEFT, RIGHT),
-            DOWN: (LEFT, RIGHT),
-        }
+        return self.compile().dead_mask
 
-        wall_bound_x, wall_bound_y = self.get_map_bound()
-        check_spaces = set()
-        for i in range(wall_bound_x + 1):
-            for j in range(wall_bound_y + 1):
-                if (i, j) not in self.walls:
-                    check_spaces.add((i, j))
 
-        def check_deadend(check_space):
-            """
-            Find and return a set of deadends. A deadend is a position where once the box gets
-            in its place, it can not be moved further to achieve the goal state.
-            """
-            if check_space in self.shelves:
-                return False
+def is_board_row(line: str) -> bool:
+    """
+    Whether the line is a row of a board. Blank lines, titles and comments are not.
+    """
+    return "#" in line and all(c in SokobanMap.BOARD_CHARS for c in line)
 
-            # Corner check
-            for direction in [LEFT, RIGHT, UP, DOWN]:
 
-                new_orthogonal_location = direction.move(check_space)
+class LevelCollection:
+    """
+    A map file holding one or many levels, e.g. a standard .xsb/.sok collection. Levels are
+    separated by any line that is not a row of a board: blank lines, titles, comments. The file is
+    read line by line, never whole. The byte offset of each level is recorded on the first pass,
+    after which any level is opened by seeking straight to it.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
 
-                if not new_orthogonal_location in self.walls:
-                    continue
-                else:
-                    for sub_direction in CHECK_MAPPINGS[direction]:
-                        if sub_direction.move(check_space) in self.walls:
-                            return True
-
-            # Boundary check
-            def check_boundary(dir: Move):
-                """
-                This function checks if a box is stuck beside a wall. Meaning it can only move
-                along the wall, but not freely move anywhere else. Return True if it is stuck,
-                otherwise False.
-
-                E.g.:
-
-                ###
-                  #
-                 U#
-                  #
-                ###
-
-                In this state, the box U cannot escape.
-                """
-
-                if dir.move(check_space) in self.walls:
-
-                    # If the position being checked is a shelve, don't mark it as a deadend
-                    if check_space[0] in map(lambda x: x[0], self.shelves):
-                        return False
-                    if check_space[1] in map(lambda x: x[1], self.shelves):
-                        return False
-
-                    bound_1 = None
-                    bound_2 = None
-                    current_location = check_space
-
-                    # Try moving along the wall to see if it's stuck, THIS direction
-                    while True:
-                        current_location = CHECK_MAPPINGS[dir][0].move(current_location)
-                        if current_location in self.walls:
-                            bound_1 = current_location[1 if dir in [LEFT, RIGHT] else 0]
-                            break
-                        if (
-                            current_location[0] > wall_bound_x
-                            or current_location[1] > wall_bound_y
-                            or current_location[0] < 0
-                            or current_location[1] < 0
-                        ):
-                            break
+        """
+        Byte offset of the first row of each level found so far. complete becomes True once the
+        whole file has been read.
+        """
+        self.offsets: list[int] = []
+        self.complete = False
 
-                    current_location = check_space
-                    # Try moving along the wall to see if it's stuck, THE OTHER direction
-                    while True:
-                        current_location = CHECK_MAPPINGS[dir][1].move(current_location)
-                        if current_location in self.walls:
-                            bound_2 = current_location[1 if dir in [LEFT, RIGHT] else 0]
-                            break
-                        if (
-                            current_location[0] > wall_bound_x
-                            or current_location[1] > wall_bound_y
-                            or current_location[0] < 0
-                            or current_location[1] < 0
-                        ):
-                            break
+    def __iter__(self):
+        """
+        Stream the levels as lists of rows, one at a time, recording their offsets on the way.
+        """
+        with open(self.path, "rb") as file:
+            offset = 0
+            number = 0
+            rows = []
+            for line in file:
+                row = line.decode("utf-8", "replace").rstrip()
+                if is_board_row(row):
+                    if not rows:
+                        if number == len(self.offsets):
+                            self.offsets.append(offset)
+                        number += 1
+                    rows.append(row)
+                elif rows:
+                    yield rows
+                    rows = []
+                offset += len(line)
+            if rows:
+                yield rows
+        self.complete = True
+
+    def index(self) -> list[int]:
+        """
+        Offsets of all the levels, reading the rest of the file if needed.
+        """
+        if not self.complete:
+            for _ in self:
+                pass
+        return self.offsets
 
-                    side_wall = dir.move(check_space)[0 if dir in [LEFT, RIGHT] else 1]
-
-                    if bound_1 and bound_2:
-                        for i in range(bound_1 + 1, bound_2):
-                            if dir in [LEFT, RIGHT]:
-                                if (side_wall, i) not in self.walls:
-                                    break
-                            else:
-                                if (i, side_wall) not in self.walls:
-                                    break
-                        else:
-                            return True
-                    else:
-                        return False
+    def __len__(self) -> int:
+        return len(self.index())
 
-            for dir in [LEFT, RIGHT, UP, DOWN]:
-                if check_boundary(dir):
-                    return True
+    def rows(self, level: int) -> list[str]:
+        """
+        Rows of the level with the given number, counted from 0.
+        """
+        if level >= len(self.offsets) and not self.complete:
+            # Stream until the level is found, the offsets of the ones before are kept
+            for number, rows in enumerate(self):
+                if number == level:
+                    return rows
+        if not 0 <= level < len(self.offsets):
+            raise IndexError(
+                "Level "
+                + str(level + 1)
+                + " not found in "
+                + self.path
+                + ", it has "
+                + str(len(self))
+                + " levels"
+            )
 
-            return False
+        with open(self.path, "rb") as file:
+            file.seek(self.offsets[level])
+            rows = []
+            for line in file:
+                row = line.decode("utf-8", "replace").rstrip()
+                if not is_board_row(row):
+                    break
+                rows.append(row)
+        return rows
+
+    def load(self, level: int) -> SokobanMap:
+        return SokobanMap(self.path, rows=self.rows(level))
+
+
+class SolutionCache:
+    """
+    Solutions kept in a SQLite file, so that a level solved before, even rotated, mirrored or
+    with other walls around it, is answered at once. A solution is keyed by the hash of the
+    canonical form of the level (see SokobanMap.canonical) and the search settings, and its
+    moves are kept in the canonical orientation. When the moves stored take more than size
+    bytes, the least recently used solutions are evicted.
+    """
+
+    DEFAULT_SIZE = 64 * 1024 * 1024
+
+    def __init__(self, path: str, size: int = DEFAULT_SIZE) -> None:
+        self.path = path
+        self.size = size
+        # Opened on first use, by each process that uses the cache
+        self.connection: sqlite3.Connection = None
+
+    def __getstate__(self) -> dict:
+        # A connection can't be sent to the worker processes
+        return {"path": self.path, "size": self.size, "connection": None}
+
+    def connect(self) -> sqlite3.Connection:
+        if self.connection is None:
+            self.connection = sqlite3.connect(self.path, timeout=30)
+            with self.connection:
+                self.connection.execute(
+                    "CREATE TABLE IF NOT EXISTS solutions (level TEXT, settings TEXT, "
+                    + "moves TEXT NOT NULL, used REAL NOT NULL, PRIMARY KEY (level, settings))"
+                )
+        return self.connection
+
+    def settings(self, options: dict) -> str:
+        """
+        The search options that change which solution is found, see parse_search_options.
+        """
+        return json.dumps(
+            {
+                "search": options["search_type"],
+                "push": options["push_level"],
+                "macros": options["macros"],
+                "corrals": options["corrals"],
+                "heuristic": options["heuristic"],
+                "weight": options["weight"],
+                "optimal": options["seek_optimal"],
+            },
+            sort_keys=True,
+        )
 
-        deadends = set()
-        for check_space in check_spaces:
-            if check_deadend(check_space):
-                deadends.add(check_space)
+    def get(self, map: SokobanMap, options: dict) -> str:
+        """
+        LURD moves of the cached solution of the map, turned to its orientation, or None.
+        """
+        connection = self.connect()
+        key = (map.canonical_hash(), self.settings(options))
+        row = connection.execute(
+            "SELECT moves FROM solutions WHERE level = ? AND settings = ?", key
+        ).fetchone()
+        if row is None:
+            return None
+        with connection:
+            connection.execute(
+                "UPDATE solutions SET used = ? WHERE level = ? AND settings = ?",
+                (time.time(), *key),
+            )
+        return transform_lurd(row[0], map.canonical()[1], inverse=True)
+
+    def put(self, map: SokobanMap, options: dict, lurd: str) -> None:
+        connection = self.connect()
+        moves = transform_lurd(lurd, map.canonical()[1])
+        with connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO solutions VALUES (?, ?, ?, ?)",
+                (map.canonical_hash(), self.settings(options), moves, time.time()),
+            )
+            self.evict()
 
-        return deadends
+    def evict(self) -> None:
+        """
+        Delete the least recently used solutions until the moves fit in self.size bytes.
+        """
+        total = self.connection.execute(
+            "SELECT COALESCE(SUM(LENGTH(moves)), 0) FROM solutions"
+        ).fetchone()[0]
+        if total <= self.size:
+            return
+        rows = self.connection.execute(
+            "SELECT level, settings, LENGTH(moves) FROM solutions ORDER BY used"
+        ).fetchall()
+        for level, settings, length in rows:
+            if total <= self.size:
+                break
+            self.connection.execute(
+                "DELETE FROM solutions WHERE level = ? AND settings = ?", (level, settings)
+            )
+            total -= length
 
 
 class GraphicController:
@@ -582,6 +3254,50 @@ class GraphicController:
         print(string)
         GraphicController.drawnRows += 1
 
+    def layer(map: CompiledMap) -> list[str]:
+        """
+        Rows of the walls, shelves and empty floor of the map. Built once and kept in the map.
+        """
+        if map.layer is None:
+            symbols = GraphicController.SYMBOLS_MAPPINGS
+            # The maze bound is the furthest wall
+            width = max(x for x, y in map.walls) + 1
+            height = max(y for x, y in map.walls) + 1
+            maze = [[symbols[SokobanMap.SPACE_CHAR]] * width for y in range(height)]
+            for x, y in map.walls:
+                maze[y][x] = symbols[SokobanMap.WALL_CHAR]
+            for x, y in map.shelves:
+                maze[y][x] = symbols[SokobanMap.SHELF_CHAR]
+            map.layer = ["".join(row) for row in maze]
+        return map.layer
+
+    def symbol(state: State, cell: int) -> str:
+        """
+        Symbol of the given cell of the state: the hero, a box, or the static layer.
+        """
+        symbols = GraphicController.SYMBOLS_MAPPINGS
+        if cell == state.hero:
+            return symbols[SokobanMap.HERO_CHAR]
+        if state.boxes >> cell & 1:
+            if state.map.shelf_mask >> cell & 1:
+                return symbols[SokobanMap.SHELF_BOX_CHAR]
+            return symbols[SokobanMap.BOX_CHAR]
+        x, y = state.map.cells[cell]
+        return GraphicController.layer(state.map)[y][x]
+
+    def legend() -> str:
+        symbols = GraphicController.SYMBOLS_MAPPINGS
+        return " ".join(
+            label + " " + symbols[char]
+            for label, char in [
+                ("Hero:", SokobanMap.HERO_CHAR),
+                ("Wall:", SokobanMap.WALL_CHAR),
+                ("Box:", SokobanMap.BOX_CHAR),
+                ("Shelf:", SokobanMap.SHELF_CHAR),
+                ("Filled shelf:", SokobanMap.SHELF_BOX_CHAR),
+            ]
+        )
+
     def reDraw(state: State):
         """
         Redraw the given game state to the console.
@@ -595,70 +3311,18 @@ class GraphicController:
         rows_full = GraphicController.drawnRows + 1
         print("\033[F" * rows_full)
 
-        GraphicController.drawnRows = 0
-
-        # Find the maze bound
-        max_wall_x = 0
-        max_wall_y = 0
-
-        for wall in state.walls:
-            wall_location = wall[0]
-            y = wall[1]
-            max_wall_x = wall_location if wall_location > max_wall_x else max_wall_x
-            max_wall_y = y if y > max_wall_y else max_wall_y
-
-        maze = [
-            [
-                GraphicController.SYMBOLS_MAPPINGS[SokobanMap.SPACE_CHAR]
-                for x in range(max_wall_x + 1)
-            ]
-            for y in range(max_wall_y + 1)
-        ]
-        for wall_location in state.walls:
-            maze[wall_location[1]][
-                wall_location[0]
-            ] = GraphicController.SYMBOLS_MAPPINGS[SokobanMap.WALL_CHAR]
-        for shelf_location in state.shelves:
-            if shelf_location in state.boxes:
-                maze[shelf_location[1]][
-                    shelf_location[0]
-                ] = GraphicController.SYMBOLS_MAPPINGS[SokobanMap.SHELF_BOX_CHAR]
-            else:
-                maze[shelf_location[1]][
-                    shelf_location[0]
-                ] = GraphicController.SYMBOLS_MAPPINGS[SokobanMap.SHELF_CHAR]
-        for box_location in state.boxes:
-            if not box_location in state.shelves:
-                maze[box_location[1]][
-                    box_location[0]
-                ] = GraphicController.SYMBOLS_MAPPINGS[SokobanMap.BOX_CHAR]
-
-        maze[state.hero[1]][state.hero[0]] = GraphicController.SYMBOLS_MAPPINGS[
-            SokobanMap.HERO_CHAR
-        ]
+        GraphicController.drawnRows = 0
 
-        print_string = ""
-        for row in maze:
-            for col in row:
-                print_string += col
-            print_string += "\n"
-            GraphicController.drawnRows += 1
+        # Only the hero and the boxes are drawn over the static layer
+        maze = [list(row) for row in GraphicController.layer(state.map)]
+        for cell in bits(state.boxes | 1 << state.hero):
+            x, y = state.map.cells[cell]
+            maze[y][x] = GraphicController.symbol(state, cell)
 
-        print(print_string)
-        GraphicController.drawnRows += 1
+        print("".join("".join(row) + "\n" for row in maze))
+        GraphicController.drawnRows += len(maze) + 1
 
-        print(
-            "Hero:",
-            GraphicController.SYMBOLS_MAPPINGS[SokobanMap.HERO_CHAR],
-            "Wall:",
-            GraphicController.SYMBOLS_MAPPINGS[SokobanMap.WALL_CHAR],
-            "Box:",
-            GraphicController.SYMBOLS_MAPPINGS[SokobanMap.BOX_CHAR],
-            "Shelf:",
-            GraphicController.SYMBOLS_MAPPINGS[SokobanMap.SHELF_CHAR],
-            "Filled shelf:",
-            GraphicController.SYMBOLS_MAPPINGS[SokobanMap.SHELF_BOX_CHAR],
-        )
+        print(GraphicController.legend())
         GraphicController.drawnRows += 1
 
         sys.stdout.write("\033[2K\033[1G")
@@ -669,42 +3333,313 @@ class GraphicController:
         GraphicController.drawnRows += 1
 
 
-def heuristic_distance_box_shelf(state: State) -> float:
+class Renderer:
+    """
+    Draws the states of a search to the console without holding the search back. The search
+    only hands its current node to submit. A thread draws the latest submitted node FRAME_RATE
+    times per second, the nodes submitted in between are never drawn. The static layer is drawn
+    once per map, after that a frame only rewrites the cells whose content changed.
+    """
+
+    FRAME_RATE = 30
+
+    def __init__(self, frame_rate: float = FRAME_RATE) -> None:
+        self.frame_rate = frame_rate
+
+        """
+        Latest submitted node (or state) and progress line. Replaced by the search without a
+        lock, the thread reads whatever is there when a frame is due.
+        """
+        self.latest = None
+        self.status = None
+
+        """
+        Map, boxes and hero cell of the state on the screen. The map is None until the first
+        frame, which clears the screen and draws the static layer.
+        """
+        self.map = None
+        self.boxes = 0
+        self.hero = 0
+
+        self.running = False
+        self.thread = None
+
+    def submit(self, node) -> None:
+        self.latest = node
+
+    def start(self) -> None:
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        """
+        Stop the thread and move the cursor below the drawing.
+        """
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+            sys.stdout.write("\n")
+
+    def run(self) -> None:
+        drawn = None
+        drawn_status = None
+        while self.running:
+            node, status = self.latest, self.status
+            if node is not None and (node is not drawn or status is not drawn_status):
+                drawn, drawn_status = node, status
+                self.draw(node.state, status)
+            time.sleep(1 / self.frame_rate)
+
+    def draw(self, state: State, status: str = None) -> None:
+        """
+        Draw the state, and the status line below it, in a single write to the console.
+        """
+        layer = GraphicController.layer(state.map)
+        out = []
+        if state.map is not self.map:
+            self.map = state.map
+            out.append("\033[2J\033[H" + "\n".join(layer) + "\n" + GraphicController.legend())
+            changed = state.boxes | 1 << state.hero
+        else:
+            changed = (self.boxes ^ state.boxes) | 1 << self.hero | 1 << state.hero
+        self.boxes = state.boxes
+        self.hero = state.hero
+
+        # Move the cursor to each changed cell, rows and columns count from 1
+        for cell in bits(changed):
+            x, y = state.map.cells[cell]
+            out.append("\033[%d;%dH" % (y + 1, x + 1) + GraphicController.symbol(state, cell))
+
+        # The status line goes below the legend
+        out.append("\033[%d;1H\033[2K" % (len(layer) + 2))
+        if status is not None:
+            out.append(status)
+        sys.stdout.write("".join(out))
+        sys.stdout.flush()
+
+
+def heuristic_distance_box_shelf(state: State, parent: State = None) -> float:
     """
     A heuristic h(n) function that calculate the distance from the given state to the goal state.
     Return the sum of the minimum distance from a box to any shelve.
     """
 
+    shelf_distance = state.map.shelf_distance
     h = 0
-    for box in state.boxes:
-        min_distance = float("inf")
-        for shelf in state.shelves:
-            distance = abs(shelf[0] - box[0]) + abs(shelf[1] - box[1])
-            if distance < min_distance:
-                min_distance = distance
-        h += min_distance
+    for box in bits(state.boxes):
+        h += shelf_distance[box]
     return h
 
 
-def heuristic_distance_combined(state: State) -> float:
+def heuristic_distance_combined(state: State, parent: State = None) -> float:
     """
     A heuristic h(n) function that calculate the distance from the given state to the goal state.
     Return the sum of the minimum distance from a box to any shelve and the sum of the distance
     from the hero to the unfilled boxes.
     """
 
+    cells = state.map.cells
+    hero_x, hero_y = cells[state.hero]
     h = 0
 
-    for box in state.boxes:
-        if box in state.shelves:
-            continue
-        distance = abs(state.hero[0] - box[0]) + abs(state.hero[1] - box[1])
+    for box in bits(state.boxes & ~state.map.shelf_mask):
+        box_x, box_y = cells[box]
+        distance = abs(hero_x - box_x) + abs(hero_y - box_y)
 
         h += distance
 
     return h + heuristic_distance_box_shelf(state)
 
 
+def heuristic_push_distance(state: State, parent: State = None) -> float:
+    """
+    A heuristic h(n) function that calculate the distance from the given state to the goal state.
+    Return the sum of the minimum number of pushes from a box to any shelve. Unlike
+    heuristic_distance_box_shelf, walls are taken into account.
+    """
+
+    nearest_push_distance = state.map.nearest_push_distance
+    h = 0
+    for box in bits(state.boxes):
+        h += nearest_push_distance[box]
+    return h
+
+
+class MatchingHeuristic:
+    """
+    A heuristic h(n) function object. Every box is assigned to its own shelf so that the sum of
+    the push distances is minimal (Hungarian algorithm), so two boxes can never claim the same
+    shelf. Return inf if there is no such assignment.
+
+    The assignment of the last parent state is kept. When a child only moved one box, the
+    assignment is repaired with a single augmenting path, O(n^2) instead of O(n^3).
+    """
+
+    # Cost of a box that can not reach a shelf, small enough to keep the sums exact
+    UNREACHABLE = 1 << 20
+
+    def __init__(self) -> None:
+        # The state whose assignment is kept, and the assignment itself
+        self.base: State = None
+        self.solution: tuple = None
+
+    def __call__(self, state: State, parent: State = None) -> float:
+        base = self.base
+        if base is not None and base.map is state.map and base.boxes == state.boxes:
+            return self.solution_cost(self.solution)
+
+        if (
+            parent is not None
+            and len(state.map.shelf_cells) == count_bits(state.boxes)
+            and count_bits(parent.boxes ^ state.boxes) == 2
+        ):
+            if base is None or base.map is not parent.map or base.boxes != parent.boxes:
+                self.base = parent
+                self.solution = self.solve(parent)
+            moved_from = (parent.boxes & ~state.boxes).bit_length() - 1
+            moved_to = (state.boxes & ~parent.boxes).bit_length() - 1
+            return self.solution_cost(self.update(state, moved_from, moved_to))
+
+        self.base = state
+        self.solution = self.solve(state)
+        return self.solution_cost(self.solution)
+
+    def row_costs(self, state: State, box: int) -> list[int]:
+        return [
+            min(distance, MatchingHeuristic.UNREACHABLE)
+            for distance in state.map.push_distance[box]
+        ]
+
+    def solve(self, state: State) -> tuple:
+        """
+        Solve the assignment from scratch. Return (boxes, costs, u, v, p) where u and v are the
+        dual potentials and p[j] is the 1-based row assigned to column j (p[0] is unused).
+        """
+        boxes = list(bits(state.boxes))
+        costs = [self.row_costs(state, box) for box in boxes]
+        columns = len(state.map.shelf_cells)
+        if len(boxes) > columns:
+            return None
+
+        u = [0] * (len(boxes) + 1)
+        v = [0] * (columns + 1)
+        p = [0] * (columns + 1)
+        for row in range(1, len(boxes) + 1):
+            self.augment(costs, u, v, p, row)
+        return boxes, costs, u, v, p
+
+    def update(self, state: State, moved_from: int, moved_to: int) -> tuple:
+        """
+        Repair the kept assignment after one box moved. The row of the moved box is unassigned,
+        its potential is lowered to stay feasible, and one augmenting path restores optimality.
+        """
+        if self.solution is None:
+            return None
+        boxes, costs, u, v, p = self.solution
+        row = boxes.index(moved_from) + 1
+
+        boxes = boxes.copy()
+        boxes[row - 1] = moved_to
+        costs = costs.copy()
+        costs[row - 1] = self.row_costs(state, moved_to)
+        v = v.copy()
+        p = [0 if assigned == row else assigned for assigned in p]
+        u = u.copy()
+        u[row] = min(cost - v[j + 1] for j, cost in enumerate(costs[row - 1]))
+
+        self.augment(costs, u, v, p, row)
+        return boxes, costs, u, v, p
+
+    def augment(self, costs: list, u: list, v: list, p: list, row: int) -> None:
+        """
+        Find a shortest augmenting path from the given unassigned row and flip it.
+        """
+        columns = len(v) - 1
+        min_value = [float("inf")] * (columns + 1)
+        used = [False] * (columns + 1)
+        way = [0] * (columns + 1)
+        p[0] = row
+        j0 = 0
+
+        while True:
+            used[j0] = True
+            i0 = p[j0]
+            row_costs = costs[i0 - 1]
+            delta = float("inf")
+            j1 = 0
+            for j in range(1, columns + 1):
+                if used[j]:
+                    continue
+                reduced = row_costs[j - 1] - u[i0] - v[j]
+                if reduced < min_value[j]:
+                    min_value[j] = reduced
+                    way[j] = j0
+                if min_value[j] < delta:
+                    delta = min_value[j]
+                    j1 = j
+            for j in range(columns + 1):
+                if used[j]:
+                    u[p[j]] += delta
+                    v[j] -= delta
+                else:
+                    min_value[j] -= delta
+            j0 = j1
+            if p[j0] == 0:
+                break
+
+        while j0:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+
+    def solution_cost(self, solution: tuple) -> float:
+        if solution is None:
+            return float("inf")
+        _, costs, _, _, p = solution
+        h = 0
+        for j in range(1, len(p)):
+            if p[j]:
+                h += costs[p[j] - 1][j - 1]
+        return h if h < MatchingHeuristic.UNREACHABLE else float("inf")
+
+
+heuristic_matching = MatchingHeuristic()
+
+
+class WeightedHeuristic:
+    """
+    A heuristic h(n) function object that multiplies another one by a weight. A weight above 1
+    makes A* greedier: solutions are found faster but may cost up to weight times the optimal.
+    """
+
+    def __init__(self, function, weight: float) -> None:
+        self.function = function
+        self.weight = weight
+
+    def __call__(self, state: State, parent: State = None) -> float:
+        return self.weight * self.function(state, parent)
+
+
+"""
+Heuristics that can be chosen with the --heuristic option.
+"""
+HEURISTICS = {
+    "combined": heuristic_distance_combined,
+    "box_shelf": heuristic_distance_box_shelf,
+    "push_distance": heuristic_push_distance,
+    "matching": heuristic_matching,
+}
+
+"""
+Heuristics that never overestimate the number of steps (or pushes) left, see
+Tree.search_anytime. combined does: the hero walk to a box is also counted for the boxes it
+pushes on the way.
+"""
+ADMISSIBLE_HEURISTICS = {"box_shelf", "push_distance", "matching"}
+
+
 def run_interactive(initial_state: State):
     """
     Run program in interactive mode. User can use arrow keys to control the hero.
@@ -745,19 +3680,527 @@ def run_interactive(initial_state: State):
                 GraphicController.print("Steps: " + str(steps))
 
 
+def parse_search_options(argv: list[str]) -> dict:
+    """
+    Read the options of the search from the command arguments. Return a dict that can be sent
+    to the worker processes of a batch, see build_tree.
+    """
+
+    # Search type
+    search_type = DFS
+    # h(n) function for a star search, and its name in HEURISTICS
+    h_function = None
+    heuristic_name = None
+    # Search over box pushes instead of hero steps
+    push_level = False
+    # Store of the learned deadlock patterns
+    patterns = None
+    # Cache of the solutions found before
+    cache = None
+    # Memory budget of the examined states in bytes, None for no limit
+    max_memory = None
+    # Keep finding optimal solution
+    seek_optimal = False
+    # Time limit when seek_optimal in seconds
+    time_limit = None
+    # Number of processes of the A* search
+    workers = 1
+    # Weight of h(n), the first weight of the anytime search with --optimal
+    weight = ANYTIME_WEIGHT
+    # Measure the time spent in each step of the search, see Tree.enable_timers
+    timers = "--timers" in argv
+    # Open queue of A*, "heap" or "bucket". By default a BucketQueue is used if f is an integer
+    queue_name = None
+    # Tunnel and goal room macro moves, see State.generate_macro_pushes
+    macros = "--macros" in argv
+    # Only push the boxes fencing a PI-corral, see CompiledMap.pi_corral
+    corrals = "--corrals" in argv
+
+    if "--optimal" in argv:
+        seek_optimal = True
+    try:
+        time_limit = int(argv[argv.index("-t") + 1])
+    except ValueError:
+        pass
+    try:
+        st = argv[argv.index("-s") + 1]
+        if st == "astar":
+            search_type = A_STAR
+            heuristic_name = "combined"
+        elif st == "idastar":
+            search_type = IDA_STAR
+            heuristic_name = "combined"
+        elif st == "push":
+            search_type = A_STAR
+            # The hero position is normalized, only the boxes are meaningful
+            heuristic_name = "box_shelf"
+            push_level = True
+        elif st == "bidirectional":
+            search_type = BIDIRECTIONAL
+            heuristic_name = "box_shelf"
+            push_level = True
+        elif st != "dfs":
+            raise Exception(
+                'Illegal search type. Accept only "dfs", "astar", "idastar", "push" or '
+                + '"bidirectional"'
+            )
+    except ValueError:
+        pass
+    try:
+        heuristic_name = argv[argv.index("--heuristic") + 1]
+        if heuristic_name not in HEURISTICS:
+            raise Exception("Illegal heuristic. Accept only " + ", ".join(HEURISTICS.keys()))
+    except ValueError:
+        # The anytime search needs an admissible h to prune and prove its bounds
+        if seek_optimal and search_type == A_STAR and heuristic_name == "combined":
+            heuristic_name = "box_shelf"
+    if heuristic_name is not None:
+        h_function = HEURISTICS[heuristic_name]
+    try:
+        patterns = PatternStore(argv[argv.index("--patterns") + 1])
+    except ValueError:
+        pass
+    try:
+        cache = SolutionCache(argv[argv.index("--cache") + 1])
+        cache.size = int(float(argv[argv.index("--cache-size") + 1]) * 1024 * 1024)
+    except ValueError:
+        pass
+    try:
+        max_memory = int(float(argv[argv.index("--max-memory") + 1]) * 1024 * 1024)
+    except ValueError:
+        pass
+    try:
+        weight = float(argv[argv.index("--weight") + 1])
+        # With --optimal, A* starts with this weight and lowers it by itself
+        if weight != 1 and h_function is not None and not seek_optimal:
+            h_function = WeightedHeuristic(h_function, weight)
+    except ValueError:
+        pass
+    try:
+        queue_name = argv[argv.index("--queue") + 1]
+        if queue_name not in ["heap", "bucket"]:
+            raise Exception('Illegal queue. Accept only "heap" or "bucket"')
+    except ValueError:
+        pass
+    if macros and not push_level:
+        raise Exception('Macro moves are only supported by "push" and "bidirectional"')
+    if corrals and not push_level:
+        raise Exception('Corral pruning is only supported by "push" and "bidirectional"')
+    if queue_name is not None and seek_optimal and search_type == A_STAR:
+        # See Tree.search_anytime
+        raise Exception('--queue is not supported with --optimal, the anytime A* has its own')
+    if queue_name is None:
+        # All the heuristics give integers, only a fractional weight makes f a fraction
+        queue_name = "bucket" if seek_optimal or float(weight).is_integer() else "heap"
+    try:
+        workers = int(argv[argv.index("--workers") + 1])
+        # With --batch, the workers are the processes solving the levels, see main
+        if workers > 1 and search_type != A_STAR and "--batch" not in argv:
+            raise Exception('Several workers are only supported by "astar" and "push"')
+    except ValueError:
+        pass
+
+    return {
+        "search_type": search_type,
+        "h_function": h_function,
+        "heuristic": heuristic_name,
+        "push_level": push_level,
+        "macros": macros,
+        "corrals": corrals,
+        "patterns": patterns,
+        "cache": cache,
+        "max_memory": max_memory,
+        "seek_optimal": seek_optimal,
+        "time_limit": time_limit,
+        "workers": workers,
+        "weight": weight,
+        "bucket_queue": queue_name == "bucket",
+        "timers": timers,
+    }
+
+
+def build_tree(
+    initial_state: State,
+    map: SokobanMap,
+    options: dict,
+    print_state=False,
+    print_progress=True,
+    stats_file=None,
+    stats_interval: float = 1,
+) -> Tree:
+    """
+    Create the space tree of the given map with the options from parse_search_options.
+    """
+
+    push_level = options["push_level"]
+    return Tree(
+        root=Node(
+            initial_state.normalized() if push_level else initial_state,
+            h_function=options["h_function"],
+        ),
+        deadends=map.search_dead_ends(),
+        print_state=print_state,
+        print_progress=print_progress,
+        search_type=options["search_type"],
+        heuristic_function=options["h_function"],
+        push_level=push_level,
+        macros=options["macros"],
+        corrals=options["corrals"],
+        patterns=options["patterns"],
+        max_memory=options["max_memory"],
+        workers=options["workers"],
+        weight=options["weight"],
+        admissible=options["heuristic"] in ADMISSIBLE_HEURISTICS,
+        bucket_queue=options["bucket_queue"],
+        timers=options["timers"],
+        stats_file=stats_file,
+        stats_interval=stats_interval,
+    )
+
+
+def run_search(tree: Tree, options: dict, profile_path: str = None) -> Node:
+    """
+    Run the search of the tree. With a profile_path, the search runs under cProfile and the
+    profile is written to that file, to be read with pstats or a viewer like snakeviz.
+    """
+    if not profile_path:
+        return tree.search(options["seek_optimal"], options["time_limit"])
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        return tree.search(options["seek_optimal"], options["time_limit"])
+    finally:
+        profiler.disable()
+        profiler.dump_stats(profile_path)
+
+
+def peak_memory() -> int:
+    """
+    Peak resident memory of the current process in bytes, None where it can not be read.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def solve_map(
+    map_path: str,
+    options: dict,
+    level: int = 0,
+    rows: list[str] = None,
+    sokoban_map: SokobanMap = None,
+    stats_file=None,
+    stats_interval: float = 1,
+) -> dict:
+    """
+    Solve a single level of a map file (or the given rows of it, or an already parsed
+    sokoban_map) without drawing anything. The statistics of the search can be streamed to
+    stats_file, see Tree.write_stats.
+    Return the result as a dict that can be written as JSON: status ("solved", "no solution",
+    "timeout" or "error"), the LURD moves, number of visited nodes, time taken in seconds and
+    peak memory in bytes. A solution found in the cache of the options is marked as cached.
+    If the learned deadlock patterns of the options could not be saved, patterns_error says why.
+    """
+
+    result = {"map": map_path, "level": level + 1}
+    t1 = time.time()
+    cache = options["cache"]
+    try:
+        map = sokoban_map if sokoban_map is not None else SokobanMap(map_path, level, rows)
+        initial_state = map.build_state()
+        moves = cache.get(map, options) if cache is not None else None
+        if moves is not None:
+            result.update(
+                status="solved",
+                moves=moves,
+                nodes=0,
+                time=round(time.time() - t1, 3),
+                peak_memory=peak_memory(),
+                cached=True,
+            )
+            return result
+        tree = build_tree(
+            initial_state,
+            map,
+            options,
+            print_progress=False,
+            stats_file=stats_file,
+            stats_interval=stats_interval,
+        )
+        node = tree.search(options["seek_optimal"], options["time_limit"])
+    except Exception as e:
+        result.update(status="error", error=str(e))
+        return result
+    time_taken = time.time() - t1
+
+    if node:
+        status = "solved"
+        moves = to_lurd(initial_state, solution_moves(initial_state, node, options["push_level"]))
+        if cache is not None:
+            cache.put(map, options, moves)
+    elif options["time_limit"] and time_taken >= options["time_limit"]:
+        status = "timeout"
+        moves = None
+    else:
+        status = "no solution"
+        moves = None
+
+    result.update(
+        status=status,
+        moves=moves,
+        nodes=tree.total_visited,
+        time=round(time_taken, 3),
+        peak_memory=peak_memory(),
+    )
+    if tree.timers:
+        # The steps the search does not use are left out
+        result["timers"] = {
+            name: round(value, 4) for name, value in tree.timers.items() if tree.calls[name]
+        }
+    # The result stands even if the learned patterns could not be kept
+    if options["patterns"] is not None:
+        try:
+            options["patterns"].save()
+        except OSError as e:
+            result["patterns_error"] = str(e)
+    return result
+
+
+"""
+Extensions of the map files of a directory given to --batch.
+"""
+MAP_EXTENSIONS = ["txt", "xsb", "sok"]
+
+
+def batch_levels(pattern: str):
+    """
+    Stream (map path, level number, rows) of every level of the map files matched by pattern,
+    a directory or a glob such as maps/*.txt. Collections are read one level at a time.
+    """
+
+    if os.path.isdir(pattern):
+        map_paths = [
+            path
+            for extension in MAP_EXTENSIONS
+            for path in glob.glob(os.path.join(pattern, "*." + extension))
+        ]
+    else:
+        map_paths = glob.glob(pattern)
+    for map_path in sorted(map_paths):
+        for level, rows in enumerate(LevelCollection(map_path)):
+            yield map_path, level, rows
+
+
+def run_batch(pattern: str, options: dict, workers: int = None, output_path: str = None):
+    """
+    Solve every level of the maps matched by pattern, see batch_levels, in parallel worker
+    processes. One JSON line per level is written to output_path (stdout if not given) as soon
+    as the level is done, so the order is the order of completion.
+    """
+
+    # A fresh process per level, so that the peak memory is the one of that level alone
+    executor_options = {"max_workers": workers}
+    if sys.version_info >= (3, 11):
+        executor_options["max_tasks_per_child"] = 1
+
+    # Only a few levels wait ahead of the workers, the rest is still in the files
+    levels = batch_levels(pattern)
+    ahead = 2 * (workers or os.cpu_count() or 1)
+
+    output = open(output_path, "w") if output_path else sys.stdout
+    try:
+        with ProcessPoolExecutor(**executor_options) as executor:
+            futures = {}
+            while True:
+                for map_path, level, rows in levels:
+                    future = executor.submit(solve_map, map_path, options, level, rows)
+                    futures[future] = (map_path, level)
+                    if len(futures) >= ahead:
+                        break
+                if not futures:
+                    break
+
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    map_path, level = futures.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        # The worker process died, e.g. it ran out of memory
+                        result = {
+                            "map": map_path,
+                            "level": level + 1,
+                            "status": "error",
+                            "error": str(e),
+                        }
+                    output.write(json.dumps(result) + "\n")
+                    output.flush()
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+
+"""
+Strategies raced by --portfolio when none are given, as algorithm[:heuristic[:weight]].
+"""
+DEFAULT_PORTFOLIO = "dfs,astar:combined,astar:box_shelf,push:push_distance:2,bidirectional"
+# Seconds a portfolio waits past the time limit for the results, and between two looks at the
+# processes
+PORTFOLIO_GRACE = 5
+PORTFOLIO_POLL = 0.5
+
+
+def strategy_options(strategy: str, argv: list[str]) -> dict:
+    """
+    Search options of a portfolio strategy, e.g. "astar:box_shelf:2". The options that are not
+    part of the strategy, like -t, are taken from argv.
+    """
+
+    # Drop the options set by the strategy, with their values
+    argv = argv.copy()
+    for option in ["-s", "--heuristic", "--weight", "--workers"]:
+        if option in argv:
+            i = argv.index(option)
+            del argv[i : i + 2]
+
+    parts = strategy.split(":")
+    argv += ["-s", parts[0]]
+    if len(parts) > 1 and parts[1]:
+        argv += ["--heuristic", parts[1]]
+    if len(parts) > 2:
+        argv += ["--weight", parts[2]]
+    return parse_search_options(argv)
+
+
+def portfolio_worker(
+    strategy: str, map_path: str, options: dict, results: multiprocessing.Queue, level: int = 0
+) -> None:
+    results.put((strategy, solve_map(map_path, options, level)))
+
+
+def run_portfolio(map_path: str, strategies: list[str], argv: list[str], level: int = 0) -> tuple:
+    """
+    Race the strategies on the level of the map, each in its own process. As soon as one of
+    them finds a solution, the others are stopped. Return (strategy, result of solve_map) of
+    the winner, or (None, None) if none of them found a solution. A process that dies without
+    a result (e.g. out of memory) is not waited for, nor are any past the time limit.
+    """
+
+    results = multiprocessing.Queue()
+    options = [strategy_options(strategy, argv) for strategy in strategies]
+    processes = [
+        multiprocessing.Process(
+            target=portfolio_worker,
+            args=(strategy, map_path, options[index], results, level),
+            daemon=True,
+        )
+        for index, strategy in enumerate(strategies)
+    ]
+    for process in processes:
+        process.start()
+
+    time_limit = options[0]["time_limit"] if options else None
+    deadline = time.time() + time_limit + PORTFOLIO_GRACE if time_limit else None
+    winner = (None, None)
+    answered = 0
+    try:
+        while answered < len(processes):
+            try:
+                strategy, result = results.get(timeout=PORTFOLIO_POLL)
+            except queue.Empty:
+                # A process that exited normally has put its result, the others never will
+                crashed = sum(process.exitcode not in (None, 0) for process in processes)
+                if answered + crashed >= len(processes):
+                    break
+                if deadline is not None and time.time() > deadline:
+                    break
+                continue
+            answered += 1
+            if result["status"] == "solved":
+                winner = (strategy, result)
+                break
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
+    return winner
+
+
+def from_lurd(lurd: str) -> list[int]:
+    """
+    Convert a LURD string back to a list of Move.dir.
+    """
+    return [Move.LURD_CHARS.index(c.lower()) for c in lurd]
+
+
+def replay_solution(initial_state: State, moves: list[int], frame_rate=10) -> None:
+    """
+    Wait for the user, then draw every state of the solution. Every step is drawn, but only the
+    cells it changed are rewritten.
+    """
+    GraphicController.print("Solution found, press enter to replay the solution...")
+    input()
+
+    renderer = Renderer(frame_rate)
+    state = initial_state
+    for index in range(len(moves) + 1):
+        if index:
+            state = state.next_state(MOVES[moves[index - 1]])
+        renderer.draw(
+            state,
+            "Replaying solution: " + str(index + 1) + "/" + str(len(moves) + 1) + " steps",
+        )
+        time.sleep(1 / frame_rate)
+    print()
+
+
 def main():
 
     if "-h" in sys.argv:
         print(HELP_TEXT)
         return
 
+    # Batch mode, solve many maps without drawing
+    if "--batch" in sys.argv:
+        workers = None
+        output_path = None
+        try:
+            workers = int(sys.argv[sys.argv.index("--workers") + 1])
+        except ValueError:
+            pass
+        try:
+            output_path = sys.argv[sys.argv.index("--output") + 1]
+        except ValueError:
+            pass
+        # --workers is the number of maps solved at the same time, each map uses one process
+        options = parse_search_options(sys.argv)
+        options["workers"] = 1
+        run_batch(sys.argv[sys.argv.index("--batch") + 1], options, workers, output_path)
+        return
+
     map: SokobanMap = None
     initial_state: State = None
 
+    # Level of a map file holding many levels, counted from 1
+    level = 0
+    try:
+        level = int(sys.argv[sys.argv.index("--level") + 1]) - 1
+    except ValueError:
+        pass
+
     # Get map path from command argument and create SokobanMap instance
     try:
         maze_file_path = sys.argv[sys.argv.index("-p") + 1]
-        map = SokobanMap(maze_file_path)
+        map = SokobanMap(maze_file_path, level)
+    except IndexError as e:
+        print(e)
+        return
     except ValueError:
         print(
             'Please provide a path to a map with the "-p" option. For example: -p maps/micro1.txt'
@@ -782,67 +4225,134 @@ def main():
     # Interactive mode, control with arrow keys
     if "-i" in sys.argv:
         run_interactive(initial_state)
+    # Portfolio mode, race several strategies
+    elif "--portfolio" in sys.argv:
+        strategies = DEFAULT_PORTFOLIO
+        try:
+            value = sys.argv[sys.argv.index("--portfolio") + 1]
+            if not value.startswith("-"):
+                strategies = value
+        except IndexError:
+            pass
+
+        GraphicController.reDraw(initial_state)
+        GraphicController.print("Racing: " + strategies.replace(",", ", "))
+        strategy, result = run_portfolio(
+            maze_file_path, strategies.split(","), sys.argv, level
+        )
+
+        if result:
+            moves = from_lurd(result["moves"])
+            os.system("cls||clear")
+            state = initial_state
+            for move in moves:
+                state = state.next_state(MOVES[move])
+            GraphicController.reDraw(state)
+            GraphicController.print("Winner: " + strategy)
+            GraphicController.print("Time taken: " + str(round(result["time"], 2)) + "s")
+            GraphicController.print("Solution path length: " + str(len(moves) + 1))
+            GraphicController.print("Total node visited: " + str(result["nodes"]))
+            GraphicController.print("Solution: " + result["moves"])
+            if "--no-replay" not in sys.argv:
+                try:
+                    frame_rate = int(sys.argv[sys.argv.index("-f") + 1])
+                except ValueError:
+                    frame_rate = 10
+                replay_solution(initial_state, moves, frame_rate)
+        else:
+            GraphicController.print("Couldn't find solution")
     # AI mode
     else:
         """Default Options"""
-        # Search type
-        search_type = DFS
-        # h(n) function for a star search
-        h_function = None
+        # Options of the search, see parse_search_options
+        options = parse_search_options(sys.argv)
         # Print the state after each node visit
         print_game_state = False
         # Replay the solution after the search completes
         replay = True
         # Number of states that are printed per second while replaying the solution
         frame_rate = 10
-        # Keep finding optimal solution
-        seek_optimal = False
-        # Time limit when seek_optimal in seconds
-        time_limit = None
 
         if "--visual" in sys.argv:
             print_game_state = True
         if "--no-replay" in sys.argv:
             replay = False
-        if "--optimal" in sys.argv:
-            seek_optimal = True
         try:
             frame_rate = int(sys.argv[sys.argv.index("-f") + 1])
         except ValueError:
             pass
+
+        search_type = options["search_type"]
+        push_level = options["push_level"]
+        patterns = options["patterns"]
+        cache = options["cache"]
+
+        t1 = time.time()
+        GraphicController.reDraw(initial_state)
+
+        # A solution found before, maybe for this level turned, mirrored or with other walls
+        cached = cache.get(map, options) if cache is not None else None
+        if cached is not None:
+            moves = from_lurd(cached)
+            state = initial_state
+            for move in moves:
+                state = state.next_state(MOVES[move])
+            os.system("cls||clear")
+            GraphicController.reDraw(state)
+            GraphicController.print(
+                "Solution found in the cache in " + str(round(time.time() - t1, 3)) + "s"
+            )
+            GraphicController.print("Solution path length: " + str(len(moves) + 1))
+            GraphicController.print("Solution: " + cached)
+            if replay:
+                replay_solution(initial_state, moves, frame_rate)
+            return
+
+        # Statistics written as JSON lines during the search
+        stats_file = None
+        stats_interval = 1
+        try:
+            stats_file = open(sys.argv[sys.argv.index("--stats") + 1], "w")
+        except ValueError:
+            pass
         try:
-            time_limit = int(sys.argv[sys.argv.index("-t") + 1])
+            stats_interval = float(sys.argv[sys.argv.index("--stats-interval") + 1])
         except ValueError:
             pass
+        # File of the cProfile profile of the search
+        profile_path = None
         try:
-            st = sys.argv[sys.argv.index("-s") + 1]
-            if st == "astar":
-                search_type = A_STAR
-                h_function = heuristic_distance_combined
-            elif st != "dfs":
-                raise Exception('Illegal search type. Accept only "dfs" or "astar"')
+            profile_path = sys.argv[sys.argv.index("--profile") + 1]
         except ValueError:
             pass
 
-        t1 = time.time()
-        GraphicController.reDraw(initial_state)
-
         # Init the space tree
-        tree = Tree(
-            root=Node(initial_state),
-            deadends=map.search_dead_ends(),
+        tree = build_tree(
+            initial_state,
+            map,
+            options,
             print_state=print_game_state,
-            search_type=search_type,
-            heuristic_function=h_function,
+            stats_file=stats_file,
+            stats_interval=stats_interval,
         )
 
         # Start searching for solution
-        result = tree.search(seek_optimal, time_limit)
+        result = run_search(tree, options, profile_path)
+
+        if stats_file is not None:
+            tree.write_stats()
+            stats_file.close()
+
+        if patterns is not None:
+            patterns.save()
 
         # If solution is found
         if result:
             time_taken = time.time() - t1
 
+            # Rebuild the moves from the root to the goal node
+            moves = solution_moves(initial_state, result, push_level)
+
             # Draw the final state (goal state) and statistics
             os.system("cls||clear")
             GraphicController.reDraw(result.state)
@@ -853,41 +4363,80 @@ def main():
                 + str(round(time_taken % 60, 2))
                 + "s"
             )
-            GraphicController.print("Solution path length: " + str(result.g + 1))
+            GraphicController.print("Solution path length: " + str(len(moves) + 1))
+            if push_level:
+                GraphicController.print("Pushes: " + str(result.g))
             GraphicController.print("Total node visited: " + str(tree.total_visited))
-
-            # Replay the found solution
-            if replay:
+            GraphicController.print("Duplicates skipped: " + str(tree.duplicates))
+            if tree.timers:
                 GraphicController.print(
-                    "Solution found, press enter to replay the solution..."
+                    "Time by step: "
+                    + ", ".join(
+                        name
+                        + " "
+                        + (
+                            str(round(tree.timers[name], 2))
+                            + "s ("
+                            + str(tree.calls[name])
+                            + " calls)"
+                            if tree.calls[name]
+                            else "n/a"
+                        )
+                        for name in tree.timers
+                    )
                 )
-                input()
-                os.system("cls||clear")
-                moves = []
-                node_travel = result
-
-                # Traverse back from the goal node to the root in order to find the moves
-                while True:
-                    moves.append(node_travel.state)
-                    node_travel = node_travel.parent
-                    if not node_travel:
-                        break
-
-                moves.reverse()
-
-                for index, move in enumerate(moves):
-                    GraphicController.reDraw(move)
-                    GraphicController.print(
-                        "Replaying solution: "
-                        + str(index + 1)
-                        + "/"
-                        + str(result.g + 1)
-                        + " steps"
+            if search_type == BIDIRECTIONAL:
+                GraphicController.print("Backward nodes visited: " + str(tree.backward_visited))
+            if tree.worker_visited:
+                GraphicController.print(
+                    "Nodes visited by worker: "
+                    + ", ".join(str(count) for count in tree.worker_visited)
+                )
+            GraphicController.print(
+                "Pruned states: "
+                + ", ".join(rule + " " + str(count) for rule, count in tree.pruned.items())
+            )
+            if tree.iterations:
+                GraphicController.print(
+                    "Iterations (threshold: nodes): "
+                    + ", ".join(
+                        str(threshold) + ": " + str(nodes)
+                        for threshold, nodes in tree.iterations
+                    )
+                )
+            if tree.solutions:
+                GraphicController.print(
+                    "Solutions: "
+                    + ", ".join(
+                        str(cost)
+                        + " (bound "
+                        + (str(round(bound, 2)) if bound is not None else "?")
+                        + ") at "
+                        + str(round(found_at, 2))
+                        + "s"
+                        for found_at, cost, bound in tree.solutions
                     )
-                    time.sleep(1 / frame_rate)
+                )
+            if isinstance(tree.closed, TranspositionTable):
+                GraphicController.print("Closed table: " + tree.closed.stats())
+            lurd = to_lurd(initial_state, moves)
+            GraphicController.print("Solution: " + lurd)
+            if cache is not None:
+                cache.put(map, options, lurd)
+
+            # Replay the found solution
+            if replay:
+                replay_solution(initial_state, moves, frame_rate)
         # No solution found
         else:
             GraphicController.print("Couldn't find solution")
+            if tree.iterations:
+                GraphicController.print(
+                    "Iterations: "
+                    + str(len(tree.iterations))
+                    + ", last threshold: "
+                    + str(tree.iterations[-1][0])
+                )
 
 
 if __name__ == "__main__":
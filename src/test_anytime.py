@@ -0,0 +1,45 @@
+import os
+import unittest
+
+from main import parse_search_options, solve_map
+
+
+MAPS = os.path.join(os.path.dirname(__file__), "maps")
+
+
+def solution_length(map_name: str, argv: list[str]) -> int:
+    path = os.path.join(MAPS, map_name)
+    result = solve_map(path, parse_search_options(["-p", path, "-t", "60"] + argv))
+    assert result["status"] == "solved", result
+    return len(result["moves"])
+
+
+class AnytimeSearchTest(unittest.TestCase):
+    def test_optimal_matches_astar(self):
+        """
+        --optimal must not stop at a longer solution than A* with an admissible h. With the
+        combined heuristic, which overestimates, it once claimed 174 steps on nabo40.
+        """
+        astar = solution_length("nabo40.txt", ["-s", "astar", "--heuristic", "box_shelf"])
+        self.assertEqual(solution_length("nabo40.txt", ["-s", "astar", "--optimal"]), astar)
+        self.assertEqual(
+            solution_length("nabo40.txt", ["-s", "astar", "--optimal", "--heuristic", "combined"]),
+            astar,
+        )
+
+    def test_optimal_matches_idastar(self):
+        idastar = solution_length("mini12.txt", ["-s", "idastar", "--heuristic", "box_shelf"])
+        self.assertEqual(solution_length("mini12.txt", ["-s", "astar", "--optimal"]), idastar)
+
+    def test_dfs_optimal_exhausts(self):
+        """
+        DFS with --optimal searches until the open list is empty, then returns the best.
+        """
+        rows = ["#####", "#XU*#", "#####"]
+        result = solve_map("tiny", parse_search_options(["-s", "dfs", "--optimal"]), rows=rows)
+        self.assertEqual(result["status"], "solved", result.get("error"))
+        self.assertEqual(result["moves"], "R")
+
+
+if __name__ == "__main__":
+    unittest.main()
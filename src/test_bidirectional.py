@@ -0,0 +1,73 @@
+import glob
+import os
+import random
+import unittest
+
+from main import (
+    MOVES,
+    Node,
+    SokobanMap,
+    build_tree,
+    from_lurd,
+    parse_search_options,
+    solution_moves,
+    solve_map,
+)
+
+
+MAPS = os.path.join(os.path.dirname(__file__), "maps")
+MAP_PATHS = sorted(glob.glob(os.path.join(MAPS, "*.txt")))
+
+
+def final_state(state, moves: list[int]):
+    """
+    Play the moves from the state, None if one of them is not legal.
+    """
+    for move in moves:
+        state = state.next_state(MOVES[move])
+        if state is None:
+            return None
+    return state
+
+
+class BidirectionalSearchTest(unittest.TestCase):
+    def test_join(self):
+        """
+        Pull the boxes at random away from a solved state, then join a forward root on the last
+        pulled state with the backward path: the pushes must lead back to the solved state.
+        """
+        rng = random.Random(0)
+        options = parse_search_options(["-s", "bidirectional"])
+        for path in MAP_PATHS:
+            with self.subTest(map=os.path.basename(path)):
+                map = SokobanMap(path)
+                goal = map.build_state().goal_states()[0]
+                backward = Node(goal)
+                for _ in range(20):
+                    pulls = backward.state.generate_possible_pulls()
+                    if not pulls:
+                        break
+                    move, state = rng.choice(pulls)
+                    backward = Node(state, parent=backward, move=move)
+
+                start = backward.state
+                tree = build_tree(start, map, options, print_progress=False)
+                node = tree.join(tree.current_node, backward)
+                self.assertEqual(node.g, backward.g)
+                self.assertEqual(node.key, goal.key)
+                end = final_state(start, solution_moves(start, node, push_level=True))
+                self.assertIsNotNone(end)
+                self.assertTrue(end.is_goal_state())
+
+    def test_solutions_replay(self):
+        for path in MAP_PATHS:
+            with self.subTest(map=os.path.basename(path)):
+                result = solve_map(path, parse_search_options(["-s", "bidirectional"]))
+                self.assertEqual(result["status"], "solved", result.get("error"))
+                end = final_state(SokobanMap(path).build_state(), from_lurd(result["moves"]))
+                self.assertIsNotNone(end)
+                self.assertTrue(end.is_goal_state())
+
+
+if __name__ == "__main__":
+    unittest.main()
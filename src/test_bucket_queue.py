@@ -0,0 +1,64 @@
+import heapq
+import os
+import random
+import unittest
+
+from main import BucketQueue, Node, SokobanMap
+
+
+MAP_PATH = os.path.join(os.path.dirname(__file__), "maps", "micro1.txt")
+
+
+class BucketQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.state = SokobanMap(MAP_PATH).build_state()
+
+    def node(self, g: int, h: float) -> Node:
+        node = Node(self.state)
+        node.g = g
+        node.h = h
+        return node
+
+    def test_same_order_as_heapq(self):
+        """
+        Random inserts and pops, with f going down as well as up: the (f, g) of every pop must
+        be the one heapq gives with Node.__lt__.
+        """
+        rng = random.Random(0)
+        queue = BucketQueue()
+        heap = []
+        for _ in range(5000):
+            if heap and rng.random() < 0.45:
+                expected = heapq.heappop(heap)
+                node = queue.pop()
+                self.assertEqual((node.g + node.h, node.g), (expected.g + expected.h, expected.g))
+            else:
+                node = self.node(rng.randrange(30), rng.randrange(30))
+                queue.insert(node)
+                heapq.heappush(heap, node)
+            self.assertEqual(len(queue), len(heap))
+        while heap:
+            expected = heapq.heappop(heap)
+            node = queue.pop()
+            self.assertEqual((node.g + node.h, node.g), (expected.g + expected.h, expected.g))
+        self.assertRaises(IndexError, queue.pop)
+
+    def test_ties(self):
+        """
+        Among nodes of the same f the highest g comes first, and among equal ones the last
+        inserted. Nodes with an infinite h are dropped.
+        """
+        queue = BucketQueue()
+        first, second = self.node(2, 3), self.node(2, 3)
+        deeper = self.node(4, 1)
+        for node in [first, self.node(1, float("inf")), second, deeper, self.node(0, 6)]:
+            queue.insert(node)
+        self.assertEqual(len(queue), 4)
+        self.assertIs(queue.pop(), deeper)
+        self.assertIs(queue.pop(), second)
+        self.assertIs(queue.pop(), first)
+        self.assertEqual(queue.pop().g, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,35 @@
+import os
+import tempfile
+import unittest
+
+from main import HEURISTICS, parse_search_options, solve_map
+
+
+MAP_PATH = os.path.join(os.path.dirname(__file__), "maps", "micro1.txt")
+
+
+class SolutionCacheTest(unittest.TestCase):
+    def test_every_heuristic(self):
+        """
+        Solve a level twice with each --heuristic and the cache: the first run is searched and
+        stored, the second one is answered by the cache.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            cache_path = os.path.join(directory, "cache.db")
+            for name in HEURISTICS:
+                with self.subTest(heuristic=name):
+                    options = parse_search_options(
+                        ["-s", "push", "--heuristic", name, "--cache", cache_path, "-t", "30"]
+                    )
+                    first = solve_map(MAP_PATH, options)
+                    self.assertEqual(first["status"], "solved", first.get("error"))
+                    self.assertNotIn("cached", first)
+
+                    second = solve_map(MAP_PATH, options)
+                    self.assertEqual(second["status"], "solved", second.get("error"))
+                    self.assertTrue(second.get("cached"))
+                    self.assertEqual(second["moves"], first["moves"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,40 @@
+import glob
+import os
+import unittest
+
+from main import parse_search_options, solve_map
+
+
+MAPS = os.path.join(os.path.dirname(__file__), "maps")
+
+
+def pushes(lurd: str) -> int:
+    return sum(char.isupper() for char in lurd)
+
+
+class CorralPruningTest(unittest.TestCase):
+    def test_same_push_counts(self):
+        """
+        The push search with an admissible heuristic finds the fewest pushes. PI-corral pruning
+        must not lose them: the push counts are the same with --corrals, with fewer nodes.
+        """
+        nodes = [0, 0]
+        for path in sorted(glob.glob(os.path.join(MAPS, "*.txt"))):
+            with self.subTest(map=os.path.basename(path)):
+                results = [
+                    solve_map(
+                        path,
+                        parse_search_options(["-s", "push", "--heuristic", "matching"] + extra),
+                    )
+                    for extra in [[], ["--corrals"]]
+                ]
+                for result in results:
+                    self.assertEqual(result["status"], "solved", result.get("error"))
+                self.assertEqual(pushes(results[1]["moves"]), pushes(results[0]["moves"]))
+                nodes[0] += results[0]["nodes"]
+                nodes[1] += results[1]["nodes"]
+        self.assertLess(nodes[1], nodes[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
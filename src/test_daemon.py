@@ -0,0 +1,78 @@
+import json
+import os
+import socket
+import subprocess
+import sys
+import unittest
+
+
+SRC = os.path.dirname(os.path.abspath(__file__))
+MAPS = os.path.join(SRC, "maps")
+
+
+def free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+class DaemonTest(unittest.TestCase):
+    def setUp(self):
+        self.port = free_port()
+        self.daemon = subprocess.Popen(
+            [sys.executable, "daemon.py", "serve", "--port", str(self.port), "--workers", "1"],
+            cwd=SRC,
+            env=dict(os.environ, PYTHONUNBUFFERED="1"),
+            stdout=subprocess.PIPE,
+            text=True,
+        )
+        # The daemon prints this line once it accepts connections
+        self.assertTrue(self.daemon.stdout.readline().startswith("Listening"))
+        self.client = socket.create_connection(("127.0.0.1", self.port), timeout=60)
+        self.answers = self.client.makefile("r")
+
+    def tearDown(self):
+        self.answers.close()
+        self.client.close()
+        self.daemon.terminate()
+        self.daemon.wait()
+        self.daemon.stdout.close()
+
+    def send(self, message: dict) -> None:
+        self.client.sendall((json.dumps(message) + "\n").encode())
+
+    def read_until(self, event: str) -> dict:
+        for line in self.answers:
+            message = json.loads(line)
+            if message["event"] == event:
+                return message
+        self.fail("The daemon closed the connection before a " + event + " message")
+
+    def test_solve(self):
+        path = os.path.join(MAPS, "micro1.txt")
+        self.send({"op": "solve", "map": path, "args": ["-s", "push"], "id": "micro1"})
+        result = self.read_until("result")
+        self.assertEqual(result["id"], "micro1")
+        self.assertEqual(result["status"], "solved", result.get("error"))
+        self.assertTrue(result["moves"])
+        self.assertIn("worker_peak_memory", result)
+        self.assertNotIn("peak_memory", result)
+
+    def test_cancel(self):
+        path = os.path.join(MAPS, "micro19.txt")
+        self.send({"op": "solve", "map": path, "args": ["-s", "idastar"], "id": "long"})
+        self.read_until("started")
+        self.send({"op": "cancel", "id": "long"})
+        result = self.read_until("result")
+        self.assertEqual(result["id"], "long")
+        self.assertEqual(result["status"], "cancelled")
+        self.assertTrue(self.read_until("cancel")["found"])
+
+        # The worker running the job has been replaced, the next job is solved
+        path = os.path.join(MAPS, "micro1.txt")
+        self.send({"op": "solve", "map": path, "args": ["-s", "push"], "id": "next"})
+        self.assertEqual(self.read_until("result")["status"], "solved")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+import unittest
+
+from main import MOVES, SokobanMap, from_lurd, parse_search_options, solve_map
+
+
+# Every shelf is in the room on the right, entered through a single cell
+GOAL_ROOM = [
+    "############",
+    "#      #***#",
+    "# UUU  #   #",
+    "#   X      #",
+    "#      #   #",
+    "############",
+]
+
+# The two shelves are at the end of one-wide tunnels
+TUNNELS = [
+    "########",
+    "#      #",
+    "# U X  ############",
+    "#  U             *#",
+    "#####  ############",
+    "    #* #",
+    "    ####",
+]
+
+
+def replays(rows: list[str], lurd: str) -> bool:
+    """
+    Check that the moves are legal and leave every box on a shelf.
+    """
+    state = SokobanMap(rows=rows).build_state()
+    for move in from_lurd(lurd):
+        state = state.next_state(MOVES[move])
+        if state is None:
+            return False
+    return state.is_goal_state()
+
+
+class MacroTest(unittest.TestCase):
+    def check_macros(self, rows: list[str]):
+        plain = solve_map("rows", parse_search_options(["-s", "push"]), rows=rows)
+        macros = solve_map("rows", parse_search_options(["-s", "push", "--macros"]), rows=rows)
+        self.assertEqual(macros["status"], "solved", macros.get("error"))
+        self.assertLess(macros["nodes"], plain["nodes"])
+        self.assertTrue(replays(rows, macros["moves"]))
+
+    def test_goal_room(self):
+        map = SokobanMap(rows=GOAL_ROOM).build_state().map
+        map.find_goal_room()
+        self.assertGreaterEqual(map.entrance, 0)
+        self.assertEqual(len(map.fill_order), 3)
+        self.check_macros(GOAL_ROOM)
+
+    def test_tunnels(self):
+        self.check_macros(TUNNELS)
+
+
+if __name__ == "__main__":
+    unittest.main()
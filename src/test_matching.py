@@ -0,0 +1,51 @@
+import glob
+import itertools
+import os
+import random
+import unittest
+
+from main import MatchingHeuristic, SokobanMap, bits
+
+
+MAPS = os.path.join(os.path.dirname(__file__), "maps")
+
+
+def brute_force(state) -> float:
+    """
+    Cheapest assignment of the boxes to the shelves, trying every permutation.
+    """
+    distance = state.map.push_distance
+    boxes = list(bits(state.boxes))
+    return min(
+        sum(distance[box][shelf] for box, shelf in zip(boxes, shelves))
+        for shelves in itertools.permutations(range(len(state.map.shelf_cells)), len(boxes))
+    )
+
+
+class MatchingHeuristicTest(unittest.TestCase):
+    def test_incremental_matches_fresh(self):
+        """
+        Walk at random with pushes: the assignment repaired from the parent must cost the same
+        as one solved from scratch, and as every permutation on the maps with few boxes.
+        """
+        rng = random.Random(0)
+        for path in sorted(glob.glob(os.path.join(MAPS, "*.txt"))):
+            with self.subTest(map=os.path.basename(path)):
+                state = SokobanMap(path).build_state()
+                incremental = MatchingHeuristic()
+                small = len(state.map.shelf_cells) <= 6
+                incremental(state)
+                for _ in range(100):
+                    children = [child for _, child in state.generate_possible_pushes()]
+                    if not children:
+                        break
+                    for child in children:
+                        h = incremental(child, state)
+                        self.assertEqual(h, MatchingHeuristic()(child))
+                        if small:
+                            self.assertEqual(h, brute_force(child))
+                    state = rng.choice(children)
+
+
+if __name__ == "__main__":
+    unittest.main()
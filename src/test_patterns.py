@@ -0,0 +1,45 @@
+import os
+import tempfile
+import unittest
+
+from main import PatternStore, parse_search_options, solve_map
+
+
+MAP_PATH = os.path.join(os.path.dirname(__file__), "maps", "micro1.txt")
+
+
+class PatternStoreTest(unittest.TestCase):
+    def test_learned_patterns_prune(self):
+        """
+        A* learns deadlock patterns on micro1 that the other rules miss, and visits fewer nodes
+        with them. The patterns are saved and loaded again by the next run.
+        """
+        plain = solve_map(MAP_PATH, parse_search_options(["-s", "astar"]))
+        with tempfile.TemporaryDirectory() as directory:
+            store_path = os.path.join(directory, "patterns.json")
+            options = parse_search_options(["-s", "astar", "--patterns", store_path])
+            learned = solve_map(MAP_PATH, options)
+            self.assertEqual(learned["status"], "solved", learned.get("error"))
+            self.assertLess(learned["nodes"], plain["nodes"])
+            self.assertEqual(len(learned["moves"]), len(plain["moves"]))
+
+            self.assertEqual(
+                list(PatternStore(store_path).patterns), list(options["patterns"].patterns)
+            )
+            self.assertGreater(len(options["patterns"].patterns), 0)
+            self.assertEqual(os.listdir(directory), ["patterns.json"])
+
+    def test_save_error(self):
+        """
+        A store that can not be written does not turn a solved level into an error.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            store_path = os.path.join(directory, "missing", "patterns.json")
+            options = parse_search_options(["-s", "push", "--patterns", store_path])
+            result = solve_map(MAP_PATH, options)
+            self.assertEqual(result["status"], "solved", result.get("error"))
+            self.assertIn("patterns_error", result)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,71 @@
+import os
+import unittest
+
+from main import (
+    Node,
+    SokobanMap,
+    StateTable,
+    TranspositionTable,
+    build_tree,
+    parse_search_options,
+)
+
+
+MAPS = os.path.join(os.path.dirname(__file__), "maps")
+
+
+def node_with_g(state, g: int) -> Node:
+    node = Node(state)
+    node.g = g
+    return node
+
+
+class StateTableTest(unittest.TestCase):
+    def test_best_g(self):
+        """
+        A table keeps the lowest g of each state, a node is in it unless its g is lower.
+        """
+        state = SokobanMap(os.path.join(MAPS, "micro1.txt")).build_state()
+        for table in [StateTable(), TranspositionTable(state.map, 1 << 20)]:
+            with self.subTest(table=type(table).__name__):
+                self.assertIsNone(table.best_g(node_with_g(state, 5)))
+                table.add(node_with_g(state, 5))
+                self.assertEqual(table.best_g(node_with_g(state, 0)), 5)
+                self.assertNotIn(node_with_g(state, 3), table)
+                table.add(node_with_g(state, 3))
+                table.add(node_with_g(state, 7))
+                self.assertEqual(table.best_g(node_with_g(state, 0)), 3)
+                self.assertIn(node_with_g(state, 3), table)
+                self.assertIn(node_with_g(state, 7), table)
+
+    def test_stale_entries_skipped(self):
+        """
+        A state queued again with a lower g leaves its old entry in the open queue. The search
+        must skip that entry when it is popped: no state is expanded twice unless its g dropped.
+        """
+        for map_name, argv in [
+            ("micro1.txt", ["-s", "astar"]),
+            ("mini12.txt", ["-s", "astar", "--heuristic", "combined"]),
+            ("micro2.txt", ["-s", "push"]),
+        ]:
+            with self.subTest(map=map_name, options=argv):
+                map = SokobanMap(os.path.join(MAPS, map_name))
+                tree = build_tree(
+                    map.build_state(), map, parse_search_options(argv), print_progress=False
+                )
+                expanded: dict[int, int] = {}
+                generate_children = tree.generate_children
+
+                def record(node, state):
+                    if node.key in expanded:
+                        self.assertLess(node.g, expanded[node.key])
+                    expanded[node.key] = node.g
+                    return generate_children(node, state)
+
+                tree.generate_children = record
+                self.assertIsNotNone(tree.search())
+                self.assertGreater(tree.duplicates, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
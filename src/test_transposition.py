@@ -0,0 +1,32 @@
+import os
+import unittest
+
+from main import parse_search_options, solve_map
+
+
+MAPS = os.path.join(os.path.dirname(__file__), "maps")
+
+
+def solve(map_name: str, argv: list[str]) -> dict:
+    path = os.path.join(MAPS, map_name)
+    return solve_map(path, parse_search_options(["-p", path, "-t", "60"] + argv))
+
+
+class TranspositionTableTest(unittest.TestCase):
+    def test_enough_memory(self):
+        result = solve("micro2.txt", ["-s", "astar", "--max-memory", "4"])
+        self.assertEqual(result["status"], "solved", result.get("error"))
+        self.assertEqual(len(result["moves"]), len(solve("micro2.txt", ["-s", "astar"])["moves"]))
+
+    def test_too_little_memory(self):
+        """
+        A* needs more than 1 megabyte on micro19. It used to forget and expand the same states
+        again until the time limit, now it stops with an error.
+        """
+        result = solve("micro19.txt", ["-s", "astar", "--max-memory", "1"])
+        self.assertEqual(result["status"], "error")
+        self.assertIn("--max-memory is too small", result["error"])
+
+
+if __name__ == "__main__":
+    unittest.main()
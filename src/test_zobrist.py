@@ -0,0 +1,43 @@
+import glob
+import os
+import random
+import unittest
+
+from main import MOVES, SokobanMap
+
+
+MAPS = os.path.join(os.path.dirname(__file__), "maps")
+
+
+class ZobristHashTest(unittest.TestCase):
+    def test_incremental_hash(self):
+        """
+        Walk at random with moves, pushes, macro pushes and pulls: the hash derived from the
+        parent must always equal the hash computed from scratch.
+        """
+        rng = random.Random(0)
+        for path in sorted(glob.glob(os.path.join(MAPS, "*.txt"))):
+            with self.subTest(map=os.path.basename(path)):
+                state = SokobanMap(path).build_state()
+                map = state.map
+                for _ in range(300):
+                    successors = [
+                        new_state
+                        for new_state in (state.next_state(move) for move in MOVES)
+                        if new_state is not None
+                    ]
+                    for generate in [
+                        state.generate_possible_pushes,
+                        state.generate_macro_pushes,
+                        state.generate_possible_pulls,
+                    ]:
+                        successors += [new_state for _, new_state in generate()]
+                    for new_state in successors:
+                        self.assertEqual(
+                            new_state.hash, map.hash_of(new_state.hero, new_state.boxes)
+                        )
+                    state = rng.choice(successors)
+
+
+if __name__ == "__main__":
+    unittest.main()